@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+复权 - 不复权日线 + 除权除息事件表，按需向量化推出前复权 / 后复权
+1. 事件表: 每次除权除息一行 (除权日, scale, offset)，表示除权日之前的价格 p 折算成 p * scale + offset
+   - 现金分红 c 元/股、送转 s 股/股: scale = 1 / (1 + s)，offset = -c / (1 + s) (交易所除权参考价公式)
+2. 前复权: 按时间顺序把每个事件作用到它之前的全部 K 线；后复权: 从最新的事件往回，把逆变换作用到除权日及之后的 K 线
+   - 每个事件一次 searchsorted 切出受影响的前缀/后缀，整段乘加 (事件通常只有几十个)，结果按东方财富口径四舍五入到分
+3. 只改价格列 (开高低收与昨收)，成交量/成交额/换手率不复权；没有事件时原样返回，不拷贝
+4. 不复权历史永远不会被改写，可一直缓存；新的除权事件只追加到这只股票的事件表
+"""
+
+import numpy as np
+
+FACTOR_DTYPE = np.dtype([('date', '<i4'), ('scale', '<f8'), ('offset', '<f8')])
+ADJUST_FIELDS = ('open', 'close', 'high', 'low', 'preclose')
+ADJUST_KINDS = ('qfq', 'hfq', '')
+
+# akshare stock_fhps_detail_em 列: 每 10 股送转 / 每 10 股派现 (元)
+DIVIDEND_COLUMNS = {'除权除息日': 'date', '送转股份-送转总比例': 'bonus', '现金分红-现金分红比例': 'cash'}
+
+
+def events_from_dividends(df, until=None):
+    """分红送转明细 (akshare 原始中文列) -> 事件表；未到除权日 (或晚于 until) 的预案不算"""
+    import pandas as pd
+    from store import dates_to_int
+    if df is None or df.empty: return np.empty(0, dtype=FACTOR_DTYPE)
+    df = df.rename(columns=DIVIDEND_COLUMNS)
+    df = df[pd.to_datetime(df['date'], errors='coerce').notna()]
+    if df.empty: return np.empty(0, dtype=FACTOR_DTYPE)
+    date = dates_to_int(pd.to_datetime(df['date']))
+    bonus = pd.to_numeric(df.get('bonus'), errors='coerce').fillna(0).to_numpy(dtype=float) / 10
+    cash = pd.to_numeric(df.get('cash'), errors='coerce').fillna(0).to_numpy(dtype=float) / 10
+    keep = (bonus != 0) | (cash != 0)
+    if until is not None: keep &= date <= until
+    events = np.empty(int(keep.sum()), dtype=FACTOR_DTYPE)
+    events['date'] = date[keep]
+    events['scale'] = 1 / (1 + bonus[keep])
+    events['offset'] = -cash[keep] / (1 + bonus[keep])
+    return merge_events(events)
+
+
+def merge_events(events):
+    """按日期排序，同一天的多条合成一条 (先作用的在前)"""
+    events = np.sort(np.asarray(events, dtype=FACTOR_DTYPE), order='date', kind='stable')
+    if len(events) < 2 or np.all(np.diff(events['date']) > 0): return events
+    out = []
+    for e in events:
+        if out and out[-1]['date'] == e['date']:
+            a, b = out[-1]['scale'], out[-1]['offset']
+            out[-1] = (e['date'], e['scale'] * a, e['scale'] * b + e['offset'])
+        else:
+            out.append(e.copy())
+    return np.array(out, dtype=FACTOR_DTYPE)
+
+
+def adjust_bars(bars, events, kind='qfq', decimals=2):
+    """不复权结构化数组 + 事件表 -> 复权后的结构化数组 (kind: 'qfq' / 'hfq' / '' 不复权)"""
+    if kind not in ADJUST_KINDS: raise ValueError(f"未知复权方式: {kind}")
+    if not kind or events is None or not len(events) or not len(bars): return bars
+    # 第 i 个事件作用于 [0, cut[i]) 这些 K 线 (除权日之前)
+    cut = np.searchsorted(bars['date'], events['date'], side='left')
+    touched = cut > 0 if kind == 'qfq' else cut < len(bars)
+    if not touched.any(): return bars
+    fields = [f for f in ADJUST_FIELDS if f in bars.dtype.names]
+    x = np.column_stack([np.asarray(bars[f], dtype=np.float64) for f in fields])
+    if kind == 'qfq':
+        # 按时间顺序逐个事件折算到最新口径
+        for k, a, b in zip(cut, events['scale'], events['offset']):
+            x[:k] = x[:k] * a + b
+        lo, hi = 0, int(cut.max())
+    else:
+        # 从最新的事件往回逐个取逆，折算到上市首日口径
+        for k, a, b in zip(cut[::-1], events['scale'][::-1], events['offset'][::-1]):
+            x[k:] = (x[k:] - b) / a
+        lo, hi = int(cut.min()), len(bars)
+    out = np.array(bars)
+    # 不受任何事件影响的 K 线保持原值，避免无谓的舍入
+    for j, f in enumerate(fields):
+        out[f][lo:hi] = np.round(x[lo:hi, j], decimals)
+    return out
+
+
+def exrights(prev_close, preclose, tol=0.005):
+    """昨收 (交易所除权参考价) 与上一根收盘对不上 => 当天除权除息；NaN 视为没有信息"""
+    with np.errstate(invalid='ignore'):
+        return np.abs(np.asarray(preclose, dtype=float) - np.asarray(prev_close, dtype=float)) > tol
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+历史回测 (walk-forward) - 整段面板一次向量化算出每根 K 线的指标/形态/得分，再逐日按选股规则模拟交易
+1. 指标、形态、打分规则都是因果算子 (只用当根及以前的数据)，第 t 根的得分就是第 t 天收盘后扫描得到的得分
+2. 逐日选股: 当天得分 ≥ 门槛且满足当时可知的过滤条件 (现价、换手率)，按分数取前 top_n (同分按代码顺序)
+3. 交易模拟: 次日开盘买入；止损 = 收盘 - 2ATR，止盈 = 收盘 + 3ATR (与选股结果同一口径)，最多持有 hold 天
+   - 跳空越过止损/止盈按开盘价成交；同一天两者都触及按止损算 (保守)；到期按收盘卖出
+4. 统计: 各持有期远期收益/胜率 (对比同期全市场)、止损/止盈/到期占比、分数分层、逐条规则与形态的远期收益
+5. 按股票分块计算，内存只与块大小有关
+说明: 历史市盈率/市净率拿不到，只能用当前快照 (有前视偏差)；ST 名称同理；舆情不参与回测
+
+用法:
+    python backtest.py --store price_store --start 20230701 --end 20240628
+    python backtest.py --provider replay --replay-dir replay --warm --days 800
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+
+import rules
+from instrument import RunReport
+from store import PriceStore, last_trading_day
+from market import MarketData
+from main import IndicatorEngine, KLineStrictLib, AlphaGalaxyOmni
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume', 'turnover')
+HORIZONS = (1, 5, 10, 20)
+# 分数分层边界 (全市场每根 K 线按得分分组，看得分与远期收益是否单调)
+SCORE_BUCKETS = (0, 20, 35, 50, 65, 80, 100)
+# 打分规则的因子名 -> panel_series 的序列名 (其余同名)
+STRATEGY_SERIES = {'pct_0': 'pct', 'macd_dif': 'dif', 'macd_dea': 'dea', 'cmf_0': 'cmf'}
+EXIT_REASONS = ('持有中', '止损', '止盈', '到期')
+
+
+def _lead(x, k):
+    """x 向前取 k 根 (第 t 列为第 t+k 根)，越过末尾为 NaN"""
+    out = np.full_like(x, np.nan)
+    if k < x.shape[1]: out[:, :x.shape[1] - k] = x[:, k:]
+    return out
+
+
+def _at(x, rows, cols):
+    out = np.full(len(rows), np.nan)
+    ok = cols < x.shape[1]
+    out[ok] = x[rows[ok], cols[ok]]
+    return out
+
+
+def _fields(df):
+    """日线里实际有的面板字段 (旧仓库/回放数据可能没有换手率)"""
+    names = df.dtype.names if hasattr(df, 'dtype') else df.keys()
+    return [f for f in FIELDS if f in names]
+
+
+def market(frames):
+    """[(代码, 日线)] 或 MarketData -> MarketData (日线里有换手率就一起带上)"""
+    if isinstance(frames, MarketData): return frames
+    return MarketData.from_frames(frames, _fields(frames[0][1]) if frames else FIELDS[:5])
+
+
+def iter_panels(frames, fundamentals=None, chunk=500):
+    """按块产出 (起始序号, 面板, pe, pb)；先剔除排除板块与空数据的股票，面板只在块内从紧凑容器展开"""
+    fundamentals = fundamentals or {}
+    md = market(frames)
+    rows = [i for i, (s, n) in enumerate(zip(md.symbols, md.lengths))
+            if s and not s.startswith(AlphaGalaxyOmni.EXCLUDED_PREFIX) and n]
+    for i in range(0, len(rows), chunk):
+        panel = md.panel(rows[i:i + chunk])
+        pe = [fundamentals.get(s, (np.nan, np.nan))[0] for s in panel['symbols']]
+        pb = [fundamentals.get(s, (np.nan, np.nan))[1] for s in panel['symbols']]
+        yield i, panel, pe, pb
+
+
+def signal_factors(panel, pe=None, pb=None):
+    """面板上每根 K 线的打分因子 -> ({因子名: 二维数组}, 形态得分, 形态位掩码, 指标序列)；与参数无关，可缓存"""
+    o, h, l, c, v = (panel[k] for k in ('open', 'high', 'low', 'close', 'volume'))
+    shape = c.shape
+    S = IndicatorEngine.panel_series(h, l, c, v)
+    bits, k_score = KLineStrictLib.detect_panel(o, h, l, c, v, S['ma5'], S['ma10'], S['ma20'])
+    per_symbol = lambda x: np.broadcast_to(np.full(shape[0], np.nan) if x is None else np.asarray(x, dtype=float)[:, None], shape)
+    env = {k: S[STRATEGY_SERIES.get(k, k)] for k in rules.STRATEGY_INPUTS if STRATEGY_SERIES.get(k, k) in S}
+    env.update(pe=per_symbol(pe), pb=per_symbol(pb), turnover=panel.get('turnover', np.full(shape, np.nan)),
+               risk=(bits & KLineStrictLib.RISK_MASK) != 0)
+    return env, k_score, bits, S
+
+
+def signal_panel(panel, pe=None, pb=None, params=rules.DEFAULT):
+    """面板上每根 K 线的 (总分, 规则位掩码, 形态位掩码, 指标序列)；pe/pb 为每只股票一个值，缺省为 NaN"""
+    env, k_score, bits, S = signal_factors(panel, pe, pb)
+    shape = k_score.shape
+    score, rule_bits = AlphaGalaxyOmni._strategy({k: np.ravel(x) for k, x in env.items()}, params)
+    score = score.reshape(shape) + np.maximum(k_score, 0)
+    return score, rule_bits.reshape(shape), bits, S
+
+
+def eligible_mask(panel, pe, start=None, end=None):
+    """当时可知的过滤: 历史够 60 根、现价、换手率 (仓库里有换手率才过滤)、非亏损股，且在回测区间内"""
+    c, d = panel['close'], panel['date']
+    turnover = panel.get('turnover', np.full(c.shape, np.nan))
+    lo, hi = AlphaGalaxyOmni.TURNOVER_RANGE
+    eligible = (np.cumsum(~np.isnan(c), axis=1) >= 60) & (c > AlphaGalaxyOmni.MIN_PRICE)
+    eligible &= np.isnan(turnover) | ((turnover > lo) & (turnover < hi))
+    eligible &= ~(np.asarray(pe, dtype=float) < 0)[:, None]  # 亏损股 (无估值数据时不过滤)
+    if start: eligible &= d >= start
+    if end: eligible &= d <= end
+    return eligible
+
+
+def simulate(panel, atr, rows, cols, hold):
+    """候选 (rows, cols): 次日开盘买入，逐日检查止损/止盈，最多持有 hold 天"""
+    o, h, l, c = (panel[k] for k in ('open', 'high', 'low', 'close'))
+    entry = _at(o, rows, cols + 1)
+    stop = c[rows, cols] - 2 * atr[rows, cols]
+    take = c[rows, cols] + 3 * atr[rows, cols]
+    exit_px = np.full(len(rows), np.nan)
+    reason = np.zeros(len(rows), dtype=np.int8)
+    days = np.zeros(len(rows), dtype=np.int16)
+    for k in range(1, hold + 1):
+        ok, hk, lk, ck = (_at(x, rows, cols + k) for x in (o, h, l, c))
+        live = (reason == 0) & ~np.isnan(entry) & ~np.isnan(ck)
+        hit_stop = live & (lk <= stop)
+        hit_take = live & ~hit_stop & (hk >= take)
+        expire = live & ~hit_stop & ~hit_take & (k == hold)
+        exit_px = np.where(hit_stop, np.minimum(ok, stop), exit_px)
+        exit_px = np.where(hit_take, np.maximum(ok, take), exit_px)
+        exit_px = np.where(expire, ck, exit_px)
+        reason[hit_stop], reason[hit_take], reason[expire] = 1, 2, 3
+        days[hit_stop | hit_take | expire] = k
+    return {'买入价': entry, '止损价': stop, '止盈价': take, '卖出价': exit_px,
+            '出场': np.array(EXIT_REASONS)[reason], '持有天数': days, '收益%': (exit_px / entry - 1) * 100}
+
+
+class _Tally:
+    """分组累加 (样本数, 收益和, 上涨数)，各块算完直接相加"""
+
+    def __init__(self):
+        self.d = {}
+
+    def add(self, key, r):
+        r = r[~np.isnan(r)]
+        n, s, w = self.d.get(key, (0, 0.0, 0))
+        self.d[key] = (n + len(r), s + float(r.sum()), w + int((r > 0).sum()))
+
+    def row(self, key):
+        n, s, w = self.d.get(key, (0, 0.0, 0))
+        return {'样本数': n, '平均收益%': round(s / n * 100, 3) if n else np.nan, '胜率%': round(w / n * 100, 2) if n else np.nan}
+
+
+class Backtest:
+    def __init__(self, start=None, end=None, top_n=30, hold=20, horizons=HORIZONS, chunk=500, report=None, params=None):
+        self.start, self.end = start, end
+        self.top_n = top_n
+        self.hold = hold
+        self.horizons = tuple(horizons)
+        self.chunk = chunk
+        self.report = report or RunReport()
+        self.params = params or rules.DEFAULT
+        self.threshold = self.params.threshold
+
+    def run(self, frames, fundamentals=None):
+        """frames: market.MarketData，或 [(代码, 日线)] (日线为 PriceStore 结构化数组或 {列: ndarray}，日期为 yyyymmdd 整数)
+        fundamentals: {代码: (pe, pb)}，来自当前快照；返回汇总字典，逐笔交易在 self.trades"""
+        self.universe = _Tally()
+        self.buckets, self.rule_stats, self.pattern_stats = _Tally(), _Tally(), _Tally()
+        self.days, picks = set(), []
+        for i, panel, pe, pb in self.report.timed('panel', iter_panels(frames, fundamentals, self.chunk)):
+            picks.append(self._chunk(panel, pe, pb, i))
+        with self.report.stage('select'):
+            trades = pd.concat(picks, ignore_index=True) if picks else pd.DataFrame()
+            if len(trades):
+                trades = trades.sort_values(['日期', '得分', '_order'], ascending=[True, False, True])
+                n = len(trades)
+                trades = trades.groupby('日期', sort=False).head(self.top_n)
+                self.report.drop('top_cut', n - len(trades), len(trades))
+            self.trades = trades.drop(columns='_order').reset_index(drop=True) if len(trades) else trades
+        return self.summary()
+
+    def _chunk(self, panel, pe, pb, offset):
+        c, d = panel['close'], panel['date']
+        with self.report.stage('scoring'):
+            score, rule_bits, bits, S = signal_panel(panel, pe, pb, self.params)
+        with self.report.stage('simulate'):
+            eligible = eligible_mask(panel, pe, self.start, self.end)
+            self.days.update(np.unique(d[eligible]).tolist())
+
+            # 全市场基准与分层: 每根合格 K 线次日开盘买入的远期收益
+            entry = _lead(panel['open'], 1)
+            fwd = {k: _lead(c, k) / entry - 1 for k in self.horizons}
+            key_h = self.horizons[-1]
+            for k in self.horizons:
+                self.universe.add(k, fwd[k][eligible])
+            bucket = np.digitize(score, SCORE_BUCKETS[1:-1])
+            for b in range(len(SCORE_BUCKETS) - 1):
+                self.buckets.add(b, fwd[key_h][eligible & (bucket == b)])
+            for i, _ in enumerate(rules.STRATEGY):
+                self.rule_stats.add(i, fwd[key_h][eligible & ((rule_bits >> i & 1) == 1)])
+            for i, _ in enumerate(KLineStrictLib.PATTERNS):
+                self.pattern_stats.add(i, fwd[key_h][eligible & ((bits >> i & 1) == 1)])
+
+            rows, cols = np.nonzero(eligible & (score >= self.threshold))
+            self.report.drop('below_threshold', int(eligible.sum()) - len(rows))
+            out = simulate(panel, S['atr'], rows, cols, self.hold)
+            out.update({f'{k}日收益%': fwd[k][rows, cols] * 100 for k in self.horizons})
+        symbols = panel['symbols']
+        tags = [' '.join(r.tag or r.name for i, r in enumerate(rules.STRATEGY) if rb >> i & 1) for rb in rule_bits[rows, cols]]
+        pats = [' | '.join(buy + risk) for _, buy, risk in map(KLineStrictLib.decode, bits[rows, cols])]
+        return pd.DataFrame({
+            '日期': d[rows, cols], '代码': [symbols[r] for r in rows], '得分': score[rows, cols], '_order': rows + offset,
+            '收盘': c[rows, cols], **out, '得分详情': tags, '形态': pats,
+        })
+
+    def summary(self):
+        t = self.trades
+        closed = t[t['出场'] != EXIT_REASONS[0]] if len(t) else t
+        out = {
+            '回测区间': f"{min(self.days, default='-')} ~ {max(self.days, default='-')}",
+            '交易日数': len(self.days), '门槛': self.threshold, '每日最多': self.top_n, '最长持有天数': self.hold,
+            '入选笔数': len(t), '日均入选': round(len(t) / len(self.days), 2) if self.days else 0,
+            '已平仓笔数': len(closed),
+        }
+        if len(closed):
+            r = closed['收益%']
+            gain, loss = r[r > 0].sum(), -r[r < 0].sum()
+            out.update({'平均收益%': round(float(r.mean()), 3), '胜率%': round(float((r > 0).mean()) * 100, 2),
+                        '盈亏比': round(float(gain / loss), 3) if loss else float('inf'),
+                        '平均持有天数': round(float(closed['持有天数'].mean()), 2)})
+        horizons = []
+        for k in self.horizons:
+            col = t[f'{k}日收益%'].dropna() / 100 if len(t) else pd.Series(dtype=float)
+            base = self.universe.row(k)
+            mean = col.mean() * 100 if len(col) else np.nan
+            horizons.append({'持有期': f'{k}日', '样本数': len(col), '平均收益%': round(mean, 3),
+                             '中位数%': round(col.median() * 100, 3) if len(col) else np.nan,
+                             '胜率%': round((col > 0).mean() * 100, 2) if len(col) else np.nan,
+                             '全市场平均%': base['平均收益%'], '全市场胜率%': base['胜率%'],
+                             '超额%': round(mean - base['平均收益%'], 3) if len(col) else np.nan})
+        exits = []
+        for name in EXIT_REASONS:
+            g = t[t['出场'] == name] if len(t) else t
+            exits.append({'出场': name, '笔数': len(g), '占比%': round(len(g) / len(t) * 100, 2) if len(t) else np.nan,
+                          '平均收益%': round(g['收益%'].mean(), 3) if len(g) else np.nan,
+                          '平均持有天数': round(g['持有天数'].mean(), 2) if len(g) and name != EXIT_REASONS[0] else np.nan})
+        key = f'{self.horizons[-1]}日'
+        buckets = [{'得分区间': f"[{lo}, {hi})", **self.buckets.row(b)}
+                   for b, (lo, hi) in enumerate(zip(SCORE_BUCKETS[:-1], SCORE_BUCKETS[1:]))]
+        buckets[0]['得分区间'], buckets[-1]['得分区间'] = f"< {SCORE_BUCKETS[1]}", f">= {SCORE_BUCKETS[-2]}"
+        contrib = [{'类型': '规则', '名称': r.name, '分值': r.weight, **self.rule_stats.row(i)} for i, r in enumerate(rules.STRATEGY)]
+        contrib += [{'类型': '形态', '名称': n, '分值': w, **self.pattern_stats.row(i)} for i, (n, w) in enumerate(KLineStrictLib.PATTERNS)]
+        self.tables = {'持有期收益': pd.DataFrame(horizons), '出场统计': pd.DataFrame(exits),
+                       f'分数分层({key})': pd.DataFrame(buckets), f'规则贡献({key})': pd.DataFrame(contrib)}
+        return out
+
+    def save(self, filename, info):
+        with pd.ExcelWriter(filename, engine='openpyxl') as writer:
+            pd.DataFrame(list(info.items()), columns=['项目', '数值']).to_excel(writer, sheet_name='回测汇总', index=False)
+            for name, df in self.tables.items():
+                df.to_excel(writer, sheet_name=name, index=False)
+            self.trades.round(3).to_excel(writer, sheet_name='交易明细', index=False)
+        return filename
+
+
+def load_store(store, symbols=None):
+    """本地仓库 -> MarketData (逐只 mmap 读出、按仓库的复权方式现推后压进紧凑容器)，不发请求"""
+    symbols = symbols if symbols is not None else store.symbols()
+    return MarketData.from_frames(((s, bars) for s in symbols for bars in [store.adjusted(s)] if len(bars)), FIELDS)
+
+
+if __name__ == "__main__":
+    from providers import make_provider
+    parser = argparse.ArgumentParser(description='打分策略历史回测')
+    parser.add_argument('--store', default='price_store', help='本地行情仓库目录')
+    parser.add_argument('--start', type=int, help='回测起始日 yyyymmdd (默认仓库里够 60 根历史的第一天)')
+    parser.add_argument('--end', type=int, help='回测结束日 yyyymmdd (默认最后一天)')
+    parser.add_argument('--top-n', type=int, default=30, help='每天最多入选多少只')
+    parser.add_argument('--hold', type=int, default=20, help='最长持有天数')
+    parser.add_argument('--chunk', type=int, default=500, help='每块股票数')
+    parser.add_argument('--provider', choices=['akshare', 'replay'], help='取当前快照 (名称/市盈率/市净率)，--warm 时也用来灌库')
+    parser.add_argument('--replay-dir', help='回放数据目录 (--provider replay)')
+    parser.add_argument('--warm', action='store_true', help='先用数据源把快照里的股票灌进仓库')
+    parser.add_argument('--days', type=int, default=800, help='--warm 灌库的自然日数')
+    parser.add_argument('--params', help='打分参数 JSON (同 main.py --params)')
+    parser.add_argument('--out', default=None, help='输出 xlsx (默认 Backtest_<结束日>.xlsx)')
+    args = parser.parse_args()
+
+    report = RunReport()
+    provider = make_provider(args.provider, args.replay_dir) if args.provider else None
+    store = PriceStore(args.store, fetch=provider.history if provider else None, factors=provider.factors if provider else None)
+    symbols, fundamentals = None, {}
+    if provider:
+        with report.stage('snapshot'):
+            spot = provider.spot()
+            for col in ['市盈率-动态', '市净率']:
+                spot[col] = pd.to_numeric(spot[col], errors='coerce')
+            spot = spot[~spot['名称'].str.contains('ST|退')]
+            symbols = spot['代码'].tolist()
+            fundamentals = dict(zip(spot['代码'], zip(spot['市盈率-动态'], spot['市净率'])))
+        if args.warm:
+            with report.stage('warm'):
+                # 交易日按数据源的时钟 (回放数据停在录制那天，按墙钟取窗口会整段落空)
+                loaded = store.bulk_load(symbols, days=args.days, today=last_trading_day(provider.now()))
+            print(f"灌库: {loaded}/{len(symbols)} 只")
+    with report.stage('load'):
+        frames = load_store(store, symbols)
+    if not len(frames.symbols):
+        raise SystemExit(f"仓库 {args.store} 里没有可回测的股票 (先加 --provider ... --warm 灌库，或检查数据源)")
+    bt = Backtest(args.start, args.end, top_n=args.top_n, hold=args.hold, chunk=args.chunk, report=report,
+                  params=rules.load_params(args.params) if args.params else None)
+    info = bt.run(frames, fundamentals)
+    info['估值数据'] = '当前快照 (有前视偏差)' if fundamentals else '无 (估值规则不生效)'
+    report.info.update(info)
+    stem = args.out[:-5] if args.out and args.out.endswith('.xlsx') else (args.out or f"Backtest_{max(bt.days, default=0)}")
+    with report.stage('export'):
+        bt.save(f"{stem}.xlsx", info)
+    report.save(f"{stem}.json")
+    for k, v in info.items(): print(f"{k}: {v}")
+    print(bt.tables['持有期收益'].to_string(index=False))
+    print(bt.tables['出场统计'].to_string(index=False))
+    print(f"   环节耗时: {report.summary()}")
+    print(f"✅ 回测报告已保存至: {stem}.xlsx")
@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+"""
+基准测试 - 合成全市场，逐环节计时
+1. 合成 N 只 × M 天日线: 跳空、涨跌停 (含一字板)、停牌零成交、停牌缺行、次新股短历史
+2. 合成新闻标题 (利好/利空关键词 + 中性句)，供舆情环节使用
+3. 各环节单独计时: 指标 (逐只/面板)、形态 (逐只/面板)、打分、舆情、Excel 导出、整条流水线、市场环境 (context.py)
+   全市场常驻内存: 逐只 akshare 原样 DataFrame vs 紧凑容器 (market.MarketData)
+4. 输出 只/秒 与 tracemalloc 峰值内存，结果存 JSON，可与基线对比
+   舆情环节另查缓存版打分与整段 SnowNLP 是否一致 (含中英混排标题，SENTIMENT_FIXTURES)
+5. 冷启动: 子进程测 import main / main.py --help 的墙钟时间 (扣掉裸解释器启动)，列出 import main 带进来的重依赖，
+   超出 STARTUP_BUDGET 视同退化
+
+用法:
+    python bench.py --sizes 100 1000 5000 --out bench.json
+    python bench.py --sizes 1000 --baseline bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+import tracemalloc
+import subprocess
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from fetcher import FetchScheduler
+from sentiment import HeadlineCache, soft_sentiment
+
+POS_KW = ['增长', '预增', '突破', '利好', '回购', '获批', '中标', '大涨', '新高']
+NEG_KW = ['立案', '调查', '亏损', '减持', '警示', '违规', '大跌', '退市', '被查']
+NEUTRAL = ['召开股东大会', '发布季度报告', '接受机构调研', '董事会换届', '披露投资者关系活动记录表', '更名公告']
+
+# 冷启动: 名称 -> python 参数 (在仓库目录下运行)；预算为扣掉裸解释器启动后的秒数
+STARTUP_COMMANDS = {
+    'python': ['-c', 'pass'],
+    'import_main': ['-c', 'import main'],
+    'help': ['main.py', '--help'],
+    'score_help': ['main.py', 'score', '--help'],
+}
+STARTUP_BUDGET = {'import_main': 0.5, 'help': 0.5, 'score_help': 0.5}
+# 不该在 import main 时就加载的重依赖
+HEAVY_MODULES = ('pandas', 'akshare', 'snownlp', 'openpyxl', 'pyarrow', 'tqdm')
+
+# 舆情一致性: 缓存版 soft_sentiment 须与 SnowNLP("。".join(标题)) 相同；中英混排的标题首尾会跨句号粘连，专门覆盖
+SENTIMENT_FIXTURES = [
+    ["A股三大指数收涨；沪指涨0.5%", "600519.SH 新高", "Q1 业绩预增 50%-80%"],
+    ["茅台 2024Q3 营收 +15%", "ST 摘帽", "ABC", "DEF 公司公告 GHI", "  空格  ", "", "回购计划"],
+    ["ETF 份额大增", "MSCI 纳入", "减持 5%"],
+]
+SENTIMENT_TOLERANCE = 1e-9
+
+ALL_STAGES = ['indicator', 'indicator_panel', 'pattern', 'pattern_panel', 'score', 'sentiment', 'export', 'pipeline',
+              'market_frames', 'market_compact', 'context']
+
+
+# ==========================================
+# 1. 合成数据
+# ==========================================
+def synth_bars(rng, days, limit=0.10):
+    """单只股票的日线 (英文列)，date 为交易日序号，调用方再映射到日历"""
+    sigma = rng.uniform(0.012, 0.035)
+    r = rng.standard_t(4, days) * sigma / np.sqrt(2) + rng.normal(0.0003, 0.001)
+    # 偶发大事件: 冲击到涨跌停
+    shock = rng.random(days) < 0.01
+    r[shock] = rng.choice([-1, 1], shock.sum()) * limit
+    r = np.clip(r, -limit, limit)
+
+    # 停牌: 若干段零成交 (价格不动)
+    halt = np.zeros(days, dtype=bool)
+    for s in np.flatnonzero(rng.random(days) < 0.003):
+        halt[s:s + rng.integers(1, 8)] = True
+    r[halt] = 0.0
+
+    close = np.round(rng.uniform(3, 80) * np.cumprod(1 + r), 2)
+    prev = np.concatenate([[close[0]], close[:-1]])
+    gap = rng.normal(0, 0.008, days)
+    gap[rng.random(days) < 0.03] *= 4
+    open_ = np.round(np.clip(prev * (1 + gap), prev * (1 - limit), prev * (1 + limit)), 2)
+    hi = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.008, days)))
+    lo = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.008, days)))
+    high = np.round(np.minimum(hi, prev * (1 + limit)), 2)
+    low = np.round(np.maximum(lo, prev * (1 - limit)), 2)
+    high = np.maximum(high, np.maximum(open_, close))
+    low = np.minimum(low, np.minimum(open_, close))
+    # 一字板: 涨停日一部分开高低收全相同
+    board = shock & (rng.random(days) < 0.4)
+    open_[board] = high[board] = low[board] = close[board]
+
+    vol = np.round(np.exp(rng.normal(11, 0.6) + np.cumsum(rng.normal(0, 0.05, days)) * 0.3
+                          + np.abs(r) * 20 + rng.normal(0, 0.35, days)))
+    vol[board] *= 0.2
+    vol[halt] = 0.0
+    open_[halt] = high[halt] = low[halt] = close[halt]
+    return pd.DataFrame({'open': open_, 'close': close, 'high': high, 'low': low, 'volume': np.round(vol)})
+
+
+def synth_universe(n, days=275, seed=0, end=None):
+    """返回 (spot, frames, news)
+    spot: stock_zh_a_spot_em 形状的快照；frames: {代码: 英文列日线}；news: {代码: 标题列表}"""
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(end or '2024-06-28')
+    calendar = pd.bdate_range(end=end, periods=days)
+    spot, frames, news = [], {}, {}
+    for i in range(n):
+        symbol = f"{600000 + i:06d}"
+        # 次新股: 上市晚，历史不足
+        length = days if rng.random() > 0.05 else int(rng.integers(20, days))
+        df = synth_bars(rng, length)
+        dates = calendar[-length:]
+        # 停牌缺行: 接口不返回停牌日
+        keep = rng.random(length) > 0.004
+        keep[-1] = True
+        df = df[keep].reset_index(drop=True)
+        df.insert(0, 'date', dates[keep])
+        frames[symbol] = df
+
+        last = df.iloc[-1]
+        c, v = df['close'].to_numpy(), df['volume'].to_numpy()
+        spot.append({
+            '代码': symbol, '名称': f"合成{i:04d}" if rng.random() > 0.02 else f"ST合成{i:04d}",
+            '最新价': last['close'], '总市值': float(np.exp(rng.normal(24.5, 1.0))),
+            '换手率': float(np.round(np.exp(rng.normal(1.0, 0.8)), 2)),
+            '市盈率-动态': float(np.round(rng.normal(25, 30), 2)), '市净率': float(np.round(np.exp(rng.normal(0.8, 0.6)), 2)),
+            # 以下由最后几根 K 线推出 (不动随机数序列，旧种子生成的数据不变)
+            '涨跌幅': round((c[-1] / c[-2] - 1) * 100, 2) if len(c) > 1 else np.nan,
+            '今开': last['open'], '最高': last['high'], '最低': last['low'], '成交量': last['volume'], '成交额': last['volume'] * last['close'] * 100,
+            '量比': round(v[-1] / v[-6:-1].mean(), 2) if len(v) > 5 and v[-6:-1].mean() > 0 else np.nan,
+            '60日涨跌幅': round((c[-1] / c[-61] - 1) * 100, 2) if len(c) > 60 else np.nan,
+        })
+
+        titles = []
+        for _ in range(int(rng.integers(5, 20))):
+            u = rng.random()
+            kw = rng.choice(POS_KW) if u < 0.3 else rng.choice(NEG_KW) if u < 0.38 else None
+            titles.append(f"合成{i:04d}{kw}{rng.choice(NEUTRAL)}" if kw else f"合成{i:04d}{rng.choice(NEUTRAL)}")
+        news[symbol] = titles
+    return pd.DataFrame(spot), frames, news
+
+
+def akshare_frame(symbol, df):
+    """英文列日线 -> stock_zh_a_hist 原样的 DataFrame (补齐成交额/振幅/涨跌幅/涨跌额/换手率)"""
+    c, h, l, v = df['close'], df['high'], df['low'], df['volume']
+    pc = c.shift()
+    return pd.DataFrame({
+        '日期': df['date'].dt.date, '股票代码': symbol, '开盘': df['open'], '收盘': c, '最高': h, '最低': l,
+        '成交量': v, '成交额': v * c * 100, '振幅': ((h - l) / pc * 100).round(2),
+        '涨跌幅': ((c / pc - 1) * 100).round(2), '涨跌额': (c - pc).round(2), '换手率': (v / 1e5).round(2),
+    })
+
+
+class SyntheticProvider:
+    """内存数据源，接口同 providers.AkshareProvider，返回 akshare 原始中文列"""
+    name = 'synthetic'
+    news_rate = None
+
+    def __init__(self, spot, frames, news, asof=None):
+        self._spot, self._frames, self._news = spot, frames, news
+        last = max(df['date'].iloc[-1] for df in frames.values()) if frames else pd.Timestamp.now()
+        self.asof = asof or (pd.Timestamp(last) + pd.Timedelta(hours=16)).to_pydatetime()
+
+    def now(self):
+        return self.asof
+
+    def spot(self):
+        return self._spot.copy()
+
+    def history(self, symbol, start, end, adjust='qfq'):
+        # 合成日线没有除权事件，各种复权方式都一样
+        df = self._frames.get(symbol)
+        if df is None: return pd.DataFrame()
+        df = df[(df['date'] >= pd.Timestamp(str(start))) & (df['date'] <= pd.Timestamp(str(end)))]
+        return df.rename(columns={'date': '日期', 'open': '开盘', 'close': '收盘', 'high': '最高', 'low': '最低', 'volume': '成交量'}).reset_index(drop=True)
+
+    def factors(self, symbol):
+        return pd.DataFrame()
+
+    def news(self, symbol):
+        titles = self._news.get(symbol, [])
+        return pd.DataFrame({'关键词': symbol, '新闻标题': titles})
+
+
+# ==========================================
+# 2. 计时
+# ==========================================
+def measure(fn, prepare=None, repeat=1, memory=True):
+    """返回 (最快一次的秒数, 峰值内存 MB, fn 的返回值)；prepare 的耗时不计入"""
+    best, out = float('inf'), None
+    for _ in range(repeat):
+        arg = prepare() if prepare else None
+        t0 = time.perf_counter()
+        out = fn(arg) if prepare else fn()
+        best = min(best, time.perf_counter() - t0)
+    peak = None
+    if memory:
+        arg = prepare() if prepare else None
+        tracemalloc.start()
+        fn(arg) if prepare else fn()
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return best, peak, out
+
+
+def _args(row):
+    return (row['代码'], row['名称'], row['市盈率-动态'], row['市净率'], row['换手率'])
+
+
+class Bench:
+    def __init__(self, n, days=275, seed=0, repeat=1, memory=True, sentiment_cap=100, batch_size=500):
+        import main
+        self.main = main
+        self.n, self.days = n, days
+        self.repeat, self.memory = repeat, memory
+        self.sentiment_cap = sentiment_cap
+        self.batch_size = batch_size
+        t0 = time.perf_counter()
+        self.spot, self.frames, self.news = synth_universe(n, days, seed)
+        self.gen_seconds = time.perf_counter() - t0
+        self.items = [(_args(row), self.frames[row['代码']]) for _, row in self.spot.iterrows()]
+        self.items = [(a, df) for a, df in self.items if len(df) >= 60]
+
+    def _copies(self):
+        return [(a, df.copy()) for a, df in self.items]
+
+    def _batches(self):
+        return [self.items[i:i + self.batch_size] for i in range(0, len(self.items), self.batch_size)]
+
+    # ---------- 各环节 ----------
+    def stage_indicator(self):
+        IE = self.main.IndicatorEngine
+        return measure(lambda items: [IE.calculate(df) for _, df in items], self._copies, self.repeat, self.memory)
+
+    def stage_indicator_panel(self):
+        IE = self.main.IndicatorEngine
+
+        def run(_):
+            out = []
+            for batch in self._batches():
+                panel = IE.to_panel([(a[0], df) for a, df in batch])
+                S = IE.panel_series(panel['high'], panel['low'], panel['close'], panel['volume'])
+                out.append(IE.panel_table(S, panel['symbols']))
+            return out
+        return measure(run, lambda: None, self.repeat, self.memory)
+
+    def stage_pattern(self):
+        K = self.main.KLineStrictLib
+        return measure(lambda items: [K.detect(df) for _, df in items], self._copies, self.repeat, self.memory)
+
+    def stage_pattern_panel(self):
+        IE, K = self.main.IndicatorEngine, self.main.KLineStrictLib
+
+        def prepare():
+            out = []
+            for batch in self._batches():
+                panel = IE.to_panel([(a[0], df) for a, df in batch])
+                S = IE.panel_series(panel['high'], panel['low'], panel['close'], panel['volume'])
+                out.append((panel, S))
+            return out
+
+        def run(prepared):
+            return [K.detect_panel(p['open'], p['high'], p['low'], p['close'], p['volume'], S['ma5'], S['ma10'], S['ma20'])
+                    for p, S in prepared]
+        return measure(run, prepare, self.repeat, self.memory)
+
+    def _factors(self):
+        if not hasattr(self, '_fac'):
+            IE, K = self.main.IndicatorEngine, self.main.KLineStrictLib
+            self._fac = []
+            for a, df in self._copies():
+                fac = IE.calculate(df)
+                if fac: self._fac.append((a, fac, K.detect(df)))
+        return self._fac
+
+    def stage_score(self):
+        app = self.main.AlphaGalaxyOmni(store_dir=None, provider=self._provider())
+        facs = self._factors()
+
+        def run(_):
+            out = []
+            for a, fac, pats in facs:
+                res = app.evaluate(a, fac, *pats)
+                if res: out.append(res)
+            return out
+        return measure(run, lambda: None, self.repeat, self.memory)
+
+    def stage_sentiment(self):
+        SE = self.main.SentimentEngine
+        provider = self._provider()
+        symbols = list(self.frames)[:self.sentiment_cap]
+        SE.analyze(symbols[0], provider)  # 预热: SnowNLP 首次调用要加载模型，不算进吞吐
+
+        def cold():
+            # 每轮换一个空缓存，测的是标题全是新的情况
+            SE.cache = HeadlineCache()
+            return FetchScheduler(concurrency=8, max_concurrency=16, rate=1e6)
+        return measure(lambda sched: SE.analyze_many(symbols, provider, sched), cold, self.repeat, self.memory)
+
+    def stage_export(self):
+        rows = self.stage_score()[2] or []
+        df = pd.DataFrame(sorted(rows, key=lambda x: x['总分'], reverse=True)[:30])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.xlsx')
+            with contextlib.redirect_stdout(io.StringIO()):
+                sec, peak, _ = measure(lambda: self.main.ExcelExporter.save(df, path), None, self.repeat, self.memory)
+        return sec, peak, df
+
+    def stage_pipeline(self):
+        def run():
+            app = self.main.AlphaGalaxyOmni(store_dir=None, provider=self._provider(), rate=1e6)
+            with tempfile.TemporaryDirectory() as tmp, _chdir(tmp), \
+                    contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                app.run()
+        return measure(run, None, self.repeat, self.memory)
+
+    def stage_market_frames(self):
+        """全市场按 akshare 原样留逐只 DataFrame (全部中文列，日期/代码为 object)"""
+        return measure(lambda: [akshare_frame(s, df) for s, df in self.frames.items()], None, self.repeat, self.memory)
+
+    def stage_market_compact(self):
+        """全市场压进紧凑容器 (只留 OHLCV，整数编码 + 共用日期轴)"""
+        from market import MarketData
+        IE = self.main.IndicatorEngine
+        return measure(lambda: MarketData.from_frames((s, IE.to_arrays(df)) for s, df in self.frames.items()),
+                       None, self.repeat, self.memory)
+
+    def stage_context(self):
+        """市场环境 (只用快照): 市场状态 + 板块聚合 + 全市场横截面分位"""
+        from context import MarketContext
+        symbols = list(self.spot['代码'])
+        return measure(lambda: MarketContext.build(self.spot, symbols), None, self.repeat, self.memory)
+
+    def _provider(self):
+        return SyntheticProvider(self.spot, self.frames, self.news)
+
+    # 每个环节按多少只股票 (导出按行数) 算吞吐
+    def _count(self, stage, out):
+        if stage == 'sentiment': return min(self.sentiment_cap, self.n)
+        if stage == 'export': return len(out)
+        if stage in ('pipeline', 'context'): return self.n
+        if stage == 'score': return len(self._factors())
+        return len(self.items)
+
+    def run(self, stages):
+        results = []
+        for stage in stages:
+            sec, peak, out = getattr(self, f"stage_{stage}")()
+            count = self._count(stage, out)
+            results.append({
+                'stage': stage, 'n': self.n, 'days': self.days, 'count': count,
+                'seconds': round(sec, 6), 'per_sec': round(count / sec, 2) if sec > 0 else None,
+                'peak_mb': round(peak, 2) if peak is not None else None,
+            })
+            print(f"  {stage:<16} n={self.n:<6} {sec:9.3f}s  {results[-1]['per_sec'] or 0:>10.1f} 只/秒"
+                  + (f"  峰值 {peak:8.1f} MB" if peak is not None else ""))
+        return results
+
+
+@contextlib.contextmanager
+def _chdir(path):
+    old = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(old)
+
+
+def startup(repeat=5, budget=None):
+    """各启动命令的墙钟时间 (取 repeat 次里最快的) + import main 之后已加载的重依赖"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    budget = dict(STARTUP_BUDGET, **(budget or {}))
+    seconds = {}
+    for name, cmd in STARTUP_COMMANDS.items():
+        best = float('inf')
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, *cmd], cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            best = min(best, time.perf_counter() - t0)
+        seconds[name] = best
+    probe = f"import sys, main; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    loaded = subprocess.run([sys.executable, '-c', probe], cwd=root, capture_output=True, text=True, check=True).stdout.split()
+    rows = [{'command': name, 'seconds': round(t, 4), 'net': round(t - seconds['python'], 4), 'budget': budget.get(name)}
+            for name, t in seconds.items()]
+    for r in rows:
+        r['over'] = r['budget'] is not None and r['net'] > r['budget']
+    return {'repeat': repeat, 'results': rows, 'heavy_loaded': loaded}
+
+
+def sentiment_check(extra=()):
+    """SENTIMENT_FIXTURES (+ extra 组标题) 上 soft_sentiment 与整段 SnowNLP 的最大误差"""
+    from snownlp import SnowNLP
+    groups = SENTIMENT_FIXTURES + [list(g) for g in extra]
+    err = max(abs(soft_sentiment(g, HeadlineCache()) - SnowNLP('。'.join(g)).sentiments) for g in groups)
+    return {'groups': len(groups), 'max_error': err, 'ok': err <= SENTIMENT_TOLERANCE}
+
+
+# ==========================================
+# 3. 结果与基线对比
+# ==========================================
+def environment():
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        rev = ''
+    return {
+        'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'git': rev,
+        'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+        'platform': platform.platform(), 'cpus': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance=0.10, floor=0.005):
+    """返回 [(stage, n, 当前秒数, 基线秒数, 倍数, 是否退化)]；绝对差不到 floor 秒的算计时噪声"""
+    base = {(r['stage'], r['n']): r for r in baseline.get('results', [])}
+    rows = []
+    for r in results:
+        b = base.get((r['stage'], r['n']))
+        if not b or not b['seconds']: continue
+        ratio = r['seconds'] / b['seconds']
+        rows.append((r['stage'], r['n'], r['seconds'], b['seconds'], ratio,
+                     ratio > 1 + tolerance and r['seconds'] - b['seconds'] > floor))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='合成全市场基准测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--days', type=int, default=275, help='每只股票的交易日数 (400 自然日约 275 个交易日)')
+    parser.add_argument('--stages', nargs='+', choices=ALL_STAGES, default=ALL_STAGES)
+    parser.add_argument('--repeat', type=int, default=1, help='每个环节重复次数，取最快一次')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='跳过 tracemalloc 峰值测量 (省一半时间)')
+    parser.add_argument('--sentiment-cap', type=int, default=100, help='舆情环节最多测多少只')
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--baseline', help='基线 JSON，逐环节对比')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='慢于基线多少算退化')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--startup-repeat', type=int, default=5, help='冷启动每条命令跑几次，取最快一次 (0 为不测)')
+    parser.add_argument('--startup-budget', type=float, help='冷启动预算 (秒，扣掉裸解释器启动后)，覆盖 STARTUP_BUDGET')
+    args = parser.parse_args(argv)
+
+    start = None
+    if args.startup_repeat:
+        override = {k: args.startup_budget for k in STARTUP_BUDGET} if args.startup_budget is not None else None
+        start = startup(args.startup_repeat, override)
+        print("冷启动 (子进程墙钟，扣掉裸解释器):")
+        for r in start['results']:
+            print(f"  {r['command']:<12} {r['seconds']:7.3f}s  净 {r['net']:7.3f}s" +
+                  (f"  预算 {r['budget']:.2f}s" if r['budget'] is not None else "") + ("  ⚠️ 超预算" if r['over'] else ""))
+        print(f"  import main 已加载的重依赖: {' '.join(start['heavy_loaded']) or '无'}")
+
+    results, check = [], None
+    for n in args.sizes:
+        bench = Bench(n, args.days, args.seed, args.repeat, not args.no_memory, args.sentiment_cap)
+        print(f"合成 {n} 只 × {args.days} 天: {bench.gen_seconds:.2f}s")
+        results += bench.run(args.stages)
+        if 'sentiment' in args.stages and check is None:
+            check = sentiment_check(list(bench.news.values())[:args.sentiment_cap])
+            print(f"舆情一致性 ({check['groups']} 组，对比整段 SnowNLP): 最大误差 {check['max_error']:.2e}" +
+                  ("" if check['ok'] else "  ⚠️ 不一致"))
+
+    report = {'env': environment(), 'config': vars(args), 'results': results, 'startup': start, 'sentiment_check': check}
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存至: {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.tolerance)
+        print(f"\n与基线对比 ({baseline.get('env', {}).get('git', '?')}):")
+        for stage, n, cur, old, ratio, bad in rows:
+            print(f"  {stage:<16} n={n:<6} {old:9.3f}s -> {cur:9.3f}s  x{ratio:5.2f}" + ("  ⚠️ 退化" if bad else ""))
+        if args.fail_on_regression and any(r[-1] for r in rows):
+            return 1
+    if args.fail_on_regression and start and any(r['over'] for r in start['results']):
+        return 1
+    if args.fail_on_regression and check and not check['ok']:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
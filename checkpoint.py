@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+扫描检查点 (RunCheckpoint) - 进程被杀/超时后从断点续跑
+1. 开跑时落盘运行条件 (交易日、数据源、打分参数、打分表格式等) 与候选列表，连同本次的市场环境 (context.MarketContext)
+2. 每算完一批追加一个分片: 这批完成的股票、入围结果、全市场打分表，外加拉取为空/失败的股票
+   - 分片先写临时文件再原子改名，进程中途被杀最多丢掉正在算的几批
+3. 续跑: 读回候选列表与已完成的股票 (算完的 + 确认无数据的)，只重跑失败与缺失的
+4. 运行条件对不上 (跨交易日、换了参数) 的检查点视为过期，整个丢弃后重新开始
+5. 整次运行成功结束后删除检查点；有股票拉取/计算失败时保留，--resume 只重跑失败的 (崩溃续跑与补拉失败走同一条路)
+"""
+
+import os
+import json
+import glob
+import pickle
+import shutil
+from collections import namedtuple
+
+# 续跑状态: 候选列表、可跳过的代码、上次失败的代码、已有入围结果、已写出的打分表、市场环境 (没有为 None)
+Resume = namedtuple('Resume', ['candidates', 'finished', 'failed', 'results', 'tables', 'context'])
+
+
+class RunCheckpoint:
+    """root: 检查点目录；key: 运行条件 (可 JSON 序列化)，续跑时必须完全一致"""
+
+    def __init__(self, root, key):
+        self.root = root
+        # 过一遍 JSON，与读回的 meta 同形 (元组 -> 列表)
+        self.key = json.loads(json.dumps(key))
+        self.parts = 0
+        self.marks = {'empty': [], 'error': []}
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _meta(self):
+        try:
+            with open(self._path('meta.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def stale(self):
+        """有检查点但运行条件对不上时返回其条件 (用于提示)，否则 None"""
+        meta = self._meta()
+        return meta['key'] if meta and meta.get('key') != self.key else None
+
+    def load(self):
+        """读回有效检查点 -> Resume；没有或已过期返回 None。写坏的分片 (被杀时正在写) 直接跳过"""
+        meta = self._meta()
+        if not meta or meta.get('key') != self.key: return None
+        finished, failed, results, tables = set(), set(), [], []
+        paths = sorted(glob.glob(self._path('part_*.pkl')))
+        for path in paths:
+            try:
+                with open(path, 'rb') as f:
+                    part = pickle.load(f)
+            except Exception:
+                continue
+            finished.update(part['done'], part['empty'])
+            failed.update(part['error'])
+            results += part['results']
+            tables += part['tables']
+        self.parts = max((int(os.path.basename(p)[5:10]) for p in paths), default=-1) + 1
+        try:
+            with open(self._path('context.pkl'), 'rb') as f:
+                context = pickle.load(f)
+        except Exception:
+            context = None
+        return Resume([tuple(c) for c in meta['candidates']], finished, failed - finished, results, tables, context)
+
+    def start(self, candidates, context=None):
+        """新开一个检查点 (丢弃旧的)，落盘候选列表与市场环境 (续跑时沿用，不必重拉快照)"""
+        self.discard()
+        os.makedirs(self.root, exist_ok=True)
+        if context is not None:
+            with open(self._path('context.pkl.tmp'), 'wb') as f:
+                pickle.dump(context, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(self._path('context.pkl.tmp'), self._path('context.pkl'))
+        tmp = self._path('meta.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'key': self.key, 'candidates': [list(c) for c in candidates]}, f, ensure_ascii=False)
+        os.replace(tmp, self._path('meta.json'))
+        self.parts = 0
+
+    def mark(self, symbol, status):
+        """拉取为空 ('empty') 或失败 ('error') 的股票，随下一个分片落盘"""
+        self.marks[status].append(symbol)
+
+    def commit(self, done=(), results=(), tables=()):
+        """一批算完: done 为这批全部股票 (含历史太短被剔除的)，与入围结果、打分表一起原子落盘"""
+        done = list(done)
+        if not (done or self.marks['empty'] or self.marks['error']): return
+        part = {'done': done, **self.marks, 'results': list(results), 'tables': list(tables)}
+        path = self._path(f'part_{self.parts:05d}.pkl')
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(part, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        self.parts += 1
+        self.marks = {'empty': [], 'error': []}
+
+    def discard(self):
+        shutil.rmtree(self.root, ignore_errors=True)
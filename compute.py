@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+计算进程池 (ComputePool) - 拉取线程只管 I/O，指标/形态/打分放到多进程里跑满多核
+1. SharedPanel: 一批面板数组打包进一块共享内存，子进程按 (名称, 布局) 直接映射，不经 pickle 传数组
+2. ComputePool: 进程数默认等于 CPU 核数；在途批次有上限 (满了先等任一批完成)，控制内存
+3. ready(): 已完成批次的结果按完成顺序吐出 (带提交时的 tag，调用方据此知道是哪一批)，同时释放对应的共享内存
+"""
+
+import os
+import contextlib
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import shared_memory
+
+ALIGN = 64
+
+
+class SharedPanel:
+    """{键: ndarray} -> 一块共享内存；spec 可 pickle，子进程用 attach(spec) 取回同名数组视图"""
+
+    def __init__(self, arrays):
+        layout, offset = [], 0
+        for k, a in arrays.items():
+            a = np.ascontiguousarray(a)
+            layout.append((k, a.dtype.str, a.shape, offset))
+            offset += -(-a.nbytes // ALIGN) * ALIGN
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for (k, dtype, shape, off), a in zip(layout, arrays.values()):
+            np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=off)[...] = a
+        self.spec = (self.shm.name, layout)
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+@contextlib.contextmanager
+def attach(spec):
+    """映射共享内存里的数组；退出后视图失效，结果需在 with 内拷出"""
+    name, layout = spec
+    # 子进程与主进程共用同一个 resource_tracker，attach 不会导致提前 unlink；释放由创建方负责
+    shm = shared_memory.SharedMemory(name=name)
+    views = {}
+    try:
+        for k, dtype, shape, off in layout:
+            views[k] = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=off)
+        yield views
+    finally:
+        views.clear()
+        shm.close()
+
+
+class ComputePool:
+    """fn(spec, *args) 在子进程里执行，spec 为共享内存面板的描述"""
+
+    def __init__(self, fn, workers=None, max_pending=None, initializer=None, initargs=()):
+        """initializer(*initargs) 在每个子进程启动时执行一次 (交付整次运行共用的只读数据，如市场环境)"""
+        self.fn = fn
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 2
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=initializer, initargs=initargs)
+        self.pending = {}
+        self.finished = deque()
+
+    def _reap(self, futures):
+        for fut in futures:
+            panel, tag = self.pending.pop(fut)
+            panel.release()
+            exc = fut.exception()
+            self.finished.append((None, exc, tag) if exc else (fut.result(), None, tag))
+
+    def submit(self, arrays, *args, tag=None):
+        # 在途批次满了先等一批完成，避免面板无限堆积
+        if len(self.pending) >= self.max_pending:
+            done, _ = wait(list(self.pending), return_when=FIRST_COMPLETED)
+            self._reap(done)
+        panel = SharedPanel(arrays)
+        try:
+            fut = self.executor.submit(self.fn, panel.spec, *args)
+        except Exception:
+            panel.release()
+            raise
+        self.pending[fut] = (panel, tag)
+        return fut
+
+    def ready(self, block=False):
+        """按完成顺序产出 (结果, 异常, tag)；block=True 时等全部批次完成"""
+        self._reap([f for f in self.pending if f.done()])
+        while self.finished or (block and self.pending):
+            if not self.finished:
+                done, _ = wait(list(self.pending), return_when=FIRST_COMPLETED)
+                self._reap(done)
+            yield self.finished.popleft()
+
+    def close(self):
+        for fut in self.pending:
+            fut.cancel()
+        self.executor.shutdown(wait=True)
+        for panel, _ in self.pending.values():
+            panel.release()
+        self.pending.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
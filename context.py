@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+市场环境 (MarketContext) - 每次扫描在快照之后、拉逐只日线之前算一次，只读，打分环节共用
+1. 市场状态: 全市场快照的上涨家数占比 (宽度)、涨跌幅中位数、跌停家数占比、60 日涨跌幅中位数 -> risk_on / neutral / risk_off
+   - 只用快照，分片扫描各片算出的完全一致
+2. 板块聚合: 按行业 (给了 代码->行业 映射时) 或按代码前缀分的交易板块，算家数/宽度/涨跌幅中位数/成交额加权涨跌幅；
+   每只候选的板块强度 = 所在板块涨跌幅中位数在各板块间的分位
+3. 横截面分位 (0~1，越大越强): 候选池内 量比/换手率/涨跌幅/60 日涨跌幅 的百分位 (同值取平均名次)；
+   有本地仓库时再用库里的历史 + 快照里今天这根 K 线，算出今天的量比与 CMF(20) (公式同 IndicatorEngine) 的分位
+   - 快照没有的列 (回放/合成数据) 对应分位为 NaN，规则里与 NaN 的比较不成立
+4. env(symbols): 按代码取出一维数组并进规则求值环境 (rules.CONTEXT_INPUTS)，打分规则可直接引用
+5. gate(): risk_off 日在拉日线之前收缩候选池 (按当日与 60 日涨跌幅分位的均值只留前一部分) 或整个跳过，省下大部分 I/O
+"""
+
+import math
+import numpy as np
+from rules import CONTEXT_INPUTS
+
+# 按代码前缀分的交易板块 (按顺序匹配第一个)，最后一项为涨跌停幅度 %；ST 一律 5%
+BOARDS = (('688', '科创板', 20), ('30', '创业板', 20), ('60', '沪主板', 10), ('00', '深主板', 10),
+          ('92', '北交所', 30), ('8', '北交所', 30), ('4', '北交所', 30))
+OTHER_BOARD = ('其他', 10)
+ST_LIMIT = 5
+# 市场状态判定: 宽度 (上涨家数占比)、跌停家数占比、60 日涨跌幅中位数 (%)
+RISK_OFF = {'breadth': 0.2, 'limit_down': 0.03, 'weak_breadth': 0.35, 'weak_pct60': -10.0}
+RISK_ON = {'breadth': 0.6, 'pct60': 0.0}
+REGIMES = {'risk_off': -1, 'neutral': 0, 'risk_on': 1}
+# 风险闸门: scan 照常扫；shrink 只留相对强度靠前的；skip 整个跳过
+GATE_MODES = ('scan', 'shrink', 'skip')
+# 今天的量比/CMF 要用的历史根数
+HISTORY_BARS = 20
+
+
+def board_of(code):
+    code = str(code)
+    for prefix, name, limit in BOARDS:
+        if code.startswith(prefix): return name, limit
+    return OTHER_BOARD
+
+
+def rank_pct(x):
+    """百分位名次 (1/n ~ 1，同值取平均名次，NaN 保持 NaN)，与 pandas rank(pct=True) 相同"""
+    x = np.asarray(x, dtype=float)
+    out = np.full(len(x), np.nan)
+    ok = ~np.isnan(x)
+    if ok.any():
+        v = np.sort(x[ok])
+        lo = np.searchsorted(v, x[ok], side='left')
+        hi = np.searchsorted(v, x[ok], side='right')
+        out[ok] = (lo + hi + 1) / 2 / len(v)
+    return out
+
+
+def classify(breadth, limit_down, pct60):
+    """宽度/跌停占比/60 日涨跌幅中位数 -> 市场状态；信息缺失 (NaN) 时不会判成 risk_off 或 risk_on"""
+    if breadth < RISK_OFF['breadth'] or limit_down > RISK_OFF['limit_down'] or \
+            (breadth < RISK_OFF['weak_breadth'] and pct60 < RISK_OFF['weak_pct60']):
+        return 'risk_off'
+    if breadth > RISK_ON['breadth'] and pct60 > RISK_ON['pct60']:
+        return 'risk_on'
+    return 'neutral'
+
+
+def load_sectors(path):
+    """代码->行业 映射 CSV (列: 代码, 行业)"""
+    import pandas as pd
+    df = pd.read_csv(path, dtype=str)
+    return dict(zip(df['代码'], df['行业']))
+
+
+def _num(df, col):
+    import pandas as pd
+    if col not in df: return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+
+
+def _nanmedian(x):
+    x = x[~np.isnan(x)]
+    return float(np.median(x)) if len(x) else math.nan
+
+
+def _round(x, k=4):
+    return None if x is None or math.isnan(x) else round(float(x), k)
+
+
+def today_flow(store, symbols, today, spot=None):
+    """本地仓库的历史 (截至 today) + 快照里今天的 K 线 -> 今天的 (量比, CMF20)；库里没有或不足 20 根的为 NaN
+    spot: {代码: (开, 高, 低, 收, 量)}，库里最后一根早于 today 时拼在末尾"""
+    n = len(symbols)
+    h, l, c, v = (np.full((n, HISTORY_BARS), np.nan) for _ in range(4))
+    for i, s in enumerate(symbols):
+        bars = store.read(s)
+        if len(bars) and bars['date'][-1] > today: bars = bars[bars['date'] <= today]
+        if not len(bars): continue
+        rows = [bars['high'][-HISTORY_BARS:], bars['low'][-HISTORY_BARS:], bars['close'][-HISTORY_BARS:], bars['volume'][-HISTORY_BARS:]]
+        bar = (spot or {}).get(s)
+        if bars['date'][-1] < today and bar is not None and bar[4] > 0:
+            rows = [np.append(r, x)[-HISTORY_BARS:] for r, x in zip(rows, bar[1:])]
+        k = len(rows[0])
+        for a, r in zip((h, l, c, v), rows):
+            a[i, HISTORY_BARS - k:] = r
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vol_ma5 = v[:, -5:].mean(axis=1)
+        vol_ratio = v[:, -1] / np.where(vol_ma5 == 0, 1, vol_ma5)
+        hl = h - l
+        mf_mult = ((c - l) - (h - c)) / np.where(hl == 0, 0.01, hl)
+        cmf = (mf_mult * v).sum(axis=1) / v.sum(axis=1)
+    # sum 遇 NaN 得 NaN: 不足 20 根的 CMF 自然为空，与 IndicatorEngine 的滚动和一致
+    return vol_ratio, cmf
+
+
+class MarketContext:
+    """info: 市场状态与板块聚合 (可 JSON)；symbols: 候选代码；columns: {CONTEXT_INPUTS 键: 与 symbols 对齐的只读数组}"""
+
+    def __init__(self, info, symbols, columns):
+        self.info = info
+        self.symbols = list(symbols)
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        self.columns = columns
+        for a in columns.values():
+            a.flags.writeable = False
+
+    def __setstate__(self, state):
+        # 进计算进程 (pickle) 后数组照样只读
+        self.__dict__.update(state)
+        for a in self.columns.values():
+            a.flags.writeable = False
+
+    @property
+    def regime(self):
+        return self.info['regime']
+
+    @staticmethod
+    def build(spot, symbols, store=None, today=None, sectors=None):
+        """spot: 全市场快照 (akshare 原始中文列)；symbols: 候选代码 (分位在它们之间算)
+        store: 本地行情仓库 (给了才算量比/CMF 分位)；today: 交易日 yyyymmdd；sectors: {代码: 行业}"""
+        code = spot['代码'].astype(str).to_numpy()
+        pct, pct60, amount, volume = (_num(spot, k) for k in ('涨跌幅', '60日涨跌幅', '成交额', '成交量'))
+        # 停牌 (没有成交量或涨跌幅) 不计入宽度
+        traded = ~np.isnan(pct) & ~(volume <= 0)
+        boards = [board_of(s) for s in code]
+        st = spot['名称'].astype(str).str.contains('ST').to_numpy() if '名称' in spot else np.zeros(len(code), dtype=bool)
+        limit = np.where(st, ST_LIMIT, [b[1] for b in boards])
+        m = int(traded.sum())
+        breadth = float((pct[traded] > 0).mean()) if m else math.nan
+        limit_down = float((pct[traded] <= -limit[traded] * 0.98).sum() / m) if m else math.nan
+        median60 = _nanmedian(pct60[traded])
+        info = {'regime': classify(breadth, limit_down, median60), 'traded': m, 'breadth': _round(breadth),
+                'limit_up': int((pct[traded] >= limit[traded] * 0.98).sum()), 'limit_down': _round(limit_down),
+                'median_pct': _round(_nanmedian(pct[traded])), 'median_pct60': _round(median60)}
+
+        # 板块聚合 (全市场参与交易的股票)
+        sector = np.array([(sectors or {}).get(s) or b[0] for s, b in zip(code, boards)], dtype=object)
+        names, inv = np.unique(sector.astype(str), return_inverse=True)
+        table = []
+        for j, name in enumerate(names):
+            sel = traded & (inv == j)
+            if not sel.any(): continue
+            w = amount[sel]
+            weighted = float(np.nansum(pct[sel] * w) / np.nansum(w)) if np.nansum(w) > 0 else math.nan
+            table.append({'sector': name, 'count': int(sel.sum()), 'breadth': _round(float((pct[sel] > 0).mean())),
+                          'median_pct': _round(_nanmedian(pct[sel])), 'weighted_pct': _round(weighted)})
+        strength = dict(zip([t['sector'] for t in table],
+                            rank_pct([math.nan if t['median_pct'] is None else t['median_pct'] for t in table])))
+        info['sectors'] = sorted(table, key=lambda t: -(t['median_pct'] if t['median_pct'] is not None else -math.inf))
+
+        # 候选池内的横截面分位
+        row = {s: i for i, s in enumerate(code)}
+        idx = np.array([row.get(str(s), -1) for s in symbols], dtype=np.int64)
+        take = lambda x: np.where(idx >= 0, x[idx], np.nan) if len(idx) else np.empty(0)
+        n = len(symbols)
+        cols = {k: np.full(n, np.nan) for k in CONTEXT_INPUTS}
+        cols['mkt_breadth'][:] = breadth
+        cols['mkt_regime'][:] = REGIMES[info['regime']]
+        cols['sector_strength'] = np.array([strength.get(sector[i], math.nan) if i >= 0 else math.nan for i in idx], dtype=float)
+        for key, col in (('vr_rank', '量比'), ('turnover_rank', '换手率'), ('pct_rank', '涨跌幅'), ('pct60_rank', '60日涨跌幅')):
+            cols[key] = rank_pct(take(_num(spot, col)))
+        if store is not None and today is not None and n:
+            ohlcv = np.column_stack([take(_num(spot, k)) for k in ('今开', '最高', '最低', '最新价', '成交量')])
+            bars = {s: tuple(r) for s, r in zip(symbols, ohlcv) if not np.isnan(r[1:]).any()}
+            vol_ratio, cmf = today_flow(store, list(symbols), today, bars)
+            # 历史量比覆盖快照量比 (口径与打分用的 vol_ratio 一致)
+            cols['vr_rank'] = np.where(np.isnan(vol_ratio), cols['vr_rank'], rank_pct(vol_ratio))
+            cols['cmf_rank'] = rank_pct(cmf)
+            info['history'] = int((~np.isnan(cmf)).sum())
+        return MarketContext(info, symbols, cols)
+
+    def env(self, symbols):
+        """按代码取出规则求值环境里的市场环境变量；不在候选池里的为 NaN"""
+        idx = np.array([self.index.get(s, -1) for s in symbols], dtype=np.int64)
+        return {k: np.where(idx >= 0, a[idx], np.nan) if len(idx) else np.empty(0) for k, a in self.columns.items()}
+
+    def gate(self, candidates, mode='scan', keep=0.3):
+        """risk_off 日按 mode 处理候选 ([(代码, ...)]，保持原顺序): scan 照常；shrink 只留相对强度前 keep；skip 全部跳过"""
+        if mode not in GATE_MODES: raise ValueError(f"未知风险闸门: {mode}")
+        if mode == 'scan' or self.regime != 'risk_off': return candidates
+        if mode == 'skip': return []
+        env = self.env([c[0] for c in candidates])
+        ranks = np.vstack([env['pct_rank'], env['pct60_rank']])
+        known = (~np.isnan(ranks)).sum(axis=0)
+        # 两个分位的均值 (缺一个用另一个，都缺按最弱)
+        strength = np.where(known > 0, np.nansum(ranks, axis=0) / np.maximum(known, 1), 0.0)
+        top = np.argsort(-strength, kind='stable')[:math.ceil(len(candidates) * keep)]
+        chosen = np.zeros(len(candidates), dtype=bool)
+        chosen[top] = True
+        return [c for c, ok in zip(candidates, chosen) if ok]
+
+    def summary(self):
+        i = self.info
+        return (f"{i['regime']} 宽度 {i['breadth']} 跌停占比 {i['limit_down']} 涨跌幅中位 {i['median_pct']}% "
+                f"60日中位 {i['median_pct60']}%")
+
+
+def empty_env(n):
+    """没有市场环境时的占位 (全 NaN)"""
+    return {k: np.full(n, np.nan) for k in CONTEXT_INPUTS}
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+常驻扫描服务 (ScanDaemon) - 行情与指标/形态/打分表常驻内存，本机 JSON 接口毫秒级查询
+1. 启动时拉一次快照与历史 (走本地仓库时基本不发请求)，逐只压进紧凑行情容器 (market.MarketData)，
+   全市场一次算完最后一根的因子、形态位与打分表 (同 main.py --scores 的打分表，规则/参数同日终扫描)
+2. 收盘后 (最近交易日变了) 后台重建一份: 仓库只补拉缺口；新表建好后整份替换，重建期间照常应答旧表
+3. 查询 (HTTP，监听本机端口或 Unix socket，返回 JSON):
+   GET  /status                       交易日、只数、上次重建的时间/耗时、查询延迟
+   GET  /symbol/<代码>[?full=1]        单只: Excel 汇总表的各列 + 打分明细，full=1 时附全部因子
+   GET  /top?n=50&has=黄金坑&min_score=60&selected=1
+                                      按总分排序的前 n 只；has 可重复 (规则名或形态名，全部命中才算)；
+                                      selected=1 只看日终扫描会入围的 (舆情风控之前)
+   GET  /bars/<代码>[?n=60]            最近 n 根日线 (复权口径同仓库)
+   POST /refresh                      立即后台重建
+4. 股票池只按板块/ST/市值/股价过滤 (不看换手率与亏损)，池里任何代码都能查；'候选' 列标出日终扫描会不会扫到它
+说明: 不做舆情风控 (新闻接口慢且限速)，总分不含舆情加减分；Excel/打分表导出仍用 main.py
+
+用法:
+    python daemon.py --port 8765
+    python daemon.py --socket /tmp/alpha.sock --provider replay --replay-dir replay
+    python daemon.py --query '/top?n=20&has=黄金坑'
+"""
+
+import os
+import json
+import math
+import time
+import socket
+import argparse
+import threading
+import http.client
+import numpy as np
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, quote, urlsplit
+from tqdm import tqdm
+
+import rules
+from instrument import RunReport
+from market import MarketData
+from store import last_trading_day
+from main import IndicatorEngine, KLineStrictLib, AlphaGalaxyOmni, ExcelExporter
+
+# has= 认的名字 -> (打分表里的位掩码列, 位序)；风险形态带不带 "风险:" 前缀都行
+NAMES = {r.name: ('规则位', i) for i, r in enumerate(rules.STRATEGY)}
+for _i, (_name, _) in enumerate(KLineStrictLib.PATTERNS):
+    NAMES[_name] = ('形态位', _i)
+    NAMES.setdefault(_name.split(':', 1)[-1], ('形态位', _i))
+# 单只/前 n 只的输出: Excel 汇总表的列 (没有舆情) + 打分明细
+DETAIL = ('日期', '入围', '候选', '规则分', '形态分', '命中规则')
+# 最近多少根查询延迟参与 /status 的分位数
+LATENCY_WINDOW = 10000
+
+
+def _plain(v):
+    """numpy 标量 / NaN -> JSON 能表示的值"""
+    if hasattr(v, 'item'): v = v.item()
+    if isinstance(v, float) and not math.isfinite(v): return None
+    return v
+
+
+class ScanTables:
+    """一份常驻结果 (建好后只读，重建时整份替换)；table 为打分表，行序同 md"""
+
+    def __init__(self, day, asof, md, table, report, seconds):
+        self.day = day
+        self.asof = asof
+        self.md = md
+        self.table = table
+        self.report = report
+        self.seconds = seconds
+        self.loaded = datetime.now()
+        self.records = table.to_dict('records')
+        self.row = {s: i for i, s in enumerate(table['代码'])}
+        # /top 的筛选全部在这几列上向量化做
+        self.score = table['总分'].to_numpy()
+        self.selected = table['入围'].to_numpy() & table['候选'].to_numpy()
+        self.bits = {'规则位': table['规则位'].to_numpy(), '形态位': table['形态位'].to_numpy()}
+        self.order = np.argsort(-self.score, kind='stable')
+
+    def format(self, i, full=False):
+        """第 i 行 -> Excel 汇总表的各列 + 打分明细 (只对要返回的行逐只格式化)"""
+        rec = self.records[i]
+        _, buy_pats, risk_pats = KLineStrictLib.decode(rec['形态位'])
+        args = (rec['代码'], rec['名称'], rec['市盈率'], rec['市净率'], rec['换手率%'])
+        try:
+            out = AlphaGalaxyOmni.output(args, rec, rec['总分'], rec['规则位'], buy_pats, risk_pats)
+        except (ValueError, TypeError):
+            # 个别因子为 NaN (如一字板的 ADX) 时汇总列格式化不了，只给打分明细
+            out = {'代码': rec['代码'], '名称': rec['名称'], '总分': rec['总分']}
+        row = {c: _plain(out[c]) for c in ExcelExporter.COLUMNS if c in out}
+        row.update({c: _plain(rec[c]) for c in DETAIL})
+        if full: row['因子'] = {k: _plain(rec[k]) for k in IndicatorEngine.FACTORS}
+        return row
+
+
+class _UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _reply(self, method):
+        status, body = self.server.scan.handle(method, self.path)
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._reply('GET')
+
+    def do_POST(self):
+        self._reply('POST')
+
+    def log_message(self, *args):
+        # 逐条访问日志太吵；延迟统计见 /status
+        pass
+
+
+class ScanDaemon:
+    """app: 配好数据源/仓库/参数的 AlphaGalaxyOmni (复用其快照过滤、历史拉取与打分规则)
+    check: 每隔多少秒看一次最近交易日变没变 (变了就后台重建)"""
+
+    def __init__(self, app, check=60, progress=True):
+        self.app = app
+        self.check = check
+        self.progress = progress
+        self.tables = None
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.queries = 0
+        self.errors = 0
+        self._building = threading.Lock()
+        self._stop = threading.Event()
+
+    # ---------- 建表 ----------
+    def build(self):
+        """快照 -> 历史 -> 紧凑容器 -> 因子/形态/打分表，返回一份新的 ScanTables"""
+        app = self.app
+        t0 = time.perf_counter()
+        app.report = report = RunReport()
+        app.scheduler.reset()
+        now = app.provider.now()
+        with report.stage('snapshot'):
+            spot = app.fetch_spot()
+        pool = spot[app.screen(spot, turnover=False)]
+        # 日终扫描会扫的: 再加换手率区间，剔除亏损股
+        candidates = set(pool['代码'][app.screen(pool) & ~(pool['市盈率-动态'] < 0)])
+        todo = list(zip(pool['代码'], pool['名称'], pool['市盈率-动态'], pool['市净率'], pool['换手率']))
+        args, short = {}, 0
+
+        def loaded():
+            nonlocal short
+            fetched = report.timed('fetch', app.scheduler.stream(todo, app.load_arrays))
+            for res in tqdm(fetched, total=len(todo), disable=not self.progress):
+                if res.status != 'ok': continue
+                if len(res.value['close']) < 60:
+                    short += 1
+                    continue
+                args[res.item[0]] = res.item
+                yield res.item[0], res.value
+
+        md = MarketData.from_frames(loaded())
+        if app.store: app.store.flush()
+        report.drop('short_history', short, len(md))
+        with report.stage('indicators'):
+            factors = IndicatorEngine.calculate_market(md, chunk=app.batch_size).reindex(md.symbols)
+        with report.stage('patterns'):
+            bits, k_score = KLineStrictLib.detect_market(md)
+        with report.stage('score_table'):
+            dates = md.calendar[md.day[md.offsets[1:] - 1]] if len(md) else np.empty(0, dtype=np.int64)
+            table = AlphaGalaxyOmni.score_table([args[s] for s in md.symbols], factors, bits, k_score, dates, app.params)
+            table['候选'] = table['代码'].isin(candidates).to_numpy()
+        return ScanTables(last_trading_day(now), now, md, table, report, time.perf_counter() - t0)
+
+    def refresh(self, wait=False):
+        """后台重建，建好后整份替换；已有重建在跑时返回 False"""
+        if not self._building.acquire(blocking=False): return False
+
+        def job():
+            try:
+                self.tables = self.build()
+                t = self.tables
+                print(f"[{datetime.now():%H:%M:%S}] 已载入 {t.day}: {len(t.md)} 只，入围 {int(t.selected.sum())} 只，"
+                      f"用时 {t.seconds:.1f}s")
+            except Exception as e:
+                self.errors += 1
+                print(f"[{datetime.now():%H:%M:%S}] 重建失败: {e!r}")
+            finally:
+                self._building.release()
+
+        if wait:
+            job()
+        else:
+            threading.Thread(target=job, daemon=True).start()
+        return True
+
+    def watch(self):
+        """后台: 最近交易日变了 (收盘后) 就重建"""
+        while not self._stop.wait(self.check):
+            t = self.tables
+            if t is None or last_trading_day(self.app.provider.now()) > t.day:
+                self.refresh()
+
+    # ---------- 查询 ----------
+    def handle(self, method, path):
+        """一次请求 -> (HTTP 状态码, JSON 对象)"""
+        t0 = time.perf_counter()
+        url = urlsplit(path)
+        parts = [p for p in url.path.split('/') if p]
+        query = parse_qs(url.query)
+        try:
+            if method == 'POST' and parts == ['refresh']:
+                return 202, {'started': self.refresh()}
+            if method != 'GET': return 405, {'error': f"不支持 {method} {url.path}"}
+            if parts == ['status']: return 200, self.status()
+            if self.tables is None: return 503, {'error': '首次载入还没完成'}
+            if len(parts) == 2 and parts[0] == 'symbol':
+                return 200, self.symbol(parts[1], _flag(query, 'full'))
+            if parts == ['top']:
+                return 200, self.top(int(_one(query, 'n', 50)), query.get('has', []),
+                                     _one(query, 'min_score'), _flag(query, 'selected'), _flag(query, 'full'))
+            if len(parts) == 2 and parts[0] == 'bars':
+                return 200, self.bars(parts[1], int(_one(query, 'n', 60)))
+            return 404, {'error': f"没有这个接口: {url.path}"}
+        except KeyError as e:
+            return 404, {'error': f"找不到: {e.args[0]}"}
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            self.errors += 1
+            return 500, {'error': repr(e)}
+        finally:
+            self.queries += 1
+            self.latencies.append(time.perf_counter() - t0)
+
+    def status(self):
+        t = self.tables
+        out = {'building': self._building.locked(), 'queries': self.queries, 'errors': self.errors}
+        if self.latencies:
+            ms = np.array(self.latencies) * 1000
+            out['latency_ms'] = {f'p{q}': round(float(np.percentile(ms, q)), 3) for q in (50, 90, 99)}
+        if t is not None:
+            out.update(day=t.day, asof=f"{t.asof:%Y-%m-%d %H:%M:%S}", loaded=f"{t.loaded:%Y-%m-%d %H:%M:%S}",
+                       build_seconds=round(t.seconds, 2), symbols=len(t.md), candidates=int(t.table['候选'].sum()),
+                       selected=int(t.selected.sum()), market_mb=round(t.md.nbytes / 2 ** 20, 1),
+                       stages=t.report.summary())
+        return out
+
+    def symbol(self, code, full=False):
+        t = self.tables
+        return t.format(t.row[code], full)
+
+    def top(self, n=50, has=(), min_score=None, selected=False, full=False):
+        t = self.tables
+        mask = np.ones(len(t.score), dtype=bool)
+        for name in has:
+            if name not in NAMES: raise ValueError(f"未知的规则/形态: {name}")
+            col, i = NAMES[name]
+            mask &= (t.bits[col] >> i & 1).astype(bool)
+        if min_score is not None: mask &= t.score >= float(min_score)
+        if selected: mask &= t.selected
+        idx = t.order[mask[t.order]]
+        return {'day': t.day, 'matched': int(len(idx)), 'rows': [t.format(i, full) for i in idx[:max(n, 0)]]}
+
+    def bars(self, code, n=60):
+        # v[-0:] 是整段、负数是截掉尾部的开头，都不是 "最近 n 根"
+        if n < 1: raise ValueError(f"n 须 >= 1: {n}")
+        t = self.tables
+        b = t.md.bars(t.row[code])
+        return {k: [_plain(x) for x in v[-n:]] for k, v in b.items()}
+
+    # ---------- 服务 ----------
+    def serve(self, host='127.0.0.1', port=8765, path=None):
+        """先同步载入一次，再开后台刷新线程与 HTTP 服务；Ctrl-C 结束"""
+        if path and os.path.exists(path): os.remove(path)
+        server = _UnixHTTPServer(path, _Handler) if path else ThreadingHTTPServer((host, port), _Handler)
+        server.scan = self
+        print("1. 首次载入...")
+        self.refresh(wait=True)
+        threading.Thread(target=self.watch, daemon=True).start()
+        print(f"2. 查询服务已启动: {path or f'http://{host}:{port}'}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stop.set()
+            server.server_close()
+            if path and os.path.exists(path): os.remove(path)
+
+
+def _one(query, key, default=None):
+    return query[key][-1] if key in query else default
+
+
+def _flag(query, key):
+    return _one(query, key, '0') not in ('0', '', 'false')
+
+
+def query(path, host='127.0.0.1', port=8765, sock=None, method='GET', timeout=30):
+    """向服务发一次请求 -> (状态码, JSON 对象)；路径里的中文自动转义"""
+    if sock:
+        class Connection(http.client.HTTPConnection):
+            def connect(self):
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.settimeout(timeout)
+                self.sock.connect(sock)
+        conn = Connection('localhost', timeout=timeout)
+    else:
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        conn.request(method, quote(path, safe='/?&=:%'))
+        resp = conn.getresponse()
+        return resp.status, json.loads(resp.read().decode('utf-8'))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    from providers import make_provider
+    parser = argparse.ArgumentParser(description='常驻扫描服务: 打分表常驻内存，本机 JSON 接口查询')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', default=None, help='改用 Unix socket (给路径)')
+    parser.add_argument('--check', type=float, default=60, help='每隔多少秒检查一次是否需要收盘后重建')
+    parser.add_argument('--store', default=None, help='本地行情仓库目录 (默认 price_store；回放模式默认不用)')
+    parser.add_argument('--no-store', action='store_true', help='不使用本地仓库 (每次重建都全量下载)')
+    parser.add_argument('--concurrency', type=int, default=8, help='拉历史的起始并发 (自适应调整)')
+    parser.add_argument('--rate', type=float, default=20, help='全局限速: 每秒最多请求数')
+    parser.add_argument('--provider', choices=['akshare', 'replay'], default='akshare', help='数据源')
+    parser.add_argument('--replay-dir', help='回放数据目录 (--provider replay)')
+    parser.add_argument('--params', help='打分参数 JSON (同 main.py --params)')
+    parser.add_argument('--query', metavar='PATH', help='不起服务，向已在跑的服务发一次 GET 并打印结果')
+    parser.add_argument('--post', action='store_true', help='--query 用 POST (如 /refresh)')
+    args = parser.parse_args()
+
+    if args.query:
+        status, body = query(args.query, args.host, args.port, args.socket, 'POST' if args.post else 'GET')
+        print(json.dumps(body, ensure_ascii=False, indent=1))
+        raise SystemExit(0 if status < 400 else 1)
+
+    provider = make_provider(args.provider, args.replay_dir, timeout=30)
+    store_dir = None if args.no_store or (args.provider == 'replay' and args.store is None) else (args.store or 'price_store')
+    app = AlphaGalaxyOmni(store_dir=store_dir, concurrency=args.concurrency, rate=args.rate, provider=provider,
+                          params=rules.load_params(args.params) if args.params else None)
+    ScanDaemon(app, args.check).serve(args.host, args.port, args.socket)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+结果导出 - 全市场打分表流式落盘 + 常量内存的 Excel 汇总
+1. ScoreWriter: 每算完一批就把这批股票的全部因子/得分追加写出，内存里不攒整张表
+   - parquet: 每批一个 row group (需要 pyarrow)；csv: 首批写表头后追加；ndjson: 一行一个 JSON 对象
+   - 先写临时文件，正常结束才改名为正式文件名，中途失败不会留下半截的表
+2. 列顺序与类型由 AlphaGalaxyOmni.score_table 固定 (字符串列不出现 None)，各批 schema 一致，可直接灌进数仓
+3. save_workbook: openpyxl 只写模式逐行写 xlsx，内存与行数无关
+4. read_scores: 按扩展名读回落盘的打分表，类型与写出时一致 (代码不丢前导零，字符串列空值为 '')
+"""
+
+import os
+import math
+
+FORMATS = {'parquet': '.parquet', 'csv': '.csv', 'ndjson': '.ndjson'}
+# 打分表里的字符串列 (读回时按字符串解析)
+TEXT_COLUMNS = ('代码', '名称', '命中规则', '买入形态', '风险形态')
+
+
+class _CSV:
+    def __init__(self, path):
+        # utf-8-sig: Excel 直接打开不乱码
+        self.f = open(path, 'w', encoding='utf-8-sig', newline='')
+        self.header = True
+
+    def write(self, df):
+        df.to_csv(self.f, header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        self.f.close()
+
+
+class _NDJSON:
+    def __init__(self, path):
+        self.f = open(path, 'w', encoding='utf-8')
+
+    def write(self, df):
+        s = df.to_json(orient='records', lines=True, force_ascii=False)
+        self.f.write(s if s.endswith('\n') else s + '\n')
+
+    def close(self):
+        self.f.close()
+
+
+class _Parquet:
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("写 parquet 需要 pyarrow: pip install pyarrow")
+        self.pa, self.pq = pa, pq
+        self.path = path
+        self.writer = None
+
+    def write(self, df):
+        if self.writer is None:
+            table = self.pa.Table.from_pandas(df, preserve_index=False)
+            self.writer = self.pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = self.pa.Table.from_pandas(df, schema=self.writer.schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None: self.writer.close()
+
+
+_WRITERS = {'parquet': _Parquet, 'csv': _CSV, 'ndjson': _NDJSON}
+
+
+class ScoreWriter:
+    """stem + 格式列表 -> {stem}_scores.parquet / .csv / .ndjson；write(df) 追加一批"""
+
+    def __init__(self, stem, formats):
+        self.paths = [f"{stem}_scores{FORMATS[f]}" for f in formats]
+        self.writers = []
+        self.rows = 0
+        try:
+            for f, path in zip(formats, self.paths):
+                self.writers.append(_WRITERS[f](path + '.tmp'))
+        except Exception:
+            self.close(ok=False)
+            raise
+
+    def write(self, df):
+        if df is None or not len(df): return
+        for w in self.writers:
+            w.write(df)
+        self.rows += len(df)
+
+    def close(self, ok=True):
+        for w, path in zip(self.writers, self.paths):
+            w.close()
+            if ok:
+                os.replace(path + '.tmp', path)
+            elif os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+        self.writers = []
+        return self.paths if ok else []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(ok=exc_type is None)
+
+
+def read_scores(path):
+    """{stem}_scores.parquet / .csv / .ndjson -> DataFrame"""
+    import pandas as pd
+    if path.endswith(FORMATS['parquet']):
+        df = pd.read_parquet(path)
+    elif path.endswith(FORMATS['csv']):
+        df = pd.read_csv(path, dtype={c: str for c in TEXT_COLUMNS}, encoding='utf-8-sig')
+    elif path.endswith(FORMATS['ndjson']):
+        df = pd.read_json(path, lines=True, dtype={c: str for c in TEXT_COLUMNS})
+    else:
+        raise ValueError(f"未知打分表格式: {path}")
+    for c in TEXT_COLUMNS:
+        if c in df: df[c] = df[c].fillna('').astype(str)
+    return df
+
+
+def _cell(v):
+    # openpyxl 不认 NaN / numpy 标量
+    if v is None: return None
+    if hasattr(v, 'item'): v = v.item()
+    if isinstance(v, float) and math.isnan(v): return None
+    return v
+
+
+def save_workbook(filename, sheets):
+    """sheets: [(表名, 列名列表, 行迭代器)]；只写模式逐行落盘"""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    for name, columns, rows in sheets:
+        ws = wb.create_sheet(name)
+        ws.append(list(columns))
+        for row in rows:
+            ws.append([_cell(v) for v in row])
+    wb.save(filename)
+    return filename
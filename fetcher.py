@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+异步拉取调度器 (FetchScheduler)
+1. 并发上限自适应 (AIMD): 成功且延迟正常时加性增，失败/超时/延迟飙升时乘性减
+2. 全局令牌桶限速，所有请求共享
+3. 瞬时失败按指数退避 + 随机抖动重试
+4. 结果三分: ok / empty(无数据) / error(拉取失败，带异常类型)，不再混在一个 None 里
+5. stream() 按完成顺序逐个吐出结果，下游可以边拉边算
+6. asyncio 只在真正拉取时导入 (import 本模块不带事件循环那一套)
+"""
+
+import time
+import queue
+import random
+import threading
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+FetchResult = namedtuple('FetchResult', ['item', 'status', 'value', 'error', 'attempts', 'latency'])
+
+
+def is_empty(value):
+    if value is None: return True
+    try:
+        return len(value) == 0
+    except TypeError:
+        return False
+
+
+class TokenBucket:
+    """令牌桶: rate 个/秒匀速补充，最多攒 burst 个"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """取一个令牌；不够时返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        import asyncio
+        while True:
+            wait = self._take()
+            if not wait: return
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self):
+        while True:
+            wait = self._take()
+            if not wait: return
+            time.sleep(wait)
+
+
+class AIMDLimiter:
+    """自适应并发上限"""
+
+    def __init__(self, start=8, lo=1, hi=32, slow_factor=3.0):
+        self.limit = float(start)
+        self.lo, self.hi = lo, hi
+        self.slow_factor = slow_factor
+        self.inflight = 0
+        self.baseline = None  # 成功请求延迟的 EWMA
+        self._last_cut = 0.0
+        self._cond = None
+        self.trace = []  # (时间, 并发上限)
+
+    async def acquire(self):
+        import asyncio
+        if self._cond is None: self._cond = asyncio.Condition()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.inflight < int(self.limit))
+            self.inflight += 1
+
+    async def release(self, ok, latency):
+        now = time.monotonic()
+        slow = ok and self.baseline is not None and latency > self.slow_factor * self.baseline
+        if ok and not slow:
+            self.baseline = latency if self.baseline is None else 0.9 * self.baseline + 0.1 * latency
+            self.limit = min(self.hi, self.limit + 1.0 / self.limit)
+        elif now - self._last_cut > (self.baseline or 1.0):
+            # 一个 RTT 内只砍一次，避免一波失败把并发砍到底
+            self.limit = max(self.lo, self.limit * 0.5)
+            self._last_cut = now
+        self.trace.append((now, self.limit))
+        async with self._cond:
+            self.inflight -= 1
+            self._cond.notify_all()
+
+
+class FetchScheduler:
+    def __init__(self, concurrency=8, max_concurrency=32, rate=20, burst=None,
+                 retries=3, timeout=30, backoff=0.5):
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.limiter = None
+        self.stats = Counter()
+        self.errors = Counter()
+        self.latencies = []
+
+    async def _one(self, fn, item, pool):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        err, t0 = None, time.monotonic()
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            await self.limiter.acquire()
+            start = time.monotonic()
+            ok = False
+            try:
+                value = await asyncio.wait_for(loop.run_in_executor(pool, fn, item), self.timeout)
+                ok = True
+            except Exception as e:  # 包括超时
+                err = e
+            latency = time.monotonic() - start
+            self.latencies.append(latency)
+            await self.limiter.release(ok, latency)
+            if ok:
+                status = 'empty' if is_empty(value) else 'ok'
+                return FetchResult(item, status, value, None, attempt + 1, time.monotonic() - t0)
+            if attempt < self.retries:
+                self.stats['retries'] += 1
+                await asyncio.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+        self.errors[type(err).__name__] += 1
+        return FetchResult(item, 'error', None, err, self.retries + 1, time.monotonic() - t0)
+
+    async def _main(self, items, fn, out):
+        import asyncio
+        self.limiter = AIMDLimiter(self.concurrency, 1, self.max_concurrency)
+        pool = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        try:
+            tasks = [asyncio.ensure_future(self._one(fn, item, pool)) for item in items]
+            for fut in asyncio.as_completed(tasks):
+                res = await fut
+                self.stats[res.status] += 1
+                out.put(res)
+        finally:
+            # 超时的请求线程可能还挂着，不等它们
+            pool.shutdown(wait=False)
+            out.put(None)
+
+    def stream(self, items, fn):
+        """后台线程跑事件循环，按完成顺序产出 FetchResult"""
+        import asyncio
+        out = queue.Queue()
+        worker = threading.Thread(target=lambda: asyncio.run(self._main(list(items), fn, out)), daemon=True)
+        worker.start()
+        while True:
+            res = out.get()
+            if res is None: break
+            yield res
+        worker.join()
+
+    def run(self, items, fn):
+        return list(self.stream(items, fn))
+
+    def reset(self):
+        """清空计数/延迟/异常 (同一个调度器跑下一次扫描前调用，报告只算这一次的)"""
+        self.stats = Counter()
+        self.errors = Counter()
+        self.latencies = []
+        self.limiter = None
+
+    def summary(self):
+        peak = max((lim for _, lim in self.limiter.trace), default=self.concurrency) if self.limiter else 0
+        return (f"成功 {self.stats['ok']} | 无数据 {self.stats['empty']} | 拉取失败 {self.stats['error']} "
+                f"| 重试 {self.stats['retries']} | 并发峰值 {int(peak)}"
+                + (f" | 异常 {dict(self.errors)}" if self.errors else ""))
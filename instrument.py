@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+运行报告 (RunReport) - 每次扫描的分环节计时、延迟分布、异常与漏斗统计
+1. stage(): 环节墙钟时间 + CPU 时间，同名环节多次进入时累加 (面板按批计算)
+2. timed(): 只计迭代器 next() 的等待时间，用于 "边拉边算" 时单独统计拉取耗时
+3. latency(): 每次请求的耗时按对数分桶成直方图，另给分位数
+4. error() / drop(): 按异常类型计数；各过滤环节剔除了多少只
+5. save(): 写成 JSON 放在 xlsx 旁边；可选 cProfile 只剖析计算环节 (指标/形态/打分)
+6. snapshot() / merge(): 计算进程里的计时与计数带回主进程累加 (此时各环节时间为各进程之和)；
+   分片扫描另带上原始延迟，合并后的直方图/分位数与单进程口径一致
+说明: CPU 时间取 time.process_time，是整个进程的 (含拉取线程)，拉取环节的 CPU 时间仅供参考
+"""
+
+import json
+import time
+import bisect
+import cProfile
+import contextlib
+import numpy as np
+from collections import Counter, defaultdict
+from datetime import datetime
+
+# 延迟直方图上界 (毫秒)，最后一桶为 +inf
+LATENCY_BUCKETS_MS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+COMPUTE_STAGES = ('indicators', 'patterns', 'scoring')
+
+
+class RunReport:
+    def __init__(self, profile=False):
+        self.started = datetime.now()
+        self.stages = defaultdict(lambda: {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.funnel = {}
+        self.info = {}
+        self.profiler = cProfile.Profile() if profile else None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        profiling = self.profiler is not None and name in COMPUTE_STAGES
+        if profiling: self.profiler.enable()
+        w0, c0 = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            s = self.stages[name]
+            s['wall'] += time.perf_counter() - w0
+            s['cpu'] += time.process_time() - c0
+            s['calls'] += 1
+            if profiling: self.profiler.disable()
+
+    def timed(self, name, iterable):
+        """逐个产出 iterable 的元素，只把等下一个元素的时间记到 name 环节"""
+        it = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            yield item
+
+    def snapshot(self, latencies=False):
+        """计时/异常/漏斗 (latencies=True 时连同原始延迟) 的可 pickle 副本，子进程算完带回主进程 merge"""
+        snap = {'stages': {k: dict(v) for k, v in self.stages.items()},
+                'errors': {k: dict(v) for k, v in self.errors.items()},
+                'funnel': {k: dict(v) for k, v in self.funnel.items()}}
+        if latencies: snap['latencies'] = {k: list(v) for k, v in self.latencies.items()}
+        return snap
+
+    def merge(self, snap):
+        for k, v in snap['stages'].items():
+            s = self.stages[k]
+            for f in ('wall', 'cpu', 'calls'): s[f] += v[f]
+        for k, v in snap['errors'].items():
+            self.errors[k].update(v)
+        for k, v in snap['funnel'].items():
+            self.drop(k, v['dropped'], v['remaining'])
+        for k, v in snap.get('latencies', {}).items():
+            self.latencies[k] += v
+
+    def latency(self, kind, seconds):
+        self.latencies[kind].append(seconds)
+
+    def error(self, stage, exc):
+        self.errors[stage][type(exc).__name__ if isinstance(exc, BaseException) else str(exc)] += 1
+
+    def drop(self, stage, count, remaining=None):
+        """stage 这一步剔除了 count 只 (分批调用时累加)，剩 remaining 只；按首次出现的顺序排列"""
+        f = self.funnel.setdefault(stage, {'dropped': 0, 'remaining': None})
+        f['dropped'] += int(count)
+        if remaining is not None: f['remaining'] = int(remaining)
+
+    @staticmethod
+    def histogram(values):
+        ms = np.asarray(values, dtype=float) * 1000
+        counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        for x in ms:
+            counts[bisect.bisect_left(LATENCY_BUCKETS_MS, x)] += 1
+        labels = [f"<={b}ms" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        out = {'count': len(ms), 'buckets': dict(zip(labels, counts))}
+        if len(ms):
+            p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+            out.update(p50_ms=round(p50, 1), p90_ms=round(p90, 1), p99_ms=round(p99, 1),
+                       max_ms=round(ms.max(), 1), total_s=round(ms.sum() / 1000, 3))
+        return out
+
+    def to_dict(self):
+        return {
+            'started': self.started.strftime('%Y-%m-%d %H:%M:%S'),
+            'finished': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'info': self.info,
+            'stages': {k: {'wall_s': round(v['wall'], 4), 'cpu_s': round(v['cpu'], 4), 'calls': v['calls']}
+                       for k, v in self.stages.items()},
+            'latency': {k: self.histogram(v) for k, v in self.latencies.items()},
+            'errors': {k: dict(v) for k, v in self.errors.items() if v},
+            'funnel': self.funnel,
+        }
+
+    def save(self, path, profile_path=None):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2, default=str)
+        if self.profiler is not None and profile_path:
+            self.profiler.dump_stats(profile_path)
+        return path
+
+    def summary(self):
+        return " | ".join(f"{k} {v['wall']:.1f}s" for k, v in self.stages.items())
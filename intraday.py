@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+盘中监控 (IntradayWatch) - 按快照节奏重算全市场得分，输出入围名单的进出变化
+1. 启动时只拉一次历史日线 (走本地仓库时基本不发请求)，截掉当天已有的 K 线，只留收盘定型的部分
+2. 每轮只拉一次全市场快照 (stock_zh_a_spot_em)，用 今开/最高/最低/最新价/成交量 拼出当天的临时 K 线
+3. 只重算最后一根:
+   - 窗口类指标在定型部分的尾部 TAIL 根 + 临时 K 线上算 (窗口最长 60 根，结果与整段计算逐位一致)
+   - EMA 类 (MACD/KDJ) 从定型部分的末值续算一步 (rolling.ewm_step)；形态只判最后一根
+4. 全部候选一次向量化打分 (规则/参数同日终扫描)，与上一轮比较，打印进入/退出入围的股票并追加到事件日志 (ndjson)
+说明: 临时 K 线的成交量/换手率是盘中累计值，量比、换手率类条件早盘天然偏低；舆情不参与盘中打分
+
+用法:
+    python intraday.py --interval 60
+    python intraday.py --provider replay --replay-dir replay --polls 1
+"""
+
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import rules
+from store import MARKET_CLOSE_HOUR, date_to_int
+from rolling import ewm_carry, ewm_step
+from market import MarketData
+from main import IndicatorEngine, KLineStrictLib, AlphaGalaxyOmni
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+# 临时 K 线字段 -> 快照列
+BAR_COLUMNS = {'open': '今开', 'high': '最高', 'low': '最低', 'close': '最新价', 'volume': '成交量'}
+SPOT_NUMERIC = ('总市值', '最新价', '换手率', '市盈率-动态', '市净率', '今开', '最高', '最低', '成交量')
+# 需要续算的 EMA: 序列名 -> (输入序列名, ewm 参数)，与 IndicatorEngine.panel_series 的公式一一对应
+EWM_CARRY = {'ema12': ('close', {'span': 12}), 'ema26': ('close', {'span': 26}), 'dea': ('dif', {'span': 9}),
+             'K': ('rsv', {'com': 2}), 'D': ('K', {'com': 2})}
+# EMA 派生序列: 定型部分只留末根，panel_table 取 *_1 历史键时接在临时 K 线前面
+SPLICED = ('dif', 'dea', 'macd_bar', 'K', 'D', 'J')
+
+
+def _tail(x, n):
+    """取最后 n 列，不足左侧补 NaN (各块面板宽度不同，拼接前对齐)"""
+    if x.shape[1] >= n: return x[:, -n:]
+    return np.concatenate([np.full((len(x), n - x.shape[1]), np.nan), x], axis=1)
+
+
+class IntradayWatch:
+    """app: 配好数据源/仓库/参数的 AlphaGalaxyOmni (复用其快照过滤、历史拉取与打分规则)"""
+    # 定型 K 线保留的尾部根数: ma60 要 60 根，ADX 的两层 14 日窗口要 28 根，留一点余量
+    TAIL = 64
+
+    def __init__(self, app, interval=60, log=None):
+        self.app = app
+        self.report = app.report
+        self.interval = interval
+        self.log = log
+        self.symbols, self.names = [], {}
+        # 上一轮入围: {代码: 总分}
+        self.selected = {}
+
+    def load(self):
+        """启动: 快照定股票池 (不看换手率，盘中逐轮判断)，每只拉一次历史，留下定型部分的尾部与 EMA 续算状态"""
+        app = self.app
+        self.today = date_to_int(app.provider.now())
+        with self.report.stage('snapshot'):
+            spot = app.fetch_spot()
+        pool = spot[app.screen(spot, turnover=False)]
+        self.names = dict(zip(pool['代码'], pool['名称']))
+        todo = list(zip(pool['代码'], pool['名称'], pool['市盈率-动态'], pool['市净率'], pool['换手率']))
+        print(f"1. 载入历史日线 (股票池 {len(todo)} 只)...")
+
+        frames, short = [], 0
+        for res in tqdm(self.report.timed('fetch', app.scheduler.stream(todo, app.load_arrays)), total=len(todo)):
+            if res.status != 'ok': continue
+            # 截掉当天已有的 K 线 (日期升序，留下的是前缀)；加上当天的临时 K 线要够 60 根
+            n = int(np.searchsorted(res.value['date'], self.today))
+            if n < 59:
+                short += 1
+                continue
+            frames.append((res.item[0], {k: np.asarray(res.value[k])[:n] for k in FIELDS + ('date',)}))
+        if app.store: app.store.flush()
+        self.report.drop('short_history', short, len(frames))
+        md = MarketData.from_frames(frames)
+        del frames
+
+        # 按批算整段指标 (面板只在批内展开)，只留尾部与 EMA 末值
+        tails, hists, carries = [], [], []
+        with self.report.stage('intraday_base'):
+            for i in range(0, len(md), app.batch_size):
+                panel = md.panel(np.arange(i, min(i + app.batch_size, len(md))))
+                S = IndicatorEngine.panel_series(panel['high'], panel['low'], panel['close'], panel['volume'])
+                tails.append({k: _tail(panel[k], self.TAIL) for k in FIELDS})
+                hists.append({k: S[k][:, -1:] for k in SPLICED})
+                carries.append({k: ewm_carry(S[src], S[k], **kw) for k, (src, kw) in EWM_CARRY.items()})
+        self.symbols = md.symbols
+        self.tail = {k: np.concatenate([t[k] for t in tails]) if tails else np.empty((0, self.TAIL)) for k in FIELDS}
+        self.hist = {k: np.concatenate([h[k] for h in hists]) if hists else np.empty((0, 1)) for k in SPLICED}
+        self.carry = {k: tuple(np.concatenate([c[k][j] for c in carries]) if carries else np.empty(0) for j in range(2))
+                      for k in EWM_CARRY}
+        self.report.info['watch'] = len(self.symbols)
+
+    def bar(self, spot):
+        """快照 -> 按 self.symbols 对齐的临时 K 线、打分用 args、是否有行情、是否满足日终的过滤条件"""
+        G = self.app
+        spot = spot.drop_duplicates('代码').set_index('代码').reindex(self.symbols)
+        bar = {k: spot[col].to_numpy(dtype=float) for k, col in BAR_COLUMNS.items()}
+        pe, pb, turnover = (spot[k].to_numpy(dtype=float) for k in ('市盈率-动态', '市净率', '换手率'))
+        args = list(zip(self.symbols, [self.names[s] for s in self.symbols], pe, pb, turnover))
+        with np.errstate(invalid='ignore'):
+            # 停牌: 没有最新价或零成交
+            live = (bar['close'] > 0) & (bar['volume'] > 0)
+            eligible = (live & (bar['close'] > G.MIN_PRICE) & ~(pe < 0)
+                        & (turnover > G.TURNOVER_RANGE[0]) & (turnover < G.TURNOVER_RANGE[1]))
+        return bar, args, live, eligible
+
+    def score(self, bar, args, live):
+        """定型尾部 + 临时 K 线 -> 当天的全市场打分表 (同 AlphaGalaxyOmni.score_table)"""
+        idx = np.flatnonzero(live)
+        p = {k: np.concatenate([self.tail[k][idx], bar[k][idx, None]], axis=1) for k in FIELDS}
+        S = IndicatorEngine.panel_series(p['high'], p['low'], p['close'], p['volume'])
+        # EMA 类从定型部分的末值续算一步，再接到定型部分的末根后面
+        carry = {k: (y[idx], wt[idx]) for k, (y, wt) in self.carry.items()}
+        with np.errstate(invalid='ignore'):
+            ema12, _ = ewm_step(*carry['ema12'], S['close'][:, -1], span=12)
+            ema26, _ = ewm_step(*carry['ema26'], S['close'][:, -1], span=26)
+            dif = ema12 - ema26
+            dea, _ = ewm_step(*carry['dea'], dif, span=9)
+            K, _ = ewm_step(*carry['K'], S['rsv'][:, -1], com=2)
+            D, _ = ewm_step(*carry['D'], K, com=2)
+            last = {'dif': dif, 'dea': dea, 'macd_bar': 2 * (dif - dea), 'K': K, 'D': D, 'J': 3 * K - 2 * D}
+        for k in SPLICED:
+            S[k] = np.concatenate([self.hist[k][idx], last[k][:, None]], axis=1)
+        table = IndicatorEngine.panel_table(S, list(range(len(idx))))
+        rows = table.index.to_numpy(dtype=int)
+        bits, k_score = KLineStrictLib.detect_panel(p['open'], p['high'], p['low'], p['close'], p['volume'],
+                                                    S['ma5'], S['ma10'], S['ma20'])
+        picked = idx[rows]
+        return AlphaGalaxyOmni.score_table([args[i] for i in picked], table, bits[rows, -1], k_score[rows, -1],
+                                           np.full(len(picked), self.today), self.app.params), picked
+
+    def poll(self):
+        """一轮: 拉快照 -> 临时 K 线 -> 重算打分 -> 与上一轮比较；返回 (本轮入围表, 进出事件表, 重算只数)"""
+        with self.report.stage('spot'):
+            spot = self.app.fetch_spot(SPOT_NUMERIC)
+        with self.report.stage('intraday_score'):
+            bar, args, live, eligible = self.bar(spot)
+            table, picked = self.score(bar, args, live)
+            sel = table[table['入围'].to_numpy() & eligible[picked]].sort_values('总分', ascending=False, kind='stable')
+        return sel, self.diff(table, sel), len(table)
+
+    def diff(self, table, sel):
+        """与上一轮入围名单比较: 进入的取本轮数据，退出的取本轮打分 (停牌/无行情为空)"""
+        now = dict(zip(sel['代码'], sel['总分']))
+        entered = [s for s in now if s not in self.selected]
+        left = [s for s in self.selected if s not in now]
+        self.selected = now
+        rows = table.set_index('代码').reindex(entered + left)
+        return pd.DataFrame({
+            '代码': entered + left, '名称': [self.names[s] for s in entered + left],
+            '事件': ['进入'] * len(entered) + ['退出'] * len(left),
+            '总分': rows['总分'].to_numpy(dtype=float), '现价': rows['close'].to_numpy(dtype=float),
+            '涨幅%': rows['pct_0'].to_numpy(dtype=float).round(2),
+            '命中规则': rows['命中规则'].fillna('').to_numpy(), '买入形态': rows['买入形态'].fillna('').to_numpy(),
+        })
+
+    def show(self, stamp, sel, events, n, elapsed):
+        n_in = int((events['事件'] == '进入').sum())
+        print(f"[{stamp:%H:%M:%S}] 入围 {len(sel)} 只 (+{n_in} / -{len(events) - n_in})，重算 {n} 只用时 {elapsed:.2f}s")
+        for code, name, kind, score, price, pct in zip(*(events[k] for k in ('代码', '名称', '事件', '总分', '现价', '涨幅%'))):
+            detail = '停牌/无行情' if np.isnan(score) else f"总分 {score:.0f} 现价 {price:g} ({pct:+.2f}%)"
+            print(f"   {'+' if kind == '进入' else '-'} {code} {name} {detail}")
+
+    def write(self, stamp, events):
+        if not self.log or not len(events): return
+        events = events.assign(时间=f"{stamp:%Y-%m-%d %H:%M:%S}")
+        s = events.to_json(orient='records', lines=True, force_ascii=False)
+        with open(self.log, 'a', encoding='utf-8') as f:
+            f.write(s if s.endswith('\n') else s + '\n')
+
+    def run(self, polls=None):
+        """polls=None 时一直轮询到收盘 (收盘后启动只跑一轮)；Ctrl-C 结束"""
+        self.load()
+        print(f"2. 盘中监控 (每 {self.interval}s 一轮，{len(self.symbols)} 只)...")
+        n = 0
+        try:
+            while True:
+                t0 = time.perf_counter()
+                stamp = self.app.provider.now()
+                try:
+                    sel, events, scored = self.poll()
+                except Exception as e:
+                    self.report.error('intraday', e)
+                    print(f"[{stamp:%H:%M:%S}] 本轮失败: {e!r}")
+                else:
+                    self.show(stamp, sel, events, scored, time.perf_counter() - t0)
+                    self.write(stamp, events)
+                n += 1
+                if (n >= polls) if polls is not None else stamp.hour >= MARKET_CLOSE_HOUR: break
+                time.sleep(max(0.0, self.interval - (time.perf_counter() - t0)))
+        except KeyboardInterrupt:
+            pass
+        self.report.info['polls'] = n
+        self.report.info['selected'] = len(self.selected)
+        return self.selected
+
+
+if __name__ == "__main__":
+    from providers import make_provider
+    parser = argparse.ArgumentParser(description='盘中监控: 按快照节奏重算得分，输出入围名单变化')
+    parser.add_argument('--interval', type=float, default=60, help='轮询间隔 (秒)')
+    parser.add_argument('--polls', type=int, default=None, help='最多轮询几轮 (默认到收盘为止)')
+    parser.add_argument('--store', default=None, help='本地行情仓库目录 (默认 price_store；回放模式默认不用)')
+    parser.add_argument('--no-store', action='store_true', help='不使用本地仓库，启动时全量下载')
+    parser.add_argument('--concurrency', type=int, default=8, help='启动拉历史的起始并发 (自适应调整)')
+    parser.add_argument('--rate', type=float, default=20, help='全局限速: 每秒最多请求数')
+    parser.add_argument('--provider', choices=['akshare', 'replay'], default='akshare', help='数据源')
+    parser.add_argument('--replay-dir', help='回放数据目录 (--provider replay)')
+    parser.add_argument('--params', help='打分参数 JSON (同 main.py --params)')
+    parser.add_argument('--log', default=None, help='进出事件日志 ndjson (默认 Intraday_<日期>.ndjson)')
+    args = parser.parse_args()
+
+    provider = make_provider(args.provider, args.replay_dir, timeout=30)
+    store_dir = None if args.no_store or (args.provider == 'replay' and args.store is None) else (args.store or 'price_store')
+    app = AlphaGalaxyOmni(store_dir=store_dir, concurrency=args.concurrency, rate=args.rate, provider=provider,
+                          params=rules.load_params(args.params) if args.params else None)
+    stem = f"Intraday_{provider.now():%Y%m%d}"
+    app.report.info.update(provider=provider.name, interval=args.interval, params=app.params._asdict())
+    watch = IntradayWatch(app, args.interval, log=args.log or f"{stem}.ndjson")
+    try:
+        watch.run(args.polls)
+    finally:
+        path = app.report.save(f"{stem}.json")
+        print(f"   环节耗时: {app.report.summary()}")
+        print(f"📄 运行报告已保存至: {path}")
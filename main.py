@@ -9,598 +9,1064 @@ Features:
 5. NLP 舆情风控
 6. Excel 完整字典导出 (补全了历史CMF和涨幅数据及所有形态图解)
 7. 新增：MACD状态与KDJ状态详解 (金叉/死叉/红绿柱伸缩)
+8. 子命令 scan (缺省，--shard / --local-shards 分片扫描，见 shard.py) / merge / score / export / sentiment / bench；pandas、tqdm、SnowNLP 等重依赖用到时才导入
+9. 市场环境 (context.py): 快照之后算一次市场状态/板块强度/横截面分位，只读共享给打分；--risk-off 可在 risk_off 日拉日线前收缩或跳过
 """
 
-import akshare as ak
-import pandas as pd
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm
 import warnings
 from datetime import datetime, timedelta
-from snownlp import SnowNLP
+import os
+import json
 import time
+from store import PriceStore, date_to_int, dates_to_int, last_trading_day
+from streaming import StreamingIndicatorEngine
+from fetcher import FetchScheduler
+from providers import AkshareProvider, make_provider
+from instrument import RunReport
+from sentiment import KeywordAutomaton, HeadlineCache, soft_sentiment, use_model, model_dir
+from compute import ComputePool, attach
+from export import FORMATS, ScoreWriter, save_workbook
+from checkpoint import RunCheckpoint
+from market import MarketData
+from context import MarketContext, GATE_MODES, empty_env, load_sectors
+import rules
+import shard
+from rolling import shift, rolling_sum, rolling_mean, rolling_std, rolling_mad, rolling_min, rolling_max, ewm_mean
 
 # 配置
 warnings.filterwarnings('ignore')
 
+
+class _Lazy:
+    """类属性第一次被访问时才求值，之后换成结果本身 (规则/形态表的编译推迟到第一次打分，import 与 --help 不付这笔开销)"""
+
+    def __init__(self, build, static=False):
+        self.build, self.static = build, static
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner):
+        value = self.build()
+        setattr(owner, self.name, staticmethod(value) if self.static else value)
+        return value
+
+
 # ==========================================
 # 1. 舆情分析引擎 (NLP Sentiment)
 # ==========================================
 class SentimentEngine:
+    # 关键词硬匹配: 每条标题每个关键词最多计一次
+    POS_KW = ['增长', '预增', '突破', '利好', '回购', '获批', '中标', '大涨', '新高']
+    NEG_KW = ['立案', '调查', '亏损', '减持', '警示', '违规', '大跌', '退市', '被查']
+    matcher = KeywordAutomaton(POS_KW + NEG_KW)
+    # SnowNLP 逐条标题缓存；load_cache 换成落盘版
+    cache = HeadlineCache()
+
     @staticmethod
-    def analyze(symbol):
+    def load_cache(path):
+        SentimentEngine.cache = HeadlineCache(path)
+        # SnowNLP 模型预编译一份放在缓存旁，之后每次运行免去约 4 秒的 import snownlp
+        use_model(model_dir(path))
+
+    @staticmethod
+    def analyze(symbol, provider=None, report=None):
         try:
-            news_df = ak.stock_news_em(symbol=symbol)
-            if news_df is None or news_df.empty:
-                return 0, "无近期舆情"
-            
-            recent_news = news_df.head(10)
-            titles = recent_news['新闻标题'].tolist()
-            full_text = "。".join(titles)
-            
-            # 关键词硬匹配
-            pos_kw = ['增长', '预增', '突破', '利好', '回购', '获批', '中标', '大涨', '新高']
-            neg_kw = ['立案', '调查', '亏损', '减持', '警示', '违规', '大跌', '退市', '被查']
-            
-            hard_score = 0
-            keywords = []
-            
-            for t in titles:
-                for kw in pos_kw:
-                    if kw in t: 
-                        hard_score += 2
-                        keywords.append(kw)
-                for kw in neg_kw:
-                    if kw in t: 
-                        hard_score -= 10 
-                        keywords.append(kw)
-            
-            # NLP 软匹配
-            s = SnowNLP(full_text)
-            soft_score = (s.sentiments - 0.5) * 10
-            
-            total_score = hard_score + soft_score
-            total_score = max(min(total_score, 20), -20)
-            
-            summary = f"关键词:{list(set(keywords))}" if keywords else "舆情平稳"
-            return round(total_score, 1), summary
-        except Exception:
+            t0 = time.perf_counter()
+            news_df = (provider or AkshareProvider()).news(symbol)
+            if report: report.latency('news', time.perf_counter() - t0)
+            return SentimentEngine.score(news_df)
+        except Exception as e:
+            if report: report.error('sentiment', e)
             return 0, "舆情获取失败"
 
-# ==========================================
-# 2. 严谨K线形态识别引擎 (30+种 - 完整扩充版)
-# ==========================================
-class KLineStrictLib:
     @staticmethod
-    def detect(df):
-        if len(df) < 30: return 0, [], []
+    def score(news_df):
+        if news_df is None or news_df.empty:
+            return 0, "无近期舆情"
         
-        # 数据准备
-        c = df['close']; o = df['open']; h = df['high']; l = df['low']; v = df['volume']
-        ma5, ma10, ma20 = df['ma5'], df['ma10'], df['ma20']
+        titles = news_df.head(10)['新闻标题'].tolist()
+        kws = SentimentEngine.POS_KW + SentimentEngine.NEG_KW
+        n_pos = len(SentimentEngine.POS_KW)
         
-        # 实体大小与影线
-        body = np.abs(c - o)
-        upper_s = h - np.maximum(c, o)
-        lower_s = np.minimum(c, o) - l
-        avg_body = body.rolling(10).mean()
+        hard_score = 0
+        keywords = []
         
-        def get(s, i): return s.iloc[i]
+        for t in titles:
+            for i in sorted(SentimentEngine.matcher.find(t)):
+                hard_score += 2 if i < n_pos else -10
+                keywords.append(kws[i])
         
-        buy_pats, risk_pats = [], []
-        score = 0
+        # NLP 软匹配 (逐条标题缓存，合起来等价于整段 SnowNLP)
+        soft_score = (soft_sentiment(titles, SentimentEngine.cache) - 0.5) * 10
         
-        # ==================== A. 底部/反转 (买入) ====================
+        total_score = hard_score + soft_score
+        total_score = max(min(total_score, 20), -20)
         
-        # 1. 早晨之星 (经典)
-        if (get(c,-3)<get(o,-3)) and (get(body,-3)>get(avg_body,-3)) and (get(h,-2)<get(l,-3)) and (get(c,-1)>get(o,-1)) and (get(c,-1)>(get(o,-3)+get(c,-3))/2):
-            buy_pats.append("早晨之星"); score += 20
-            
-        # 2. 锤子线
-        if (get(l,-1)==l.iloc[-5:].min()) and (get(lower_s,-1)>=2*get(body,-1)) and (get(upper_s,-1)<=0.1*get(body,-1)):
-            buy_pats.append("锤子线"); score += 15
-            
-        # 3. 倒锤头
-        if (get(l,-1)==l.iloc[-5:].min()) and (get(upper_s,-1)>=2*get(body,-1)) and (get(lower_s,-1)<=0.1*get(body,-1)):
-            buy_pats.append("倒锤头"); score += 10
-            
-        # 4. 阳包阴
-        if (get(c,-2)<get(o,-2)) and (get(c,-1)>get(o,-1)) and (get(o,-1)<get(c,-2)) and (get(c,-1)>get(o,-2)):
-            buy_pats.append("阳包阴"); score += 20
-            
-        # 5. 曙光初现
-        if (get(c,-2)<get(o,-2)) and (get(body,-2)>get(avg_body,-2)) and (get(o,-1)<get(l,-2)) and (get(c,-1)>(get(o,-2)+get(c,-2))/2):
-            buy_pats.append("曙光初现"); score += 15
-            
-        # 6. 平底 (新增)
-        if abs(get(l,-1)-get(l,-2)) < (get(c,-1)*0.003) and (get(l,-1) <= l.iloc[-10:].min()):
-            buy_pats.append("平底"); score += 15
-            
-        # 7. 多头孕线 (原身怀六甲)
-        if (get(c,-2)<get(o,-2)) and (get(body,-2)>get(avg_body,-2)) and (get(c,-1)>get(o,-1)) and (get(h,-1)<get(h,-2)) and (get(l,-1)>get(l,-2)):
-            buy_pats.append("多头孕线"); score += 15
-            
-        # 8. 旭日东升 (新增 - 强反转)
-        # 前日大阴，今日高开高走，收盘高于前日开盘
-        if (get(c,-2)<get(o,-2)) and (get(body,-2)>get(avg_body,-2)*1.2) and (get(o,-1)>get(c,-2)) and (get(c,-1)>get(o,-2)):
-            buy_pats.append("旭日东升"); score += 25
-            
-        # 9. 岛形反转(底) (新增 - 极强)
-        # 前几天向下跳空，中间盘整，今日向上跳空
-        if (get(h,-2) < get(l,-3)) and (get(l,-1) > get(h,-2)): 
-            buy_pats.append("岛形反转(底)"); score += 35
-            
-        # 10. 踢脚线 (新增)
-        # 只有下影线没有上影线，大阳
-        if (get(upper_s,-1) == 0) and (get(lower_s,-1) > 0) and (get(c,-1)>get(o,-1)) and (get(o,-1) > get(h,-2)):
-            buy_pats.append("踢脚线"); score += 20
-            
-        # 11. 蜻蜓点水 (新增)
-        # 低点触碰MA20/30后拉起
-        if (get(l,-1) <= get(ma20,-1)) and (min(get(o,-1), get(c,-1)) > get(ma20,-1)) and (get(c,-1)>get(o,-1)):
-            buy_pats.append("蜻蜓点水"); score += 15
+        summary = f"关键词:{list(dict.fromkeys(keywords))}" if keywords else "舆情平稳"
+        return round(total_score, 1), summary
 
-        # ==================== B. 攻击/突破 (买入) ====================
-        
-        # 12. 红三兵
-        if (get(c,-3)>get(o,-3)) and (get(c,-2)>get(o,-2)) and (get(c,-1)>get(o,-1)) and (get(c,-1)>get(c,-2)>get(c,-3)):
-            buy_pats.append("红三兵"); score += 15
-            
-        # 13. 上升三法
-        if (get(c,-5)>get(o,-5)) and (get(body,-5)>get(avg_body,-5)) and (get(c,-4)<get(o,-4)) and (get(c,-3)<get(o,-3)) and (get(c,-2)<get(o,-2)) and (get(c,-1)>get(o,-1)) and (get(c,-1)>get(c,-5)):
-            buy_pats.append("上升三法"); score += 25
-            
-        # 14. 多方炮
-        if (get(c,-3)>get(o,-3)) and (get(c,-2)<get(o,-2)) and (get(c,-1)>get(o,-1)) and (get(c,-1)>get(c,-3)):
-            buy_pats.append("多方炮"); score += 20
-            
-        # 15. 向上缺口 (跳空缺口)
-        if get(l,-1)>get(h,-2):
-            buy_pats.append("向上缺口"); score += 15
-            
-        # 16. 一阳穿三线
-        if (get(c,-1)>max(get(ma5,-1),get(ma10,-1),get(ma20,-1))) and (get(o,-1)<min(get(ma5,-1),get(ma10,-1),get(ma20,-1))):
-            buy_pats.append("一阳穿三线"); score += 25
-            
-        # 17. 倍量过左峰
-        if (get(v,-1)>get(v,-2)*1.9) and (get(c,-1)>=c.iloc[-20:].max()):
-            buy_pats.append("倍量过左峰"); score += 20
-            
-        # 18. 金蜘蛛
-        diff = max(get(ma5,-1),get(ma10,-1),get(ma20,-1)) - min(get(ma5,-1),get(ma10,-1),get(ma20,-1))
-        if (diff/get(c,-1)<0.015) and (get(c,-1)>get(ma5,-1)) and (get(c,-1)>get(o,-1)):
-            buy_pats.append("金蜘蛛"); score += 15
-            
-        # 19. 仙人指路
-        if (get(upper_s,-2)>get(body,-2)) and (get(c,-1)>get(h,-2)) and (get(c,-1)>get(o,-1)):
-            buy_pats.append("仙人指路"); score += 15
+    @staticmethod
+    def analyze_many(symbols, provider, scheduler, report=None):
+        """新闻走调度器并发拉取 (限速 + 重试)，打分在主线程按完成顺序进行；返回 {代码: (得分, 说明)}"""
+        out = {}
+        for res in scheduler.stream(symbols, provider.news):
+            if report: report.latency('news_e2e', res.latency)
+            if res.status == 'error':
+                if report: report.error('sentiment', res.error)
+                out[res.item] = (0, "舆情获取失败")
+                continue
+            try:
+                out[res.item] = SentimentEngine.score(res.value)
+            except Exception as e:
+                if report: report.error('sentiment', e)
+                out[res.item] = (0, "舆情获取失败")
+        if report:
+            for t in scheduler.latencies: report.latency('news', t)
+        SentimentEngine.cache.save()
+        return out
 
-        # ==================== C. 风险形态 (卖出/否决) ====================
-        
-        # 20. 黄昏之星
-        if (get(c,-3)>get(o,-3)) and (get(l,-2)>get(h,-3)) and (get(c,-1)<get(o,-1)) and (get(c,-1)<(get(o,-3)+get(c,-3))/2):
-            risk_pats.append("风险:黄昏之星"); score -= 30
-            
-        # 21. 乌云盖顶
-        if (get(c,-2)>get(o,-2)) and (get(c,-1)<get(o,-1)) and (get(o,-1)>get(h,-2)) and (get(c,-1)<(get(o,-2)+get(c,-2))/2):
-            risk_pats.append("风险:乌云盖顶"); score -= 25
-            
-        # 22. 阴包阳
-        if (get(c,-2)>get(o,-2)) and (get(c,-1)<get(o,-1)) and (get(o,-1)>get(c,-2)) and (get(c,-1)<get(o,-2)):
-            risk_pats.append("风险:阴包阳"); score -= 25
-            
-        # 23. 三只乌鸦
-        if (get(c,-1)<get(o,-1)) and (get(c,-2)<get(o,-2)) and (get(c,-3)<get(o,-3)):
-            risk_pats.append("风险:三只乌鸦"); score -= 30
-            
-        # 24. 射击之星
-        if (get(upper_s,-1)>2*get(body,-1)) and (get(lower_s,-1)<0.1*get(body,-1)) and (get(c,-1)>get(c,-20)*1.15):
-            risk_pats.append("风险:射击之星"); score -= 20
-            
-        # 25. 吊颈线
-        if (get(lower_s,-1)>2*get(body,-1)) and (get(upper_s,-1)<0.1*get(body,-1)) and (get(c,-1)>get(c,-20)*1.15):
-            risk_pats.append("风险:吊颈线"); score -= 20
-            
-        # 26. 断头铡刀
-        if (get(c,-1)<min(get(ma5,-1),get(ma10,-1),get(ma20,-1))) and (get(o,-1)>max(get(ma5,-1),get(ma10,-1),get(ma20,-1))):
-            risk_pats.append("风险:断头铡刀"); score -= 40
-            
-        # 27. 向下缺口
-        if get(h,-1)<get(l,-2):
-            risk_pats.append("风险:向下缺口"); score -= 20
-            
-        # 28. 倾盆大雨 (新增)
-        # 低开低走大阴线，收盘低于前日开盘
-        if (get(c,-2)>get(o,-2)) and (get(o,-1)<get(c,-2)) and (get(c,-1)<get(o,-2)) and (get(c,-1)<get(o,-1)):
-            risk_pats.append("风险:倾盆大雨"); score -= 25
-            
-        # 29. 空头孕线 (新增)
-        if (get(c,-2)>get(o,-2)) and (get(body,-2)>get(avg_body,-2)) and (get(c,-1)<get(o,-1)) and (get(h,-1)<get(h,-2)) and (get(l,-1)>get(l,-2)) and (get(c,-1)>get(c,-20)*1.1):
-            risk_pats.append("风险:空头孕线"); score -= 20
-            
-        # 30. 岛形反转(顶) (新增 - 极度危险)
-        if (get(l,-2) > get(h,-3)) and (get(h,-1) < get(l,-2)):
-            risk_pats.append("风险:岛形反转(顶)"); score -= 50
-            
-        # 31. 墓碑线 (新增)
-        # 倒T字，高位，多头力竭
-        if (get(body,-1) < 0.005*get(c,-1)) and (get(upper_s,-1) > 3*get(body,-1)) and (get(lower_s,-1) < get(body,-1)) and (get(c,-1) > get(c,-20)*1.2):
-            risk_pats.append("风险:墓碑线"); score -= 30
+# ==========================================
+# 2. 严谨K线形态识别引擎 (30+种 - 完整扩充版)
+# ==========================================
+class KLineStrictLib:
+    # 形态表 (名称, 分值)：由 rules.PATTERNS 生成，顺序即位掩码的位序；风险形态名称加 "风险:" 前缀
+    PATTERNS = [(("风险:" if p.weight < 0 else "") + p.name, p.weight) for p in rules.PATTERNS]
+    MIN_BARS = 30
+    RISK_MASK = sum(1 << i for i, (_, w) in enumerate(PATTERNS) if w < 0)
+    # 整张形态表编译成一个向量化函数 (滞后序列只算一次)
+    _compiled = _Lazy(lambda: rules.compile_patterns(rules.PATTERNS, rules.PATTERN_INPUTS, rules.SERIES))
 
+    @staticmethod
+    def detect(df):
+        """单只股票最后一根 K 线的形态 (只取最后 30 根，结果与整段计算逐位一致)"""
+        return KLineStrictLib.decode(KLineStrictLib.detect_bits(df))
+
+    @staticmethod
+    def detect_bits(df):
+        """单只股票最后一根 K 线的形态位掩码"""
+        if len(df) < KLineStrictLib.MIN_BARS: return 0
+        tail = df.iloc[-KLineStrictLib.MIN_BARS:]
+        arr = lambda k: tail[k].to_numpy(dtype=float)[None, :]
+        # 没跑过 calculate 的 df 直接在尾部 30 根上补算均线 (窗口 ≤ 20，结果与整段一致)
+        ma = lambda w: arr(f'ma{w}') if f'ma{w}' in tail else rolling_mean(arr('close'), w)
+        bits, _ = KLineStrictLib.detect_panel(
+            arr('open'), arr('high'), arr('low'), arr('close'), arr('volume'), ma(5), ma(10), ma(20))
+        return int(bits[0, -1])
+
+    @staticmethod
+    def detect_market(md, rows=None):
+        """紧凑行情容器 (market.MarketData) 上每只最后一根 K 线的形态位掩码与得分；只解码尾部 30 根"""
+        p = md.panel(rows, tail=KLineStrictLib.MIN_BARS)
+        c = p['close']
+        bits, k_score = KLineStrictLib.detect_panel(p['open'], p['high'], p['low'], c, p['volume'],
+                                                    rolling_mean(c, 5), rolling_mean(c, 10), rolling_mean(c, 20))
+        return bits[:, -1], k_score[:, -1]
+
+    @staticmethod
+    def decode(bits):
+        """位掩码 -> (形态得分, 买入形态, 风险形态)"""
+        bits = int(bits)
+        score, buy_pats, risk_pats = 0, [], []
+        for i, (name, w) in enumerate(KLineStrictLib.PATTERNS):
+            if bits >> i & 1:
+                (buy_pats if w > 0 else risk_pats).append(name)
+                score += w
         return score, buy_pats, risk_pats
 
+    @staticmethod
+    def detect_panel(o, h, l, c, v, ma5, ma10, ma20):
+        """(股票 × 日期) 面板上逐根 K 线判定全部形态，返回 (位掩码, 形态得分) 两个同形状数组"""
+        # 历史不足 30 根的 K 线不判定 (与 detect 的长度门槛一致)
+        enough = np.cumsum(~np.isnan(c), axis=1) >= KLineStrictLib.MIN_BARS
+        return KLineStrictLib._compiled(o, h, l, c, v, ma5, ma10, ma20, enough)
+
 # ==========================================
 # 3. 高级指标计算引擎 (已补全：布林上下轨 + 历史涨幅/CMF + 历史MACD/KDJ)
 # ==========================================
 class IndicatorEngine:
+    # calculate / panel_table 输出的因子键 (全市场打分表按这个顺序出列)
+    FACTORS = ('close', 'ma20', 'ma60', 'atr', 'adx', 'macd_dif', 'macd_dea', 'dif_0', 'dif_1', 'dea_0', 'dea_1',
+               'macd_bar_0', 'macd_bar_1', 'cci', 'rsi', 'j_val', 'k_0', 'k_1', 'd_0', 'd_1', 'bias',
+               'bb_width', 'bb_up', 'bb_low', 'cmf_0', 'cmf_1', 'cmf_2', 'pct_0', 'pct_1', 'pct_2', 'vol_ratio')
+
     @staticmethod
     def calculate(df):
+        """单只股票: 与面板模式共用同一套向量化算子，等价于一行的 calculate_panel"""
         if len(df) < 60: return None
-        c = df['close']; h = df['high']; l = df['low']; v = df['volume']
-        
-        # 均线
-        ma5=c.rolling(5).mean(); ma10=c.rolling(10).mean(); ma20=c.rolling(20).mean(); ma60=c.rolling(60).mean()
-        df['ma5'], df['ma10'], df['ma20'] = ma5, ma10, ma20
-        
-        # 量比计算
-        vol_ma5 = v.rolling(5).mean()
-        vol_ratio = v / vol_ma5.replace(0, 1)
-        
-        # CMF 资金流
-        mf_mult = ((c - l) - (h - c)) / (h - l).replace(0, 0.01)
-        cmf_series = (mf_mult * v).rolling(20).sum() / v.rolling(20).sum()
-        
-        # KDJ
-        low_min = l.rolling(9).min(); high_max = h.rolling(9).max()
-        rsv = (c - low_min) / (high_max - low_min) * 100
-        K = rsv.ewm(com=2, adjust=False).mean()
-        D = K.ewm(com=2, adjust=False).mean()
-        J = 3 * K - 2 * D
-        
-        # 布林带 [UPDATED for Combo C]
-        std20 = c.rolling(20).std()
-        boll_up = ma20 + 2 * std20
-        boll_low = ma20 - 2 * std20
-        bb_width = (boll_up - boll_low) / ma20
-        
-        bias = (c - ma20) / ma20 * 100
-        
-        # CCI
-        tp = (h + l + c) / 3
-        cci = (tp - tp.rolling(14).mean()) / (0.015 * tp.rolling(14).apply(lambda x: np.mean(np.abs(x - np.mean(x))), raw=True))
-        
-        # ATR & RSI
-        tr = pd.concat([h - l, abs(h - c.shift(1)), abs(l - c.shift(1))], axis=1).max(axis=1)
-        atr = tr.rolling(14).mean()
-        delta = c.diff(); gain = (delta.where(delta > 0, 0)).rolling(14).mean(); loss = (-delta.where(delta < 0, 0)).rolling(14).mean()
-        rsi = 100 - (100 / (1 + gain/loss))
-
-        # ADX
-        up = h - h.shift(1); down = l.shift(1) - l
-        plus_dm = np.where((up > down) & (up > 0), up, 0.0); minus_dm = np.where((down > up) & (down > 0), down, 0.0)
-        tr_smooth = tr.rolling(14).sum()
-        plus_di = 100 * (pd.Series(plus_dm).rolling(14).sum() / tr_smooth)
-        minus_di = 100 * (pd.Series(minus_dm).rolling(14).sum() / tr_smooth)
-        dx = 100 * abs(plus_di - minus_di) / (plus_di + minus_di); adx = dx.rolling(14).mean()
-        
-        # MACD
-        exp12 = c.ewm(span=12, adjust=False).mean(); exp26 = c.ewm(span=26, adjust=False).mean()
-        dif = exp12 - exp26; dea = dif.ewm(span=9, adjust=False).mean()
-        macd_bar = 2 * (dif - dea)
+        arr = lambda k: df[k].to_numpy(dtype=float)[None, :]
+        S = IndicatorEngine.panel_series(arr('high'), arr('low'), arr('close'), arr('volume'))
+        df['ma5'], df['ma10'], df['ma20'] = S['ma5'][0], S['ma10'][0], S['ma20'][0]
+        table = IndicatorEngine.panel_table(S, [0])
+        return table.iloc[0].to_dict() if len(table) else None
+
+    @staticmethod
+    def to_panel(frames, fields=('open', 'high', 'low', 'close', 'volume')):
+        """[(代码, df), ...] -> 右对齐的 (股票 × 日期) 面板，历史较短的股票左侧补 NaN
+        df 也可以是 to_arrays 解码好的 {列: ndarray} 或 PriceStore 的结构化数组；也可直接传 market.MarketData"""
+        if isinstance(frames, MarketData): return frames.panel(fields=fields)
+        symbols = [s for s, _ in frames]
+        lens = [len(df['close']) for _, df in frames]
+        T = max(lens, default=0)
+        panel = {'symbols': symbols}
+        for f in fields:
+            arr = np.full((len(frames), T), np.nan)
+            for i, (_, df) in enumerate(frames):
+                if lens[i]: arr[i, T - lens[i]:] = np.asarray(df[f], dtype=float)
+            panel[f] = arr
+        dates = np.zeros((len(frames), T), dtype=np.int64)
+        for i, (_, df) in enumerate(frames):
+            if not lens[i]: continue
+            d = np.asarray(df['date'])
+            dates[i, T - lens[i]:] = d if np.issubdtype(d.dtype, np.integer) else dates_to_int(d)
+        panel['date'] = dates
+        return panel
+
+    @staticmethod
+    def to_arrays(df):
+        """日线 DataFrame -> {列: ndarray} (日期为 yyyymmdd 整数)，拉取线程里解码，计算侧不再碰 DataFrame"""
+        out = {f: df[f].to_numpy(dtype=float) for f in ('open', 'high', 'low', 'close', 'volume')}
+        out['date'] = dates_to_int(df['date'])
+        return out
+
+    @staticmethod
+    def panel_series(h, l, c, v):
+        """全部指标的完整二维序列 (calculate / calculate_panel 共用这一套公式)"""
+        valid = ~np.isnan(c)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # 均线
+            ma5 = rolling_mean(c, 5); ma10 = rolling_mean(c, 10); ma20 = rolling_mean(c, 20); ma60 = rolling_mean(c, 60)
+
+            # 量比计算
+            vol_ma5 = rolling_mean(v, 5)
+            vol_ratio = v / np.where(vol_ma5 == 0, 1, vol_ma5)
+
+            # CMF 资金流
+            hl = h - l
+            mf_mult = ((c - l) - (h - c)) / np.where(hl == 0, 0.01, hl)
+            cmf = rolling_sum(mf_mult * v, 20) / rolling_sum(v, 20)
+
+            # KDJ
+            low_min = rolling_min(l, 9); high_max = rolling_max(h, 9)
+            rsv = (c - low_min) / (high_max - low_min) * 100
+            K = ewm_mean(rsv, com=2)
+            D = ewm_mean(K, com=2)
+            J = 3 * K - 2 * D
+
+            # 布林带 [UPDATED for Combo C]
+            std20 = rolling_std(c, 20)
+            boll_up = ma20 + 2 * std20
+            boll_low = ma20 - 2 * std20
+            bb_width = (boll_up - boll_low) / ma20
+            bias = (c - ma20) / ma20 * 100
+
+            # CCI (滑动平均绝对离差，替代逐根调用的 lambda)
+            tp = (h + l + c) / 3
+            cci = (tp - rolling_mean(tp, 14)) / (0.015 * rolling_mad(tp, 14))
+
+            # ATR & RSI
+            pc = shift(c)
+            tr = np.fmax(np.fmax(h - l, np.abs(h - pc)), np.abs(l - pc))
+            atr = rolling_mean(tr, 14)
+            delta = c - pc
+            # 左侧补齐区置 NaN，避免补位的 0 混进滚动窗口
+            gain = np.where(valid, np.where(delta > 0, delta, 0.0), np.nan)
+            loss = np.where(valid, np.where(delta < 0, -delta, 0.0), np.nan)
+            rsi = 100 - (100 / (1 + rolling_mean(gain, 14) / rolling_mean(loss, 14)))
+
+            # ADX
+            up = h - shift(h); down = shift(l) - l
+            plus_dm = np.where(valid, np.where((up > down) & (up > 0), up, 0.0), np.nan)
+            minus_dm = np.where(valid, np.where((down > up) & (down > 0), down, 0.0), np.nan)
+            tr_smooth = rolling_sum(tr, 14)
+            plus_di = 100 * (rolling_sum(plus_dm, 14) / tr_smooth)
+            minus_di = 100 * (rolling_sum(minus_dm, 14) / tr_smooth)
+            dx = 100 * np.abs(plus_di - minus_di) / (plus_di + minus_di)
+            adx = rolling_mean(dx, 14)
+
+            # MACD
+            ema12 = ewm_mean(c, span=12); ema26 = ewm_mean(c, span=26)
+            dif = ema12 - ema26
+            dea = ewm_mean(dif, span=9)
+            macd_bar = 2 * (dif - dea)
+            pct = (c / pc - 1) * 100
 
-        curr = df.iloc[-1]
-        pct_change = c.pct_change() * 100
-        
         return {
-            'close': curr['close'], 'ma20': ma20.iloc[-1], 'ma60': ma60.iloc[-1],
-            'atr': atr.iloc[-1], 'adx': adx.iloc[-1], 
-            'macd_dif': dif.iloc[-1], 'macd_dea': dea.iloc[-1],
-            
-            # [Added] 历史MACD数据用于状态判断
-            'dif_0': dif.iloc[-1], 'dif_1': dif.iloc[-2],
-            'dea_0': dea.iloc[-1], 'dea_1': dea.iloc[-2],
-            'macd_bar_0': macd_bar.iloc[-1], 'macd_bar_1': macd_bar.iloc[-2],
-            
-            'cci': cci.iloc[-1], 'rsi': rsi.iloc[-1], 
-            
-            # [Added] KDJ历史数据
-            'j_val': J.iloc[-1], 
-            'k_0': K.iloc[-1], 'k_1': K.iloc[-2],
-            'd_0': D.iloc[-1], 'd_1': D.iloc[-2],
-            
-            'bias': bias.iloc[-1], 
-            'bb_width': bb_width.iloc[-1], 'bb_up': boll_up.iloc[-1], 'bb_low': boll_low.iloc[-1],
-            
-            # [RESTORED] 补全历史数据返回
-            'cmf_0': cmf_series.iloc[-1], 'cmf_1': cmf_series.iloc[-2], 'cmf_2': cmf_series.iloc[-3],
-            'pct_0': pct_change.iloc[-1], 'pct_1': pct_change.iloc[-2], 'pct_2': pct_change.iloc[-3],
-            
-            'vol_ratio': vol_ratio.iloc[-1] 
+            'close': c, 'ma5': ma5, 'ma10': ma10, 'ma20': ma20, 'ma60': ma60, 'vol_ratio': vol_ratio,
+            'cmf': cmf, 'rsv': rsv, 'K': K, 'D': D, 'J': J, 'bb_up': boll_up, 'bb_low': boll_low, 'bb_width': bb_width,
+            'bias': bias, 'cci': cci, 'atr': atr, 'rsi': rsi, 'adx': adx, 'ema12': ema12, 'ema26': ema26,
+            'dif': dif, 'dea': dea, 'macd_bar': macd_bar, 'pct': pct,
         }
 
+    @staticmethod
+    def panel_table(S, symbols, col=-1):
+        """取面板第 col 根 K 线的截面，键与 calculate 返回的字典一致；历史不足 60 根的股票剔除"""
+        import pandas as pd
+        at = lambda k, lag=0: S[k][:, col - lag] if col - lag >= -S[k].shape[1] else np.full(len(symbols), np.nan)
+        table = pd.DataFrame({
+            'close': at('close'), 'ma20': at('ma20'), 'ma60': at('ma60'),
+            'atr': at('atr'), 'adx': at('adx'),
+            'macd_dif': at('dif'), 'macd_dea': at('dea'),
+            'dif_0': at('dif'), 'dif_1': at('dif', 1),
+            'dea_0': at('dea'), 'dea_1': at('dea', 1),
+            'macd_bar_0': at('macd_bar'), 'macd_bar_1': at('macd_bar', 1),
+            'cci': at('cci'), 'rsi': at('rsi'),
+            'j_val': at('J'),
+            'k_0': at('K'), 'k_1': at('K', 1),
+            'd_0': at('D'), 'd_1': at('D', 1),
+            'bias': at('bias'),
+            'bb_width': at('bb_width'), 'bb_up': at('bb_up'), 'bb_low': at('bb_low'),
+            'cmf_0': at('cmf'), 'cmf_1': at('cmf', 1), 'cmf_2': at('cmf', 2),
+            'pct_0': at('pct'), 'pct_1': at('pct', 1), 'pct_2': at('pct', 2),
+            'vol_ratio': at('vol_ratio'),
+        }, index=symbols)
+        n_bars = (~np.isnan(S['close'][:, :S['close'].shape[1] + col + 1])).sum(axis=1)
+        return table[n_bars >= 60]
+
+    @staticmethod
+    def calculate_market(md, rows=None, chunk=500):
+        """紧凑行情容器上逐块算最后一根的因子表 (以代码为索引)，面板只在块内展开"""
+        import pandas as pd
+        rows = np.arange(len(md)) if rows is None else np.asarray(rows)
+        tables = []
+        for i in range(0, len(rows), chunk):
+            p = md.panel(rows[i:i + chunk], fields=('high', 'low', 'close', 'volume'))
+            tables.append(IndicatorEngine.panel_table(IndicatorEngine.panel_series(p['high'], p['low'], p['close'], p['volume']),
+                                                      p['symbols']))
+        return pd.concat(tables) if tables else pd.DataFrame(columns=list(IndicatorEngine.FACTORS))
+
+    @staticmethod
+    def calculate_panel(o, h, l, c, v, symbols=None):
+        """全市场一次算完: 返回以代码为索引的列式表，列名与 calculate 的字典键一致"""
+        symbols = list(symbols) if symbols is not None else list(range(len(c)))
+        return IndicatorEngine.panel_table(IndicatorEngine.panel_series(h, l, c, v), symbols)
+
 # ==========================================
 # 4. Excel 导出引擎 (更新：包含30+种形态说明 & 新增MACD/KDJ状态列)
 # ==========================================
 class ExcelExporter:
+    # 指标说明
+    INDICATORS_DESC = [
+        ['量比', '量能变化', '>1.5为放量；0.5-1.0为缩量(锁筹)'],
+        ['市盈率(PE)', '估值', '0<PE<20为低估值(优)；PE<0为亏损(差)'],
+        ['市净率(PB)', '资产价格', 'PB>10可能高估'],
+        ['CMF', '资金流', '正值越大说明主力吸筹越明显'],
+        ['J值 (KDJ)', '超买超卖', 'J<0为超卖(抄底)，J>100为超买(风险)'],
+        ['布林带宽', '变盘前兆', '数值越小(<0.10)说明筹码越集中，即将变盘'],
+        ['BIAS', '乖离率', '正值过大要回调，负值过大有反弹'],
+        ['ADX', '趋势强度', '>25表示趋势强劲；<20表示震荡'],
+        ['RSI', '强弱指标', '50-80为强势区，>80过热'],
+        ['换手率', '活跃度', '3%-10%健康；>15%且滞涨则危险'],
+        ['CCI', '爆发力', '>100表示加速'],
+        ['MACD状态', '趋势判断', '红柱伸长表加速上涨，绿柱缩短表止跌反弹'],
+        ['KDJ状态', '短线买卖', '低位金叉为买点，高位死叉为卖点']
+    ]
+    COLUMNS = [
+        '代码', '名称', '总分', '现价', '建议买入区间', '止损价', '止盈价', 
+        '买入形态', '风险形态', '舆情分析', '得分详情', 
+        'MACD状态', 'KDJ状态', # [New Columns]
+        '换手率%', '量比', '市盈率', '市净率', 
+        'J值', 'RSI', 'BIAS(%)', '布林带宽', 'ADX', 'CCI', 
+        'CMF(今)', 'CMF(昨)', 'CMF(前)', 
+        '涨幅%(今)', '涨幅%(昨)', '涨幅%(前)'
+    ]
+
     @staticmethod
-    def save(df_data, filename):
+    def save(df_data, filename, params=rules.DEFAULT, pattern_stats=None):
+        """精选结果汇总表: openpyxl 只写模式逐行写出 (全市场明细见 export.ScoreWriter)
+        pattern_stats: pattern_index.sheet_stats() 的 (列名, {形态名: 值})，给形态图解补上历史实测胜率"""
         if df_data.empty: return
         print(f"正在生成 Excel 报表: {filename} ...")
-        
-        with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-            cols = [
-                '代码', '名称', '总分', '现价', '建议买入区间', '止损价', '止盈价', 
-                '买入形态', '风险形态', '舆情分析', '得分详情', 
-                'MACD状态', 'KDJ状态', # [New Columns]
-                '换手率%', '量比', '市盈率', '市净率', 
-                'J值', 'RSI', 'BIAS(%)', '布林带宽', 'ADX', 'CCI', 
-                'CMF(今)', 'CMF(昨)', 'CMF(前)', 
-                '涨幅%(今)', '涨幅%(昨)', '涨幅%(前)'
-            ]
-            # 确保列存在 (防呆)
-            df_export = df_data[[c for c in cols if c in df_data.columns]]
-            df_export.to_excel(writer, sheet_name='选股结果', index=False)
-            
-            # 形态图解 (完整 30+ 种)
-            patterns_desc = [
-                ['形态名称', '类型', '大白话说明'],
-                ['早晨之星', '买入-反转', '底部三日组合：阴线+星线+阳线，强力见底'],
-                ['锤子线', '买入-反转', '底部长下影线，主力试盘后拉回，支撑强'],
-                ['倒锤头', '买入-反转', '底部长上影线，主力低位试盘，抛压减轻'],
-                ['阳包阴', '买入-反转', '今日阳线完全包住昨日阴线，多头反击'],
-                ['曙光初现', '买入-反转', '大阴线后低开高走，阳线刺入阴线一半'],
-                ['平底', '买入-反转', '两日最低价相同，筑底成功'],
-                ['多头孕线', '买入-反转', '长阴包含小K线，底部孕育，变盘在即'],
-                ['旭日东升', '买入-强反转', '大阴线后高开高走，收盘价高于前日开盘'],
-                ['岛形反转(底)', '买入-强反转', '下跌缺口+盘整+上涨缺口，超强反转'],
-                ['踢脚线', '买入-强反转', '大阴线后直接高开高走，无上影，主力暴力反转'],
-                ['蜻蜓点水', '买入-技巧', '股价回踩均线(MA20/30)后立即弹起'],
-                ['红三兵', '买入-攻击', '连续三天阳线稳步推升'],
-                ['上升三法', '买入-持续', '大阳后接三小阴不破低，再接大阳'],
-                ['多方炮', '买入-攻击', '阳阴阳组合，洗盘结束，再次上攻'],
-                ['向上缺口', '买入-强势', '向上跳空不回补，主力强势特征'],
-                ['一阳穿三线', '买入-突破', '大阳线同时突破5/10/20均线'],
-                ['倍量过左峰', '买入-突破', '成交量翻倍且价格突破前期高点'],
-                ['金蜘蛛', '买入-突破', '均线粘合后放量向上发散'],
-                ['仙人指路', '买入-试盘', '今日大阳线突破昨日的长上影线'],
-                ['黄昏之星', '卖出-风险', '顶部三日组合：阳线+星线+阴线'],
-                ['乌云盖顶', '卖出-风险', '大阳后接大阴，吃掉一半涨幅'],
-                ['阴包阳', '卖出-风险', '空头吞噬，阴线包住阳线'],
-                ['三只乌鸦', '卖出-风险', '连续三根阴线杀跌'],
-                ['射击之星', '卖出-风险', '高位长上影线，冲高回落'],
-                ['吊颈线', '卖出-风险', '高位长下影线，主力诱多'],
-                ['断头铡刀', '卖出-风险', '一阴断多线，趋势崩塌'],
-                ['向下缺口', '卖出-风险', '向下跳空不回补，极弱势'],
-                ['倾盆大雨', '卖出-风险', '低开低走大阴线，吞没前日涨幅'],
-                ['空头孕线', '卖出-风险', '高位长阳包含小K线，滞涨信号'],
-                ['岛形反转(顶)', '卖出-风险', '上涨缺口+盘整+下跌缺口，见顶信号'],
-                ['墓碑线', '卖出-风险', '高位T字线，多头力竭'],
-                ['黄金坑', '买入-机会', '跌破布林下轨且主力资金逆势进场']
-            ]
-            pd.DataFrame(patterns_desc[1:], columns=patterns_desc[0]).to_excel(writer, sheet_name='形态图解', index=False)
-            
-            # 指标说明
-            indicators_desc = [
-                ['指标名称', '实战含义', '判断标准'],
-                ['量比', '量能变化', '>1.5为放量；0.5-1.0为缩量(锁筹)'],
-                ['市盈率(PE)', '估值', '0<PE<20为低估值(优)；PE<0为亏损(差)'],
-                ['市净率(PB)', '资产价格', 'PB>10可能高估'],
-                ['CMF', '资金流', '正值越大说明主力吸筹越明显'],
-                ['J值 (KDJ)', '超买超卖', 'J<0为超卖(抄底)，J>100为超买(风险)'],
-                ['布林带宽', '变盘前兆', '数值越小(<0.10)说明筹码越集中，即将变盘'],
-                ['BIAS', '乖离率', '正值过大要回调，负值过大有反弹'],
-                ['ADX', '趋势强度', '>25表示趋势强劲；<20表示震荡'],
-                ['RSI', '强弱指标', '50-80为强势区，>80过热'],
-                ['换手率', '活跃度', '3%-10%健康；>15%且滞涨则危险'],
-                ['CCI', '爆发力', '>100表示加速'],
-                ['MACD状态', '趋势判断', '红柱伸长表加速上涨，绿柱缩短表止跌反弹'],
-                ['KDJ状态', '短线买卖', '低位金叉为买点，高位死叉为卖点']
-            ]
-            pd.DataFrame(indicators_desc[1:], columns=indicators_desc[0]).to_excel(writer, sheet_name='指标说明书', index=False)
-            
+        # 确保列存在 (防呆)
+        cols = [c for c in ExcelExporter.COLUMNS if c in df_data.columns]
+        pattern_cols, pattern_rows = ['形态名称', '类型', '大白话说明'], rules.pattern_sheet()
+        if pattern_stats:
+            extra, values = pattern_stats
+            pattern_cols = pattern_cols + list(extra)
+            pattern_rows = [row + list(values.get(row[0], [None] * len(extra))) for row in pattern_rows]
+        save_workbook(filename, [
+            ('选股结果', cols, df_data[cols].itertuples(index=False)),
+            # 形态图解 / 打分规则: 与判定逻辑同源，直接由规则库生成
+            ('形态图解', pattern_cols, pattern_rows),
+            ('打分规则', ['规则', '分值', '类型', '说明', '条件'], rules.strategy_sheet(params)),
+            ('指标说明书', ['指标名称', '实战含义', '判断标准'], ExcelExporter.INDICATORS_DESC),
+        ])
         print(f"✅ Excel 文件已保存至: {filename}")
 
+def score_panel(panel, args_list, report, params=rules.DEFAULT, sink=None, context=None):
+    """一批面板 -> 入围结果 (进程内 scan_batch 与计算进程共用)；args_list 与面板行一一对应
+    漏斗按代价从低到高: 快照字段 -> 尾部均线/量比 -> 形态 -> 布林下轨 -> 全量指标打分；
+    每步之后按已知因子算出规则表还能给的最高分 (rules.compile_bound)，够不着门槛就不再往下算
+    (入围结果与全量计算完全一致)；params 为打分参数 (rules.StrategyParams)
+    sink: 需要全市场打分表时传入，整批股票不剪枝全部算完，这批的 score_table 交给 sink
+    context: 本次运行的市场环境 (context.MarketContext)，其变量并进规则求值环境"""
+    n = len(args_list)
+    if not n: return []
+    G = AlphaGalaxyOmni
+    env = G.strategy_env(args_list, {}, np.zeros(n, dtype=bool), context)
+    del env['risk']
+    alive = np.arange(n)
+
+    def prune(stage, pattern_bound, arrays):
+        nonlocal alive, env
+        if sink is not None: return arrays
+        keep = G._bounds[stage](env, params) + pattern_bound >= params.threshold
+        report.drop(f'prune_{stage}', (~keep).sum())
+        alive = alive[keep]
+        env = {k: v[keep] for k, v in env.items()}
+        return [a[keep] for a in arrays]
+
+    # 1. 快照字段: 估值加减分已定，其余规则按满分算
+    with report.stage('funnel_snapshot'):
+        prune('snapshot', G.PATTERN_MAX, [])
+    if not len(alive): return []
+
+    # 2. 只取尾部 TAIL 根: 窗口 ≤ 20 的量都与整段计算逐位一致
+    o, h, l, c, v = (panel[k][alive, -G.TAIL:] for k in ('open', 'high', 'low', 'close', 'volume'))
+    with report.stage('funnel_cheap'):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ma5, ma10, ma20 = rolling_mean(c, 5), rolling_mean(c, 10), rolling_mean(c, 20)
+            vol_ma5 = rolling_mean(v, 5)[:, -1]
+            env['vol_ratio'] = v[:, -1] / np.where(vol_ma5 == 0, 1, vol_ma5)
+            env['pct_0'] = (c[:, -1] / c[:, -2] - 1) * 100
+        env['close'], env['ma20'] = c[:, -1], ma20[:, -1]
+        o, h, l, c, v, ma5, ma10, ma20 = prune('cheap', G.PATTERN_MAX, [o, h, l, c, v, ma5, ma10, ma20])
+    if not len(alive): return []
+
+    # 3. 形态: 只判最后一根，得分与风险否决精确
+    with report.stage('patterns'):
+        bits, k_score = KLineStrictLib.detect_panel(o, h, l, c, v, ma5, ma10, ma20)
+        bits, k_score = bits[:, -1], k_score[:, -1]
+        env['risk'] = (bits & KLineStrictLib.RISK_MASK) != 0
+        bits, k_score, c, ma20 = prune('patterns', np.maximum(k_score, 0), [bits, k_score, c, ma20])
+    if not len(alive): return []
+
+    # 4. 黄金坑 (+40) 要求收盘跌破布林下轨
+    with report.stage('funnel_boll'):
+        with np.errstate(invalid='ignore'):
+            env['bb_low'] = ma20[:, -1] - 2 * rolling_std(c, 20)[:, -1]
+        bits, k_score = prune('boll', np.maximum(k_score, 0), [bits, k_score])
+    if not len(alive): return []
+
+    # 5. 幸存者才算全量指标，整张规则表一次向量化打分，只对过门槛的逐只格式化
+    with report.stage('indicators'):
+        sub = {k: panel[k][alive] for k in ('high', 'low', 'close', 'volume')}
+        S = IndicatorEngine.panel_series(sub['high'], sub['low'], sub['close'], sub['volume'])
+        table = IndicatorEngine.panel_table(S, list(range(len(alive))))
+    results = []
+    with report.stage('scoring'):
+        picked = [args_list[i] for i in alive]
+        env = G.strategy_env(picked, {k: table[k].to_numpy() for k in rules.STRATEGY_INPUTS if k in table},
+                             (bits & KLineStrictLib.RISK_MASK) != 0, context)
+        score, rule_bits = G._strategy(env, params)
+        score = score + np.maximum(k_score, 0)
+        for j in np.flatnonzero(score >= params.threshold):
+            try:
+                _, buy_pats, risk_pats = KLineStrictLib.decode(bits[j])
+                results.append(G.output(picked[j], table.iloc[j].to_dict(), int(score[j]), rule_bits[j], buy_pats, risk_pats))
+            except Exception as e:
+                report.error('scoring', e)
+    report.drop('score_threshold', len(alive) - len(results))
+    if sink is not None:
+        with report.stage('score_table'):
+            table = G.score_table(picked, table, bits, k_score, panel['date'][alive, -1], params, context)
+        sink(table)
+    return results
+
+
+# 计算进程里本次运行的市场环境 (进程启动时由 _set_context 交付一次，不随每批 pickle)
+_context = None
+
+
+def _set_context(context):
+    global _context
+    _context = context
+
+
+def score_shared(spec, args_list, params=rules.DEFAULT, universe=False):
+    """计算进程入口: 从共享内存映射面板，返回 (入围结果, 计时/计数快照, 全市场打分表或 None)"""
+    report = RunReport()
+    tables = []
+    with attach(spec) as panel:
+        results = score_panel(panel, args_list, report, params, tables.append if universe else None, _context)
+    return results, report.snapshot(), tables[0] if tables else None
+
 # ==========================================
 # 5. 策略主控 (漏斗式 + 量价逻辑 A+B+C)
 # ==========================================
 class AlphaGalaxyOmni:
-    def __init__(self):
+    # 快照过滤: 剔除的板块代码前缀、最低股价、换手率区间 (%)
+    EXCLUDED_PREFIX = ('30', '688', '8', '4')
+    MIN_PRICE = 3.0
+    TURNOVER_RANGE = (1.0, 20)
+    # 检查点运行条件的中文名 (过期提示用)
+    CKPT_KEYS = {'day': '交易日', 'provider': '数据源', 'params': '打分参数', 'scores': '打分表格式', 'incremental': '流式模式',
+                 'shard': '分片', 'risk_off': '风险闸门'}
+    # 打分规则表编译成一个向量化函数，阈值与入围门槛在调用时按参数 (rules.StrategyParams) 代入
+    _strategy = _Lazy(lambda: rules.compile_strategy(rules.STRATEGY, rules.STRATEGY_INPUTS, rules.FACTORS, rules.DEFAULT), static=True)
+    # 打分漏斗各步已知的因子 (市场环境变量一开始就全部已知)，及据此编译的规则得分上界
+    FUNNEL_FACTORS = {
+        'snapshot': ('pe', 'pb', 'turnover') + rules.CONTEXT_INPUTS,
+        'cheap': ('pe', 'pb', 'turnover', 'close', 'ma20', 'vol_ratio', 'pct_0') + rules.CONTEXT_INPUTS,
+        'patterns': ('pe', 'pb', 'turnover', 'close', 'ma20', 'vol_ratio', 'pct_0', 'risk') + rules.CONTEXT_INPUTS,
+        'boll': ('pe', 'pb', 'turnover', 'close', 'ma20', 'vol_ratio', 'pct_0', 'risk', 'bb_low') + rules.CONTEXT_INPUTS,
+    }
+    _bounds = _Lazy(lambda: {k: rules.compile_bound(rules.STRATEGY, v, rules.FACTORS, rules.DEFAULT)
+                             for k, v in AlphaGalaxyOmni.FUNNEL_FACTORS.items()})
+    PATTERN_MAX = sum(w for _, w in KLineStrictLib.PATTERNS if w > 0)
+    # 漏斗前几步只看尾部这么多根 K 线 (形态 30 根 + 均线 20 根)
+    TAIL = KLineStrictLib.MIN_BARS + 20
+
+    def __init__(self, store_dir='price_store', state_dir=None, concurrency=8, rate=20, provider=None, profile=False,
+                 sentiment_top=300, sentiment_cache=None, workers=None, params=None, scores=None, excel=True,
+                 checkpoint=None, resume=False, pattern_index='pattern_index', shard=None, shard_dir='shards',
+                 risk_off='scan', risk_off_keep=0.3, sectors=None):
         self.min_cap = 40 * 10000 * 10000 
+        self.fetch_timeout = 30
+        # 数据源: 默认线上 akshare，可换成离线回放 (providers.ReplayProvider)
+        self.provider = provider or AkshareProvider(timeout=self.fetch_timeout)
+        # 本地行情仓库: 只补拉缺口；store_dir=None 时回退为每次全量下载
+        self.store = PriceStore(store_dir, fetch=self.provider.history, factors=self.provider.factors) if store_dir else None
+        # 流式指标状态: 指定 state_dir 时每只股票只增量更新新 K 线
+        self.streams = StreamingIndicatorEngine(state_dir) if state_dir else None
+        self.batch_size = 500
+        # 拉取调度: 起始并发 concurrency，按延迟/失败自适应 (上限 4 倍)，全局 rate 次/秒
+        self.scheduler = FetchScheduler(concurrency=concurrency, max_concurrency=concurrency * 4, rate=rate, timeout=self.fetch_timeout)
+        # 舆情: 对前 sentiment_top 只并发拉新闻 (按数据源的 news_rate 限速)，剔除后取前 top_n 导出
+        self.sentiment_top = sentiment_top
+        self.top_n = 30
+        news_rate = getattr(self.provider, 'news_rate', None) or 1e6
+        self.news_scheduler = FetchScheduler(concurrency=concurrency, max_concurrency=concurrency * 2, rate=news_rate,
+                                             retries=1, timeout=self.fetch_timeout)
+        if sentiment_cache: SentimentEngine.load_cache(sentiment_cache)
+        # 运行报告: 分环节耗时/延迟/异常/漏斗，profile=True 时计算环节另存 cProfile
+        self.profile = profile
+        self.report = RunReport(profile)
+        # 计算进程数: 默认 CPU 核数，<=1 时在主进程里算；cProfile 只能看到本进程，剖析时强制进程内
+        self.workers = 1 if profile else (workers or os.cpu_count() or 1)
+        self.pool = None
+        # 打分参数: 规则阈值 + 入围门槛 (调参见 sweep.py)
+        self.params = params or rules.DEFAULT
+        # 全市场打分表: scores 为格式列表 (parquet/csv/ndjson)，每算完一批就追加落盘；excel=False 时不写 xlsx 汇总
+        self.score_formats = list(scores or [])
+        self.excel = excel
+        self.scores = None
+        # 检查点: 指定目录时每算完一批落盘，resume=True 时从有效检查点续跑 (只重跑失败与缺失的股票)
+        self.checkpoint_dir = checkpoint
+        self.resume = resume
+        self.ckpt = None
+        self._tables = []
+        # 形态索引目录 (pattern_index.py 维护)，导出时给形态图解补实测胜率
+        self.pattern_index = pattern_index
+        # 分片扫描 (见 shard.py): shard=(K, N) 时只扫第 K 片，结果写到 shard_dir，舆情与导出留给 merge
+        self.shard = tuple(shard) if shard else None
+        self.shard_dir = shard_dir
+        # 市场环境 (context.py): 快照之后算一次，只读共享给打分；sectors 为 {代码: 行业}，不给按交易板块分
+        # risk_off: risk_off 日的风险闸门 (scan 照常/shrink 只留相对强度前 risk_off_keep/skip 跳过)
+        if risk_off not in GATE_MODES: raise ValueError(f"未知风险闸门: {risk_off}")
+        self.risk_off = risk_off
+        self.risk_off_keep = risk_off_keep
+        self.sectors = sectors
+        self.context = None
+
+    def fetch_spot(self, columns=('总市值', '最新价', '换手率', '市盈率-动态', '市净率')):
+        """全市场快照 (只有一次请求，失败直接重试，不走调度器)；columns 转成数值"""
+        for attempt in range(3):
+            try:
+                t0 = time.perf_counter()
+                df = self.provider.spot()
+                self.report.latency('spot', time.perf_counter() - t0)
+                break
+            except Exception as e:
+                self.report.error('snapshot', e)
+                if attempt == 2: raise
+                time.sleep(2 ** attempt)
+        import pandas as pd
+        for col in columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        return df
+
+    def screen(self, df, turnover=True):
+        """快照过滤掩码: 板块/ST/市值/股价，turnover=True 时再加换手率区间 (盘中换手率未走完，由调用方另行判断)"""
+        mask = (
+            (~df['代码'].str.startswith(self.EXCLUDED_PREFIX)) & 
+            (~df['名称'].str.contains('ST|退')) &
+            (df['总市值'] > self.min_cap) &
+            (df['最新价'] > self.MIN_PRICE)
+        )
+        if turnover:
+            mask &= (df['换手率'] > self.TURNOVER_RANGE[0]) & (df['换手率'] < self.TURNOVER_RANGE[1])
+        return mask
 
     def get_candidates(self):
         print("1. 获取全市场快照 & 初步清洗...")
         try:
-            df = ak.stock_zh_a_spot_em()
-            for col in ['总市值', '最新价', '换手率', '市盈率-动态', '市净率']:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-            mask = (
-                (~df['代码'].str.startswith(('30', '688', '8', '4'))) & 
-                (~df['名称'].str.contains('ST|退')) &
-                (df['总市值'] > self.min_cap) &
-                (df['最新价'] > 3.0) &
-                (df['换手率'] > 1.0) & (df['换手率'] < 20)
-            )
-            return list(zip(df[mask]['代码'], df[mask]['名称'], df[mask]['市盈率-动态'], df[mask]['市净率'], df[mask]['换手率']))
-        except:
+            with self.report.stage('snapshot'):
+                df = self.fetch_spot()
+                mask = self.screen(df)
+            self.report.info['universe'] = len(df)
+            self.report.drop('snapshot_filter', (~mask).sum(), int(mask.sum()))
+            candidates = list(zip(df[mask]['代码'], df[mask]['名称'], df[mask]['市盈率-动态'], df[mask]['市净率'], df[mask]['换手率']))
+        except Exception as e:
+            self.report.error('snapshot', e)
             return []
+        self.context = self.build_context(df, candidates)
+        if self.context is None: return candidates
+        # 风险闸门: risk_off 日在拉日线之前收缩/跳过候选池
+        gated = self.context.gate(candidates, self.risk_off, self.risk_off_keep)
+        if self.risk_off != 'scan':
+            self.report.drop('risk_off', len(candidates) - len(gated), len(gated))
+        return gated
 
-    def scan_tech_fund(self, args):
-        symbol, name, pe, pb, turnover = args
+    def build_context(self, df, candidates):
+        """全市场快照 + 本地仓库 -> 本次运行的市场环境 (只算一次)；失败只记报告，打分照常 (环境变量为 NaN)
+        分片模式不看仓库: 各片的仓库只有自己那片的历史，算出的历史分位会各不相同"""
+        try:
+            with self.report.stage('context'):
+                context = MarketContext.build(df, [c[0] for c in candidates], None if self.shard else self.store,
+                                              last_trading_day(self.provider.now()), self.sectors)
+        except Exception as e:
+            self.report.error('context', e)
+            return None
+        self.report.info['context'] = context.info
+        print(f"   市场环境: {context.summary()}")
+        return context
+
+    def load_history(self, args):
+        """I/O 部分: 拉取 400 天日线 (异常向上抛，交给调度器区分失败与无数据)"""
+        symbol = args[0]
+        now = self.provider.now()
+        if self.store:
+            df = self.store.history(symbol, now=now)
+        else:
+            end = now.strftime("%Y%m%d")
+            start = (now - timedelta(days=400)).strftime("%Y%m%d")
+            df = self.provider.history(symbol, start, end)
+        
+        if df is None: return None
+        df.rename(columns={'日期':'date', '开盘':'open', '收盘':'close', '最高':'high', '最低':'low', '成交量':'volume'}, inplace=True)
+        return df
+
+    def load_arrays(self, args):
+        """I/O 线程: 拉取并解码成数组，交给计算侧的只有 numpy 数组 (走本地仓库时直接切结构化数组，不经 DataFrame)"""
+        if self.store:
+            bars = self.store.window(args[0], now=self.provider.now())
+            return bars if len(bars) else None
+        df = self.load_history(args)
+        if df is None or df.empty: return None
+        return IndicatorEngine.to_arrays(df)
+
+    def fetch_history(self, args):
+        """返回 (args, df)；亏损股/无数据/失败返回 None"""
         try:
             # 基础过滤：剔除亏损股 (可选)
-            if pe < 0: return None
-            
-            end = datetime.now().strftime("%Y%m%d")
-            start = (datetime.now() - timedelta(days=400)).strftime("%Y%m%d")
-            df = ak.stock_zh_a_hist(symbol=symbol, period='daily', start_date=start, end_date=end, adjust='qfq')
-            
-            if df is None: return None
-            df.rename(columns={'日期':'date', '开盘':'open', '收盘':'close', '最高':'high', '最低':'low', '成交量':'volume'}, inplace=True)
-            
+            if args[2] < 0: return None
+            df = self.load_history(args)
+            return (args, df) if df is not None else None
+        except:
+            return None
+
+    def scan_tech_fund(self, args):
+        item = self.fetch_history(args)
+        if not item: return None
+        try:
+            df = item[1]
             fac = IndicatorEngine.calculate(df)
             if not fac: return None
-            k_score, buy_pats, risk_pats = KLineStrictLib.detect(df)
-            
-            score = 0
-            logic = []
-            
-            # --- 否决项 ---
-            if risk_pats: score -= 30
-            
-            # =========================================================
-            # [Added] MACD 状态判断逻辑
-            # =========================================================
-            dif0, dea0, dif1, dea1 = fac['dif_0'], fac['dea_0'], fac['dif_1'], fac['dea_1']
-            bar0, bar1 = fac['macd_bar_0'], fac['macd_bar_1']
-            
-            # 交叉判断
-            macd_cross_str = ""
-            if dif0 > dea0 and dif1 <= dea1: macd_cross_str = "金叉(新)"
-            elif dif0 < dea0 and dif1 >= dea1: macd_cross_str = "死叉(新)"
-            else: macd_cross_str = "金叉持仓" if dif0 > dea0 else "死叉持币"
-            
-            # 红绿柱伸缩判断
-            bar_status_str = ""
-            if bar0 > 0:
-                bar_status_str = "红柱伸长" if bar0 > bar1 else "红柱缩短"
-            else:
-                # 负数比较：例如 -5 > -10 为真，表示绿柱变短（反弹迹象）
-                bar_status_str = "绿柱缩短" if bar0 > bar1 else "绿柱伸长"
-            
-            macd_full_status = f"{macd_cross_str} | {bar_status_str}"
-
-            # =========================================================
-            # [Added] KDJ 状态判断逻辑
-            # =========================================================
-            k0, d0, k1, d1 = fac['k_0'], fac['d_0'], fac['k_1'], fac['d_1']
-            
-            kdj_status_str = ""
-            if k0 > d0 and k1 <= d1: kdj_status_str = "金叉(新)"
-            elif k0 < d0 and k1 >= d1: kdj_status_str = "死叉(新)"
-            else: kdj_status_str = "多头排列" if k0 > d0 else "空头排列"
-
-            # =========================================================
-            # 策略组合 A：量比 + 换手率 + 位置 = 【主力意图】
-            # =========================================================
-            is_trend_up = fac['close'] > fac['ma20']
-            
-            # 1. 锁筹/躺赢 (拉升中 + 低换手 + 量比平稳)
-            if is_trend_up and (1 < turnover < 5) and (0.5 < fac['vol_ratio'] < 1.2):
-                score += 20
-                logic.append("A:主力锁筹(最强)")
-            
-            # 2. 建仓/启动 (趋势向上 + 换手活跃 + 放量)
-            elif is_trend_up and (fac['vol_ratio'] > 1.5) and (fac['pct_0'] > 0):
-                score += 15
-                logic.append("A:放量启动")
-            
-            # 3. 出货/滞涨 (高换手 + 滞涨) -> 扣分风险
-            if (turnover > 15) and (-2 < fac['pct_0'] < 2):
-                score -= 30
-                logic.append("A:⚠️高换手滞涨")
-
-            # =========================================================
-            # 策略组合 B：MACD + RSI = 【买卖点校准】
-            # =========================================================
-            macd_gold = (fac['macd_dif'] > fac['macd_dea']) and (fac['macd_dif'] > 0)
-            
-            if macd_gold:
-                # 只有当情绪不过热时，MACD金叉才有效
-                if fac['rsi'] < 80:
-                    score += 10
-                    logic.append("B:趋势情绪共振")
-                else:
-                    # MACD金叉 但 RSI过热 = 假买点
-                    score -= 5
-                    logic.append("B:⚠️假买点(RSI过热)")
-            
-            # =========================================================
-            # 策略组合 C：布林带 + 资金流 = 【真假突破】
-            # =========================================================
-            # 1. 黄金坑 (股价跌破下轨 + 资金流入)
-            if (fac['close'] < fac['bb_low']) and (fac['cmf_0'] > 0.1):
-                score += 40  # 极高分，因为这是绝佳的反转点
-                logic.append("C:黄金坑(破位+资金进)")
-            
-            # 2. 顶背离/诱多 (股价突破上轨 + 资金流出)
-            if (fac['close'] > fac['bb_up']) and (fac['cmf_0'] < -0.05):
-                score -= 40
-                logic.append("C:⚠️顶背离(诱多)")
-
-            # =========================================================
-            # 其他辅助加分
-            # =========================================================
-            # 估值保护
-            if 0 < pe <= 25: score += 10
-            if pb > 10: score -= 5
-            
-            # 趋势强度 (ADX)
-            if fac['adx'] > 25 and is_trend_up: score += 5
-            
-            # 形态得分
-            if k_score > 0: score += k_score
-
-            # --- 输出 ---
-            buy_l = fac['close'] * 0.99
-            buy_h = fac['close'] * 1.01
-            stop = fac['close'] - 2 * fac['atr']
-            profit = fac['close'] + 3 * fac['atr']
-            
-            # 门槛设定：保持65分
-            if score >= 65:
-                return {
-                    "代码": symbol, "名称": name, "总分": score, "现价": fac['close'],
-                    "市盈率": round(pe, 2), "市净率": round(pb, 2), "换手率%": round(turnover, 2),
-                    "量比": round(fac['vol_ratio'], 2), 
-                    "建议买入区间": f"{round(buy_l,2)}~{round(buy_h,2)}",
-                    "止损价": round(stop, 2), "止盈价": round(profit, 2),
-                    "买入形态": " | ".join(buy_pats) if buy_pats else "-",
-                    "风险形态": " | ".join(risk_pats) if risk_pats else "-",
-                    "得分详情": " ".join(logic),
-                    
-                    # [Added Output] 新增状态列
-                    "MACD状态": macd_full_status,
-                    "KDJ状态": kdj_status_str,
-                    
-                    "J值": round(fac['j_val'], 1), "布林带宽": round(fac['bb_width'], 3),
-                    "RSI": round(fac['rsi'], 1), "BIAS(%)": round(fac['bias'], 2),
-                    "ADX": int(fac['adx']), "CCI": int(fac['cci']),
-                    
-                    # [RESTORED] 补全历史数据字段
-                    "CMF(今)": round(fac['cmf_0'], 3), "CMF(昨)": round(fac['cmf_1'], 3), "CMF(前)": round(fac['cmf_2'], 3),
-                    "涨幅%(今)": round(fac['pct_0'], 2), "涨幅%(昨)": round(fac['pct_1'], 2), "涨幅%(前)": round(fac['pct_2'], 2)
-                }
-            return None
+            return self.evaluate(args, fac, *KLineStrictLib.detect(df), params=self.params)
         except:
             return None
 
+    def scan_batch(self, items):
+        """计算部分: 一批 (args, df) 组成面板，一次向量化算完指标，再逐只打分"""
+        items = self._long_enough(items)
+        if not items: return []
+        with self.report.stage('panel'):
+            panel = IndicatorEngine.to_panel([(a[0], df) for a, df in items])
+        return score_panel(panel, [a for a, _ in items], self.report, self.params,
+                           self.write_scores if self.scores else None, self.context)
+
+    def submit_batch(self, items):
+        """进程池模式: 面板打包进共享内存交给计算进程，结果之后由 collect 取回"""
+        symbols = [a[0] for a, _ in items]
+        items = self._long_enough(items)
+        if not items:
+            self.commit(symbols, [])
+            return
+        with self.report.stage('panel'):
+            panel = IndicatorEngine.to_panel([(a[0], df) for a, df in items])
+            arrays = {k: panel[k] for k in ('open', 'high', 'low', 'close', 'volume', 'date')}
+            self.pool.submit(arrays, [a for a, _ in items], self.params, bool(self.scores), tag=symbols)
+
+    def collect(self, block=False):
+        results = []
+        for out, exc, symbols in self.pool.ready(block):
+            if exc is not None:
+                self.report.error('compute', exc)
+                if self.ckpt:
+                    for s in symbols: self.ckpt.mark(s, 'error')
+                continue
+            res, snap, table = out
+            self.report.merge(snap)
+            results += res
+            if table is not None: self.write_scores(table)
+            self.commit(symbols, res)
+        return results
+
+    def commit(self, symbols, results):
+        """一批算完: 这批的入围结果连同已写出的打分表一起落检查点"""
+        tables, self._tables = self._tables, []
+        if self.ckpt: self.ckpt.commit(symbols, results, tables)
+
+    def checkpoint_key(self):
+        """检查点的运行条件: 交易日/数据源/参数/打分表格式/流式模式任一变化，旧检查点即过期"""
+        key = {'day': last_trading_day(self.provider.now()), 'provider': self.provider.name,
+               'params': self.params._asdict(), 'scores': self.score_formats, 'incremental': bool(self.streams)}
+        if self.shard: key['shard'] = list(self.shard)
+        if self.risk_off != 'scan': key['risk_off'] = [self.risk_off, self.risk_off_keep]
+        return key
+
+    def _long_enough(self, items):
+        n = len(items)
+        items = [(a, df) for a, df in items if len(df['close']) >= 60]
+        self.report.drop('short_history', n - len(items))
+        return items
+
+    def scan_incremental(self, items):
+        """流式模式: 指标走持久化状态 O(1) 更新，形态只看最后 30 根"""
+        results, short, scored = [], 0, []
+        for args, df in items:
+            try:
+                with self.report.stage('indicators'):
+                    fac = self.streams.update(args[0], df)
+                if not fac:
+                    short += 1
+                    continue
+                with self.report.stage('patterns'):
+                    bits = KLineStrictLib.detect_bits(df)
+                    pats = KLineStrictLib.decode(bits)
+                with self.report.stage('scoring'):
+                    res = self.evaluate(args, fac, *pats, params=self.params, context=self.context)
+                if res: results.append(res)
+                if self.scores: scored.append((args, fac, bits, pats[0], dates_to_int(df['date'].iloc[-1:])[0]))
+            except Exception as e:
+                self.report.error('scoring', e)
+        self.report.drop('short_history', short)
+        self.report.drop('score_threshold', len(items) - short - len(results))
+        if scored:
+            import pandas as pd
+            args_list, facs, bits, k_score, dates = zip(*scored)
+            with self.report.stage('score_table'):
+                table = self.score_table(list(args_list), pd.DataFrame(list(facs)), bits, k_score, dates, self.params,
+                                         self.context)
+            self.write_scores(table)
+        return results
+
+    def write_scores(self, table):
+        with self.report.stage('score_export'):
+            self.scores.write(table)
+        if self.ckpt: self._tables.append(table)
+
+    @staticmethod
+    def score_table(args_list, factors, bits, k_score, dates, params=rules.DEFAULT, context=None):
+        """一批股票的全市场打分表: 一行一只 (入围与否都在)，标识 + 得分 + 命中的规则/形态 + 全部因子 + 市场环境变量
+        列与类型固定 (字符串列不出现 None)，各批可直接追加到同一张 parquet/csv/ndjson"""
+        import pandas as pd
+        G = AlphaGalaxyOmni
+        factors = factors.reset_index(drop=True)
+        bits = np.asarray(bits, dtype=np.int64)
+        k_score = np.asarray(k_score, dtype=np.int64)
+        env = G.strategy_env(args_list, {k: factors[k].to_numpy() for k in rules.STRATEGY_INPUTS if k in factors},
+                             (bits & KLineStrictLib.RISK_MASK) != 0, context)
+        rule_score, rule_bits = G._strategy(env, params)
+        score = rule_score + np.maximum(k_score, 0)
+        decoded = [KLineStrictLib.decode(b) for b in bits]
+        out = pd.DataFrame({
+            '代码': [str(a[0]) for a in args_list], '名称': [str(a[1]) for a in args_list],
+            '日期': np.asarray(dates, dtype=np.int64),
+            '总分': score.astype(np.int64), '规则分': rule_score.astype(np.int64), '形态分': k_score,
+            '入围': score >= params.threshold,
+            '命中规则': [' '.join(r.name for i, r in enumerate(rules.STRATEGY) if rb >> i & 1) for rb in rule_bits],
+            '买入形态': [' | '.join(b) for _, b, _ in decoded], '风险形态': [' | '.join(r) for _, _, r in decoded],
+            '规则位': rule_bits.astype(np.int64), '形态位': bits,
+            '市盈率': env['pe'], '市净率': env['pb'], '换手率%': env['turnover'],
+        })
+        for k in IndicatorEngine.FACTORS:
+            out[k] = factors[k].to_numpy(dtype=float) if k in factors else np.nan
+        for k in rules.CONTEXT_INPUTS:
+            out[k] = env[k]
+        return out
+
+    @staticmethod
+    def evaluate(args, fac, k_score, buy_pats, risk_pats, params=rules.DEFAULT, context=None):
+        """打分: fac 为 calculate 的字典或 calculate_panel 的一行 (规则见 rules.STRATEGY)"""
+        env = AlphaGalaxyOmni.strategy_env([args], {k: [fac[k]] for k in rules.STRATEGY_INPUTS if k in fac}, [bool(risk_pats)],
+                                           context)
+        score, bits = AlphaGalaxyOmni._strategy(env, params)
+        score = int(score[0]) + (k_score if k_score > 0 else 0)
+        if score < params.threshold: return None
+        return AlphaGalaxyOmni.output(args, fac, score, bits[0], buy_pats, risk_pats)
+
+    @staticmethod
+    def strategy_env(args_list, factors, risk, context=None):
+        """规则求值环境: 因子列 + 快照 pe/pb/turnover + 是否有风险形态 + 市场环境变量 (没有 context 时为 NaN)，全部为一维数组"""
+        env = context.env([a[0] for a in args_list]) if context is not None else empty_env(len(args_list))
+        env.update({k: np.asarray(v, dtype=float) for k, v in factors.items()})
+        env['pe'] = np.array([a[2] for a in args_list], dtype=float)
+        env['pb'] = np.array([a[3] for a in args_list], dtype=float)
+        env['turnover'] = np.array([a[4] for a in args_list], dtype=float)
+        env['risk'] = np.asarray(risk, dtype=bool)
+        return env
+
+    @staticmethod
+    def output(args, fac, score, rule_bits, buy_pats, risk_pats):
+        """入围股票的输出行 (只对过了门槛的股票做逐只格式化)"""
+        symbol, name, pe, pb, turnover = args
+        # 数值一律按 np.float64 取整 (与逐只 DataFrame 版一致: numpy 的 round 与 Python float 的 round 在 .xx5 附近会差一分钱)
+        # 面板行 to_dict、检查点 JSON 读回的都是 Python float
+        pe, pb, turnover = np.float64(pe), np.float64(pb), np.float64(turnover)
+        fac = {k: np.float64(v) if isinstance(v, (float, np.floating)) else v for k, v in fac.items()}
+        rule_bits = int(rule_bits)
+        logic = [r.tag for i, r in enumerate(rules.STRATEGY) if r.tag and rule_bits >> i & 1]
+        
+        # =========================================================
+        # [Added] MACD 状态判断逻辑
+        # =========================================================
+        dif0, dea0, dif1, dea1 = fac['dif_0'], fac['dea_0'], fac['dif_1'], fac['dea_1']
+        bar0, bar1 = fac['macd_bar_0'], fac['macd_bar_1']
+        
+        # 交叉判断
+        macd_cross_str = ""
+        if dif0 > dea0 and dif1 <= dea1: macd_cross_str = "金叉(新)"
+        elif dif0 < dea0 and dif1 >= dea1: macd_cross_str = "死叉(新)"
+        else: macd_cross_str = "金叉持仓" if dif0 > dea0 else "死叉持币"
+        
+        # 红绿柱伸缩判断
+        bar_status_str = ""
+        if bar0 > 0:
+            bar_status_str = "红柱伸长" if bar0 > bar1 else "红柱缩短"
+        else:
+            # 负数比较：例如 -5 > -10 为真，表示绿柱变短（反弹迹象）
+            bar_status_str = "绿柱缩短" if bar0 > bar1 else "绿柱伸长"
+        
+        macd_full_status = f"{macd_cross_str} | {bar_status_str}"
+
+        # =========================================================
+        # [Added] KDJ 状态判断逻辑
+        # =========================================================
+        k0, d0, k1, d1 = fac['k_0'], fac['d_0'], fac['k_1'], fac['d_1']
+        
+        kdj_status_str = ""
+        if k0 > d0 and k1 <= d1: kdj_status_str = "金叉(新)"
+        elif k0 < d0 and k1 >= d1: kdj_status_str = "死叉(新)"
+        else: kdj_status_str = "多头排列" if k0 > d0 else "空头排列"
+
+        # --- 输出 ---
+        buy_l = fac['close'] * 0.99
+        buy_h = fac['close'] * 1.01
+        stop = fac['close'] - 2 * fac['atr']
+        profit = fac['close'] + 3 * fac['atr']
+        
+        return {
+            "代码": symbol, "名称": name, "总分": score, "现价": fac['close'],
+            "市盈率": round(pe, 2), "市净率": round(pb, 2), "换手率%": round(turnover, 2),
+            "量比": round(fac['vol_ratio'], 2), 
+            "建议买入区间": f"{round(buy_l,2)}~{round(buy_h,2)}",
+            "止损价": round(stop, 2), "止盈价": round(profit, 2),
+            "买入形态": " | ".join(buy_pats) if buy_pats else "-",
+            "风险形态": " | ".join(risk_pats) if risk_pats else "-",
+            "得分详情": " ".join(logic),
+            
+            # [Added Output] 新增状态列
+            "MACD状态": macd_full_status,
+            "KDJ状态": kdj_status_str,
+            
+            "J值": round(fac['j_val'], 1), "布林带宽": round(fac['bb_width'], 3),
+            "RSI": round(fac['rsi'], 1), "BIAS(%)": round(fac['bias'], 2),
+            "ADX": int(fac['adx']), "CCI": int(fac['cci']),
+            
+            # [RESTORED] 补全历史数据字段
+            "CMF(今)": round(fac['cmf_0'], 3), "CMF(昨)": round(fac['cmf_1'], 3), "CMF(前)": round(fac['cmf_2'], 3),
+            "涨幅%(今)": round(fac['pct_0'], 2), "涨幅%(昨)": round(fac['pct_1'], 2), "涨幅%(前)": round(fac['pct_2'], 2)
+        }
+
     def run(self):
+        self.report = RunReport(self.profile)
+        # 调度器随 app 复用 (merge 补扫多片、常驻进程重建)，计数按次清零，免得这次的报告带上前几次的
+        self.scheduler.reset()
+        self.news_scheduler.reset()
+        stem = f"Alpha_Galaxy_ProMax_{self.provider.now().strftime('%Y%m%d')}"
+        self.report.info.update(provider=self.provider.name, asof=self.provider.now().strftime('%Y-%m-%d %H:%M:%S'),
+                                store=bool(self.store), incremental=bool(self.streams), params=self.params._asdict())
+        # 分片 worker 的报告放在分片文件旁边，免得本机多进程时互相覆盖
+        out = shard.path(self.shard_dir, *self.shard)[:-len('.pkl')] if self.shard else stem
+        if self.shard: self.report.info['shard'] = list(self.shard)
+        try:
+            self._run(stem)
+            # 整次运行成功才删检查点 (舆情/导出失败也能续跑，不必重扫)；
+            # 有股票拉取/计算失败时保留，--resume 只重跑失败的那些
+            failed = self.scheduler.stats['error'] + sum(self.report.errors.get('compute', {}).values())
+            if self.ckpt and failed:
+                print(f"   {failed} 只拉取/计算失败，检查点保留，加 --resume 只重跑失败的")
+            elif self.ckpt: self.ckpt.discard()
+        finally:
+            self.ckpt = None
+            # 报告与 xlsx 同名同目录；无入围或中途异常也照写
+            path = self.report.save(f"{out}.json", f"{out}.prof" if self.profile else None)
+            print(f"   环节耗时: {self.report.summary()}")
+            print(f"📄 运行报告已保存至: {path}")
+
+    def _run(self, stem):
         print(f"{'='*100}")
         print(" 🌌 Alpha Galaxy Omni Pro Max - 机构级全维融合版 (Strat A+B+C & 30+ Pattern Lib) 🌌")
         print(f"{'='*100}")
-        
-        candidates = self.get_candidates()
+        tech_survivors, order, tables = self.scan_market(stem)
+        if self.shard:
+            path = self.save_shard(stem, tech_survivors, order, tables)
+            print(f"📦 分片 {self.shard[0]}/{self.shard[1]} 已保存至: {path} (入围 {len(tech_survivors)} 只)")
+            return
+        self.finish(stem, tech_survivors, order)
+
+    def scan_market(self, stem):
+        """快照 -> 技术/基本面扫描，返回 (入围结果, {代码: 快照中的位置}, 分片模式下留在内存的打分表)"""
+        resumed = None
+        if self.checkpoint_dir:
+            # 各分片各用一个检查点子目录，本机多进程不互相踩
+            root = os.path.join(self.checkpoint_dir, os.path.basename(shard.path('', *self.shard))[:-len('.pkl')]) \
+                if self.shard else self.checkpoint_dir
+            self.ckpt = RunCheckpoint(root, self.checkpoint_key())
+            if self.resume:
+                stale = self.ckpt.stale()
+                resumed = self.ckpt.load()
+                if stale:
+                    changed = [self.CKPT_KEYS[k] for k, v in self.ckpt.key.items() if stale.get(k) != v]
+                    print(f"   检查点已过期 ({'/'.join(changed)}变了)，丢弃重跑")
+                elif not resumed: print("   没有可续跑的检查点，从头开始")
+        if resumed:
+            # 市场环境沿用开跑时存下的 (候选列表也是按它过的闸门)
+            candidates, self.context = resumed.candidates, resumed.context
+            print(f"1. 从检查点续跑: 已完成 {len(resumed.finished)} 只，上次失败 {len(resumed.failed)} 只，"
+                  f"已入围 {len(resumed.results)} 只")
+        else:
+            candidates = self.get_candidates()
+            if self.ckpt and candidates: self.ckpt.start(candidates, self.context)
+        order = {c[0]: i for i, c in enumerate(candidates)}
+        if self.shard:
+            # 快照失败时 get_candidates 返回空表: 分片 worker 不能当成 "这一片没有股票" 交差 (风险闸门整个跳过的除外)
+            if not candidates and 'risk_off' not in self.report.funnel: raise RuntimeError("快照为空，本片不写结果")
+            # 按代码哈希取自己这一片；位置仍按整张快照记，合并时同分排序与单进程一致
+            k, n = self.shard
+            mine = [c for c in candidates if shard.shard_of(c[0], n) == k]
+            self.report.drop('shard', len(candidates) - len(mine), len(mine))
+            self.report.info['snapshot'] = {'candidates': len(candidates), 'fingerprint': shard.fingerprint(order)}
+            candidates = mine
+            order = {c[0]: order[c[0]] for c in mine}
         print(f"1. 技术/基本面扫描 (待扫 {len(candidates)} 只)...")
         
+        # 基础过滤：剔除亏损股 (可选)，不必发请求
+        todo = [c for c in candidates if not c[2] < 0]
+        self.report.drop('loss_making', len(candidates) - len(todo), len(todo))
         tech_survivors = []
-        with ThreadPoolExecutor(max_workers=16) as executor:
-            for res in tqdm(executor.map(self.scan_tech_fund, candidates), total=len(candidates)):
-                if res: tech_survivors.append(res)
-        
+        if resumed:
+            n = len(todo)
+            todo = [c for c in todo if c[0] not in resumed.finished]
+            self.report.drop('checkpoint_done', n - len(todo), len(todo))
+            self.report.info['resumed'] = {'finished': len(resumed.finished), 'retry_failed': len(resumed.failed),
+                                           'survivors': len(resumed.results)}
+            tech_survivors = list(resumed.results)
+        # 调度器只负责拉数据 (自适应并发 + 限速 + 重试)；按完成顺序每攒够一批就组成面板整批计算
+        # fetch 只计等待拉取结果的时间，面板计算另记在 indicators/patterns/scoring
+        # 进程池模式: 拉取线程只解码数组，面板经共享内存交给计算进程，结果随完随收
+        batch = []
+        batch_size = self.batch_size
+        pooled = self.workers > 1 and not self.streams
+        if pooled:
+            self.pool = ComputePool(score_shared, self.workers, initializer=_set_context, initargs=(self.context,))
+            # 批次切小到每个进程至少分到两批，候选少时也能铺满所有核
+            batch_size = max(50, min(self.batch_size, -(-len(todo) // (self.workers * 2))))
+
+            def scan(items):
+                self.submit_batch(items)
+                return self.collect()
+        else:
+            compute = self.scan_incremental if self.streams else self.scan_batch
+
+            def scan(items):
+                results = compute(items)
+                self.commit([a[0] for a, _ in items], results)
+                return results
+        load = self.load_history if self.streams else self.load_arrays
+        sink = None
+        if self.score_formats:
+            # 分片模式下打分表随分片文件带走，由 merge 统一落盘
+            self.scores = sink = shard.TableSink() if self.shard else ScoreWriter(stem, self.score_formats)
+            # 续跑: 检查点里已算完的那部分打分表先写回去
+            for table in (resumed.tables if resumed else []):
+                self.write_scores(table)
+            self._tables = []
+        from tqdm import tqdm
+        ok = False
+        try:
+            fetched = self.report.timed('fetch', self.scheduler.stream(todo, load))
+            for res in tqdm(fetched, total=len(todo)):
+                self.report.latency('history_e2e', res.latency)  # 含排队/限速/重试
+                if res.status == 'ok': batch.append((res.item, res.value))
+                elif self.ckpt: self.ckpt.mark(res.item[0], res.status)
+                if len(batch) >= batch_size:
+                    tech_survivors += scan(batch)
+                    batch = []
+            tech_survivors += scan(batch)
+            if pooled:
+                with self.report.stage('compute_wait'):
+                    tech_survivors += self.collect(block=True)
+            # 最后一批之后的拉取为空/失败记录
+            if self.ckpt: self.ckpt.commit()
+            ok = True
+        finally:
+            if pooled:
+                self.pool.close()
+                self.pool = None
+            if self.scores:
+                # 中途异常只删临时文件，不留半截的表
+                paths = self.scores.close(ok)
+                self.report.info['scores'] = {'rows': self.scores.rows, 'paths': paths}
+                self.scores = None
+        if self.store:
+            with self.report.stage('store_flush'):
+                self.store.flush()
+        print(f"   拉取统计: {self.scheduler.summary()}")
+        stats = self.scheduler.stats
+        self.report.drop('fetch_empty', stats['empty'])
+        self.report.drop('fetch_error', stats['error'])
+        for name, n in self.scheduler.errors.items():
+            self.report.errors['fetch'][name] += n
+        self.report.info['fetch'] = {k: stats[k] for k in ('ok', 'empty', 'error', 'retries')}
+        for t in self.scheduler.latencies: self.report.latency('history', t)
+        self.report.info['survivors'] = len(tech_survivors)
+        return tech_survivors, order, sink.tables if self.shard and sink else []
+
+    def finish(self, stem, tech_survivors, order):
+        """全市场入围结果 -> 前 sentiment_top 跑舆情风控 -> 前 top_n 导出 (单进程扫描与分片合并共用)"""
         if not tech_survivors:
             print("无入围标的。")
             return
 
-        tech_survivors.sort(key=lambda x: x['总分'], reverse=True)
-        top_picks = tech_survivors[:30]
+        # 同分按候选顺序排 (与原先按提交顺序收集结果一致)，结果不受完成先后影响
+        tech_survivors.sort(key=lambda x: (-x['总分'], order[x['代码']]))
+        top_picks = tech_survivors[:self.sentiment_top]
+        self.report.drop('top_cut', len(tech_survivors) - len(top_picks), len(top_picks))
         
         print(f"\n2. 舆情风控扫描 (针对 Top {len(top_picks)})...")
         final_results = []
         
-        for stock in tqdm(top_picks):
-            s_score, s_msg = SentimentEngine.analyze(stock['代码'])
+        with self.report.stage('sentiment'):
+            sentiments = SentimentEngine.analyze_many([s['代码'] for s in top_picks], self.provider,
+                                                      self.news_scheduler, self.report)
+        cache = SentimentEngine.cache
+        self.report.info['sentiment_cache'] = {'hits': cache.hits, 'misses': cache.misses}
+        for stock in top_picks:
+            s_score, s_msg = sentiments[stock['代码']]
             
             if s_score < -10:
                 print(f"⚠️ 剔除 {stock['名称']}: {s_msg}")
@@ -611,16 +1077,294 @@ class AlphaGalaxyOmni:
             if s_score > 0: stock['得分详情'] += f" 舆情({s_score})"
             
             final_results.append(stock)
-            time.sleep(0.5)
+        self.report.drop('sentiment_veto', len(top_picks) - len(final_results), len(final_results))
 
+        import pandas as pd
         final_results.sort(key=lambda x: x['总分'], reverse=True)
-        df = pd.DataFrame(final_results)
+        df = pd.DataFrame(final_results[:self.top_n])
         
         print("\n" + "="*120)
         print(df[['代码', '名称', '总分', '现价', 'MACD状态', 'KDJ状态']].head(10).to_string(index=False))
         
-        filename = f"Alpha_Galaxy_ProMax_{datetime.now().strftime('%Y%m%d')}.xlsx"
-        ExcelExporter.save(df, filename)
+        if self.excel:
+            with self.report.stage('export'):
+                # 形态索引 (pattern_index.py update 建的) 在的话，形态图解带上历史实测胜率
+                from pattern_index import sheet_stats
+                stats = sheet_stats(self.pattern_index) if self.pattern_index else None
+                ExcelExporter.save(df, f"{stem}.xlsx", self.params, stats)
+
+    def shard_key(self):
+        """分片文件的运行条件: 同检查点，但不含分片编号 (各片与合并进程应完全一致)"""
+        key = self.checkpoint_key()
+        key.pop('shard', None)
+        return json.loads(json.dumps(key))
+
+    def save_shard(self, stem, results, order, tables):
+        k, n = self.shard
+        return shard.save(self.shard_dir, k, n, {
+            'key': self.shard_key(), 'stem': stem, 'results': results, 'order': order, 'tables': tables,
+            'info': self.report.info, 'report': self.report.snapshot(latencies=True)})
+
+    def merge(self, shards, retry=True, allow_missing=False):
+        """合并 shard_dir 下 N 片的扫描结果，之后与单进程一样跑舆情与导出
+        缺片 (没有/写坏/运行条件对不上) 在 retry 时先在本进程补扫；仍缺且不允许时抛 RuntimeError"""
+        parts, missing = shard.load(self.shard_dir, shards, self.shard_key())
+        rescanned = []
+        if missing and retry:
+            print(f"分片 {missing} 缺失或已过期，在本进程补扫...")
+            for k in missing:
+                self.shard = (k, shards)
+                try:
+                    self.run()
+                    rescanned.append(k)
+                except Exception as e:
+                    print(f"   分片 {k}/{shards} 补扫失败: {e}")
+                finally:
+                    self.shard = None
+            parts, missing = shard.load(self.shard_dir, shards, self.shard_key())
+        if missing and not allow_missing:
+            raise RuntimeError(f"分片 {missing} 缺失 (共 {shards} 片)；加 --allow-missing 可只合并已有的")
+        if not parts:
+            raise RuntimeError(f"{self.shard_dir} 下没有可用的分片")
+
+        self.report = RunReport(self.profile)
+        first = parts[min(parts)]
+        stem = first['stem']
+        self.report.info.update({k: first['info'][k] for k in ('provider', 'asof', 'store', 'incremental', 'params')})
+        # 市场环境只看快照 (分片模式不用仓库)，各片一致，取一份
+        if 'context' in first['info']: self.report.info['context'] = first['info']['context']
+        snapshots = {p['info']['snapshot']['fingerprint'] for p in parts.values()}
+        self.report.info['shards'] = {'n': shards, 'merged': sorted(parts), 'rescanned': rescanned, 'missing': missing,
+                                      'snapshot_mismatch': len(snapshots) > 1,
+                                      'survivors': {k: p['info'].get('survivors', 0) for k, p in sorted(parts.items())}}
+        if missing: print(f"⚠️ 缺少分片 {missing}，只合并已有的 {len(parts)} 片")
+        if len(snapshots) > 1: print("⚠️ 各分片拉到的快照不一致 (候选列表不同)，合并结果可能与单进程不同")
+        try:
+            shard.merge_reports(self.report, [parts[k]['report'] for k in sorted(parts)])
+            results, order = [], {}
+            for k in sorted(parts):
+                results += parts[k]['results']
+                order.update(parts[k]['order'])
+            self.report.info['survivors'] = len(results)
+            tables = [t for k in sorted(parts) for t in parts[k]['tables']]
+            if self.score_formats and tables:
+                import pandas as pd
+                # 各片的打分表按快照顺序拼成一张
+                with self.report.stage('score_export'):
+                    table = pd.concat(tables, ignore_index=True)
+                    table = table.iloc[np.argsort(table['代码'].map(order).to_numpy(), kind='stable')]
+                    writer = ScoreWriter(stem, self.score_formats)
+                    try:
+                        for i in range(0, len(table), self.batch_size):
+                            writer.write(table.iloc[i:i + self.batch_size])
+                    except Exception:
+                        writer.close(ok=False)
+                        raise
+                    self.report.info['scores'] = {'rows': writer.rows, 'paths': writer.close()}
+            self.finish(stem, results, order)
+        finally:
+            path = self.report.save(f"{stem}.json", f"{stem}.prof" if self.profile else None)
+            print(f"   环节耗时: {self.report.summary()}")
+            print(f"📄 运行报告已保存至: {path}")
+
+
+def score_offline(store, symbols, asof=None, snapshot=None, params=rules.DEFAULT):
+    """本地仓库 -> 若干只在 asof (yyyymmdd，缺省各自最后一根) 收盘后的打分表，不联网，列同全市场打分表
+    取数窗口同日终扫描 (往前 store.window_days 天，按仓库的复权方式)；snapshot: {代码: (名称, 市盈率, 市净率, 换手率%)}，
+    没给的 (或换手率为 None): 换手率取当天 K 线的，估值为空 (估值类规则不计分)"""
+    snapshot = snapshot or {}
+    frames, args = [], {}
+    for s in symbols:
+        bars = store.read(s)
+        if asof: bars = bars[bars['date'] <= asof]
+        if not len(bars): continue
+        end = datetime.strptime(str(asof or bars['date'][-1]), '%Y%m%d')
+        bars = store.adjusted(s, bars[bars['date'] >= date_to_int(end - timedelta(days=store.window_days))])
+        if len(bars) < 60: continue
+        name, pe, pb, turnover = snapshot.get(s, (s, np.nan, np.nan, None))
+        args[s] = (s, name, pe, pb, bars['turnover'][-1] if turnover is None else turnover)
+        frames.append((s, bars))
+    md = MarketData.from_frames(frames)
+    factors = IndicatorEngine.calculate_market(md).reindex(md.symbols)
+    bits, k_score = KLineStrictLib.detect_market(md)
+    dates = md.calendar[md.day[md.offsets[1:] - 1]] if len(md) else np.empty(0, dtype=np.int64)
+    return AlphaGalaxyOmni.score_table([args[s] for s in md.symbols], factors, bits, k_score, dates, params)
+
+
+def picks_from_scores(table, top_n=30):
+    """全市场打分表 -> 精选结果行 (即 run 里舆情风控之前的入围结果，按总分取前 top_n，同分按表内顺序)"""
+    split = lambda x: x.split(' | ') if x else []
+    sel = table[table['入围'].astype(bool)].sort_values('总分', ascending=False, kind='stable').head(top_n)
+    return [AlphaGalaxyOmni.output((r['代码'], r['名称'], r['市盈率'], r['市净率'], r['换手率%']), r, int(r['总分']),
+                                   int(r['规则位']), split(r['买入形态']), split(r['风险形态']))
+            for r in sel.to_dict('records')]
+
+
+# 子命令 (第一个参数不是子命令时按 scan 处理，兼容原来的 python main.py --scores parquet 写法)
+COMMANDS = ('scan', 'merge', 'score', 'export', 'sentiment', 'bench')
+
+
+def _provider_args(p):
+    p.add_argument('--provider', choices=['akshare', 'replay'], default='akshare', help='数据源')
+    p.add_argument('--replay-dir', help='回放数据目录 (--provider replay)')
+    p.add_argument('--latency', type=float, default=0.0, help='回放: 每次请求注入的平均延迟 (秒)')
+    p.add_argument('--fail-rate', type=float, default=0.0, help='回放: 每次请求注入的失败概率')
+    p.add_argument('--seed', type=int, default=0, help='回放: 注入延迟/失败的随机种子')
+    p.add_argument('--sentiment-cache', default='sentiment_cache/headlines.pkl', help='逐条标题 SnowNLP 缓存文件')
+
+
+def _scan_args(p):
+    p.add_argument('--store', default=None, help='本地行情仓库目录 (默认 price_store；回放模式默认不用)')
+    p.add_argument('--no-store', action='store_true', help='不使用本地仓库，每次全量下载')
+    p.add_argument('--incremental', action='store_true', help='指标走持久化流式状态，只更新新 K 线')
+    p.add_argument('--state', default='indicator_state', help='流式指标状态目录')
+    p.add_argument('--concurrency', type=int, default=8, help='起始拉取并发 (自适应调整)')
+    p.add_argument('--rate', type=float, default=20, help='全局限速: 每秒最多请求数')
+    _provider_args(p)
+    p.add_argument('--record', help='把本次拉到的数据录制成回放目录')
+    p.add_argument('--profile', action='store_true', help='计算环节 (指标/形态/打分) 另存 cProfile 到报告旁的 .prof')
+    p.add_argument('--workers', type=int, default=None, help='计算进程数 (默认 CPU 核数，1 为进程内计算)')
+    p.add_argument('--sentiment-top', type=int, default=300, help='舆情风控覆盖前多少只 (剔除后导出前 30)')
+    p.add_argument('--params', help='打分参数 JSON ({参数名: 值}，未列出的用缺省值；sweep.py 输出的最优参数可直接用)')
+    p.add_argument('--scores', nargs='+', choices=sorted(FORMATS), help='全市场打分表流式落盘格式 (可多选；入围与否都写，含全部因子)')
+    p.add_argument('--no-excel', action='store_true', help='不写 xlsx 汇总 (只要打分表时用)')
+    p.add_argument('--checkpoint', default='checkpoint', help='检查点目录 (每算完一批落盘，成功结束后删除)')
+    p.add_argument('--no-checkpoint', action='store_true', help='不写检查点')
+    p.add_argument('--resume', action='store_true', help='从检查点续跑: 跳过已完成的股票，只重跑失败与缺失的 (过期检查点自动丢弃)')
+    p.add_argument('--pattern-index', default='pattern_index', help='形态索引目录 (有的话形态图解附历史实测胜率)')
+    p.add_argument('--shard-dir', default='shards', help='分片结果目录')
+    p.add_argument('--risk-off', choices=GATE_MODES, default='scan',
+                   help='risk_off 日 (见运行报告 info.context) 的风险闸门: scan 照常扫/shrink 只留相对强度靠前的/skip 跳过')
+    p.add_argument('--risk-off-keep', type=float, default=0.3, help='--risk-off shrink: 保留候选池的比例')
+    p.add_argument('--sectors', help='代码->行业 映射 CSV (列: 代码, 行业)；不给按代码前缀分交易板块')
+
+
+def cli(argv=None):
+    import sys
+    import argparse
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv[:1] == ['bench']:
+        # 基准测试自带参数解析，原样转交
+        import bench
+        return bench.main(argv[1:])
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ('-h', '--help')):
+        argv = ['scan'] + argv
+    parser = argparse.ArgumentParser(description='Alpha Galaxy Omni Pro Max')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('scan', help='日终全市场扫描 (缺省子命令)')
+    _scan_args(p)
+    p.add_argument('--shard', help='分片 worker: 只扫第 K 片 (K/N，按代码哈希切)，结果写到 --shard-dir，舆情与导出留给 merge')
+    p.add_argument('--local-shards', type=int, help='本机起 N 个分片 worker 子进程，跑完在本进程合并')
+    p.add_argument('--allow-missing', action='store_true', help='--local-shards: 补扫后仍缺片时只合并已有的')
+
+    p = sub.add_parser('merge', help='合并各分片的扫描结果，跑舆情风控并导出 (参数须与各片一致)')
+    _scan_args(p)
+    p.add_argument('--shards', type=int, required=True, help='总片数 N')
+    p.add_argument('--no-retry', action='store_true', help='缺片不在本进程补扫')
+    p.add_argument('--allow-missing', action='store_true', help='仍缺片时只合并已有的 (缺哪些记在运行报告里)')
+
+    p = sub.add_parser('score', help='用本地仓库给几只股票打分 (不联网)')
+    p.add_argument('symbols', nargs='+', help='股票代码')
+    p.add_argument('--store', default='price_store', help='本地行情仓库目录')
+    p.add_argument('--date', type=int, help='按哪天收盘后打分 yyyymmdd (默认各自最后一根)')
+    p.add_argument('--pe', type=float, default=np.nan, help='市盈率 (仓库里没有估值，不给则估值类规则不计分)')
+    p.add_argument('--pb', type=float, default=np.nan, help='市净率')
+    p.add_argument('--turnover', type=float, help='换手率%% (默认取当天 K 线的)')
+    p.add_argument('--params', help='打分参数 JSON')
+
+    p = sub.add_parser('export', help='从已落盘的全市场打分表重新生成 xlsx 汇总 (不重扫、不联网、不跑舆情)')
+    p.add_argument('scores', help='打分表文件 (*_scores.csv / .ndjson / .parquet)')
+    p.add_argument('--out', help='xlsx 路径 (默认与打分表同名)')
+    p.add_argument('--top', type=int, default=30, help='导出前多少只')
+    p.add_argument('--params', help='打分参数 JSON (默认取同名运行报告里记的参数)')
+    p.add_argument('--pattern-index', default='pattern_index', help='形态索引目录 (有的话形态图解附历史实测胜率)')
+
+    p = sub.add_parser('sentiment', help='几只股票的舆情打分 (或只预编译 SnowNLP 模型)')
+    p.add_argument('symbols', nargs='*', help='股票代码')
+    _provider_args(p)
+    p.add_argument('--compile-model', action='store_true', help='重新预编译 SnowNLP 模型 (放在舆情缓存旁)')
+
+    sub.add_parser('bench', help='合成全市场基准测试 (参数见 python main.py bench --help)')
+    args = parser.parse_args(argv)
+    params = rules.load_params(args.params) if getattr(args, 'params', None) else None
+
+    if args.command in ('scan', 'merge'):
+        local = getattr(args, 'local_shards', None)
+        if local:
+            # worker 子进程用同一套 scan 参数，去掉本机多进程自己的开关
+            rest, skip = [], False
+            for a in argv[1:]:
+                if skip: skip = False
+                elif a == '--local-shards': skip = True
+                elif not a.startswith('--local-shards=') and a != '--allow-missing': rest.append(a)
+            failed = shard.spawn(rest, local, args.shard_dir)
+            if failed: print(f"⚠️ 分片 {failed} 的 worker 失败，合并时补扫")
+        provider = make_provider(args.provider, args.replay_dir, args.latency, args.fail_rate, args.seed, args.record, timeout=30)
+        # 回放模式默认不碰本地仓库，避免回放数据混进线上缓存
+        store_dir = None if args.no_store or (args.provider == 'replay' and args.store is None) else (args.store or 'price_store')
+        app = AlphaGalaxyOmni(store_dir=store_dir,
+                              state_dir=args.state if args.incremental else None,
+                              concurrency=args.concurrency, rate=args.rate, provider=provider, profile=args.profile,
+                              sentiment_top=args.sentiment_top, sentiment_cache=args.sentiment_cache,
+                              workers=args.workers, params=params, scores=args.scores, excel=not args.no_excel,
+                              checkpoint=None if args.no_checkpoint else args.checkpoint, resume=args.resume,
+                              pattern_index=args.pattern_index, shard_dir=args.shard_dir,
+                              shard=shard.parse(args.shard) if getattr(args, 'shard', None) else None,
+                              risk_off=args.risk_off, risk_off_keep=args.risk_off_keep,
+                              sectors=load_sectors(args.sectors) if args.sectors else None)
+        if args.command == 'merge':
+            app.merge(args.shards, retry=not args.no_retry, allow_missing=args.allow_missing)
+        elif local:
+            app.merge(local, allow_missing=args.allow_missing)
+        else:
+            app.run()
+
+    elif args.command == 'score':
+        import pandas as pd
+        snapshot = {s: (s, args.pe, args.pb, args.turnover) for s in args.symbols}
+        table = score_offline(PriceStore(args.store), args.symbols, args.date, snapshot, params or rules.DEFAULT)
+        missing = [s for s in args.symbols if s not in set(table['代码'])]
+        if missing: print(f"仓库里没有或历史不足 60 根: {' '.join(missing)}")
+        if len(table):
+            with pd.option_context('display.max_colwidth', 80):
+                print(table.drop(columns=['名称']).set_index('代码').T.to_string())
+
+    elif args.command == 'export':
+        import pandas as pd
+        from export import read_scores
+        from pattern_index import sheet_stats
+        stem = args.scores.rsplit('_scores', 1)[0]
+        if params is None and os.path.exists(f"{stem}.json"):
+            with open(f"{stem}.json", encoding='utf-8') as f:
+                recorded = json.load(f).get('info', {}).get('params')
+            params = rules.params_from(recorded) if recorded else None
+        df = pd.DataFrame(picks_from_scores(read_scores(args.scores), args.top))
+        if df.empty:
+            print("打分表里没有入围标的。")
+            return 0
+        df['舆情分析'] = '-'
+        print(df[['代码', '名称', '总分', '现价', 'MACD状态', 'KDJ状态']].head(10).to_string(index=False))
+        stats = sheet_stats(args.pattern_index) if args.pattern_index else None
+        ExcelExporter.save(df, args.out or f"{stem}.xlsx", params or rules.DEFAULT, stats)
+
+    elif args.command == 'sentiment':
+        SentimentEngine.load_cache(args.sentiment_cache)
+        if args.compile_model:
+            from sentiment import CompiledSentiment, snownlp_fingerprint
+            t0 = time.perf_counter()
+            CompiledSentiment.compile(model_dir(args.sentiment_cache), snownlp_fingerprint())
+            print(f"SnowNLP 模型已预编译至: {model_dir(args.sentiment_cache)} ({time.perf_counter() - t0:.1f}s)")
+        if args.symbols:
+            provider = make_provider(args.provider, args.replay_dir, args.latency, args.fail_rate, args.seed, timeout=30)
+            scheduler = FetchScheduler(concurrency=8, max_concurrency=16, rate=getattr(provider, 'news_rate', None) or 1e6,
+                                       retries=1, timeout=30)
+            for s, (score, msg) in SentimentEngine.analyze_many(args.symbols, provider, scheduler).items():
+                print(f"{s}  {score:+.1f}  {msg}")
+            SentimentEngine.cache.save()
+    return 0
+
 
 if __name__ == "__main__":
-    AlphaGalaxyOmni().run()
+    import sys
+    sys.exit(cli())
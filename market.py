@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+紧凑行情容器 (MarketData) - 全市场日线常驻内存，不留逐只 DataFrame
+1. 只存引擎用到的字段 (默认 OHLCV)：全部股票的 K 线首尾相接，每个字段一条连续数组，第 i 只占 [offsets[i], offsets[i+1])
+2. 日期共用一条交易日轴 (int32 yyyymmdd，升序去重)，每根 K 线只存 uint16 轴下标
+3. 字段按能否无损压缩选编码: 价格/换手率按 0.01 存 int32 (A 股报价精确到分，还原后与原 float64 逐位相同)，
+   成交量 (手) 存整数；有一个值还原不回原值就整列换成更宽的编码 (最后退回 float64)，所以下游结果与原始数据逐位一致
+4. from_frames() 可吃迭代器，逐只压缩追加，峰值内存约等于容器本身加一只股票
+5. panel(): 取若干只拼成右对齐的 (股票 × 日期) float64 面板，与 IndicatorEngine.to_panel 同形，可只取尾部 tail 根
+6. save()/load(): 每个数组一个 .npy，load(mmap=True) 只映射不读入，多进程共用同一份页缓存
+"""
+
+import os
+import json
+import numpy as np
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+# 由窄到宽依次尝试的编码 (dtype, 放大倍数)，整数编码里 NaN 用该 dtype 的最小值占位；float64 兜底
+CODECS = (('<i4', 100), ('<i4', 1), ('<i8', 1), ('<f8', 1))
+
+
+def _encode(x, start=0):
+    """float64 -> (编码后数组, CODECS 下标)，从 CODECS[start] 起取第一个能无损还原的编码"""
+    x = np.asarray(x, dtype=np.float64)
+    nan = np.isnan(x)
+    with np.errstate(invalid='ignore', over='ignore'):
+        for k in range(start, len(CODECS) - 1):
+            dtype, scale = CODECS[k]
+            info = np.iinfo(dtype)
+            q = np.rint(x * scale)
+            ok = nan | ((np.abs(q) < info.max) & (q / scale == x))
+            if ok.all():
+                return np.where(nan, info.min, q).astype(dtype), k
+    return x, len(CODECS) - 1
+
+
+def _decode(raw, dtype, scale):
+    if dtype == '<f8': return np.asarray(raw, dtype=np.float64)
+    out = np.asarray(raw).astype(np.float64)
+    out[np.asarray(raw) == np.iinfo(dtype).min] = np.nan
+    return out / scale if scale != 1 else out
+
+
+class MarketData:
+    """symbols: 代码列表；offsets: (n+1,) int64；calendar: 交易日轴；day: 每根 K 线的轴下标；
+    columns: {字段: 编码后数组}；codecs: {字段: (dtype, 放大倍数)}"""
+
+    def __init__(self, symbols, offsets, calendar, day, columns, codecs):
+        self.symbols = list(symbols)
+        self.offsets = offsets
+        self.calendar = calendar
+        self.day = day
+        self.columns = columns
+        self.codecs = codecs
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+
+    @property
+    def fields(self):
+        return tuple(self.columns)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.offsets, self.calendar, self.day, *self.columns.values()))
+
+    @staticmethod
+    def from_frames(frames, fields=FIELDS):
+        """[(代码, 日线)] (可为迭代器) -> MarketData；日线为 {列: ndarray}、PriceStore 结构化数组或 DataFrame
+        逐只编码追加；某只压不进当前编码时，已有部分解码后与它一起换成更宽的编码"""
+        from store import dates_to_int
+        symbols, lens, dates = [], [], []
+        chunks = {f: [] for f in fields}
+        codec = {f: 0 for f in fields}
+        for symbol, df in frames:
+            d = np.asarray(df['date'])
+            dates.append((d if np.issubdtype(d.dtype, np.integer) else dates_to_int(d)).astype(np.int32))
+            symbols.append(symbol)
+            lens.append(len(d))
+            for f in fields:
+                raw, k = _encode(df[f], codec[f])
+                if k != codec[f] and chunks[f]:
+                    old = _decode(np.concatenate(chunks[f]), *CODECS[codec[f]])
+                    raw, k = _encode(np.concatenate([old, np.asarray(df[f], dtype=np.float64)]), k)
+                    chunks[f] = []
+                chunks[f].append(raw)
+                codec[f] = k
+        calendar, day = np.unique(np.concatenate(dates) if dates else np.empty(0, dtype=np.int32), return_inverse=True)
+        if len(calendar) > np.iinfo(np.uint16).max: raise ValueError("交易日超过 65535 个")
+        offsets = np.concatenate([[0], np.cumsum(lens, dtype=np.int64)])
+        columns = {f: np.concatenate(chunks[f]) if chunks[f] else np.empty(0, dtype=CODECS[codec[f]][0]) for f in fields}
+        return MarketData(symbols, offsets, calendar.astype(np.int32), day.astype(np.uint16), columns,
+                          {f: CODECS[codec[f]] for f in fields})
+
+    def bars(self, i):
+        """第 i 只 (或代码) 的全部 K 线 -> {列: ndarray}，与 IndicatorEngine.to_arrays 同形"""
+        i = self.index[i] if isinstance(i, str) else i
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        out = {f: _decode(self.columns[f][lo:hi], *self.codecs[f]) for f in self.columns}
+        out['date'] = self.calendar[self.day[lo:hi]].astype(np.int64)
+        return out
+
+    def column(self, f):
+        """字段 f 的全部 K 线解码成一条 float64 (第 i 只为 [offsets[i], offsets[i+1]))"""
+        return _decode(self.columns[f], *self.codecs[f])
+
+    def panel(self, rows=None, fields=None, tail=None):
+        """rows 只股票 (下标列表，缺省全部) -> 右对齐面板 {字段: (股票 × 日期)}，含 'symbols' 与 'date'
+        tail: 每只只取最后 tail 根 (窗口不超过 tail 的指标/形态结果不变)"""
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.int64)
+        fields = fields or self.fields
+        lens = self.lengths[rows]
+        if tail is not None: lens = np.minimum(lens, tail)
+        T = int(lens.max()) if len(lens) else 0
+        # 展平: 第 k 根 (k 在全体被选 K 线里的序号) 来自 src[k]，落到面板 (r[k], col[k])
+        total = int(lens.sum())
+        before = np.repeat(np.cumsum(lens) - lens, lens)
+        k = np.arange(total) - before
+        src = np.repeat(self.offsets[rows + 1] - lens, lens) + k
+        r = np.repeat(np.arange(len(rows)), lens)
+        col = np.repeat(T - lens, lens) + k
+        panel = {'symbols': [self.symbols[i] for i in rows]}
+        for f in fields:
+            arr = np.full((len(rows), T), np.nan)
+            arr[r, col] = _decode(self.columns[f][src], *self.codecs[f])
+            panel[f] = arr
+        dates = np.zeros((len(rows), T), dtype=np.int64)
+        dates[r, col] = self.calendar[self.day[src]]
+        panel['date'] = dates
+        return panel
+
+    def select(self, rows):
+        """取子集 (拷贝成新的连续数组)"""
+        rows = np.asarray(rows, dtype=np.int64)
+        lens = self.lengths[rows]
+        src = np.repeat(self.offsets[rows], lens) + np.arange(int(lens.sum())) - np.repeat(np.cumsum(lens) - lens, lens)
+        return MarketData([self.symbols[i] for i in rows], np.concatenate([[0], np.cumsum(lens)]), self.calendar,
+                          np.asarray(self.day[src]), {f: np.asarray(a[src]) for f, a in self.columns.items()}, self.codecs)
+
+    # ---------- 落盘 ----------
+    def save(self, root):
+        os.makedirs(root, exist_ok=True)
+        arrays = {'offsets': self.offsets, 'calendar': self.calendar, 'day': self.day,
+                  **{f'col_{f}': a for f, a in self.columns.items()}}
+        for name, a in arrays.items():
+            np.save(os.path.join(root, f'{name}.npy'), np.ascontiguousarray(a))
+        # meta 最后写，读到 meta 就说明数组已写完
+        tmp = os.path.join(root, 'meta.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'symbols': self.symbols, 'codecs': self.codecs}, f)
+        os.replace(tmp, os.path.join(root, 'meta.json'))
+        return root
+
+    @staticmethod
+    def load(root, mmap=True):
+        with open(os.path.join(root, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        load = lambda name: np.load(os.path.join(root, f'{name}.npy'), mmap_mode='r' if mmap else None)
+        codecs = {f: tuple(c) for f, c in meta['codecs'].items()}
+        return MarketData(meta['symbols'], load('offsets'), load('calendar'), load('day'),
+                          {f: load(f'col_{f}') for f in codecs}, codecs)
@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""
+形态倒排索引 (PatternIndex) - 全部历史 K 线的形态出现记录，按形态查 (代码, 日期) 与事后涨跌
+1. K 线表: 全部历史上出现过任一形态的 K 线一行，按 (日期, 代码) 排序，行号即 K 线编号
+   - 列: 日期、代码编号、形态位掩码 (位序同 KLineStrictLib.PATTERNS)、若干筛选因子 (float32)、远期收益
+   - 远期收益同 backtest: 次日开盘买入，第 h 天收盘 (h = 5/10/20)；还没走完的为 NaN，之后的更新里补上
+2. 倒排: 每个形态一条升序的 K 线编号列表 (由位掩码列生成)；编号按日期有序，日期区间即编号区间，
+   多个形态的与/或就是有序数组的交/并
+3. 筛选因子只收窗口类指标 (资金流/RSI/ADX/量比/乖离/布林带宽/CCI/涨幅)，日常更新只在尾部 TAIL 根上算，与整段算逐位一致
+4. 日常更新: 只扫最后一次索引之后的新 K 线追加到表尾，补齐到期的远期收益；
+   复权事件变了 (分红送转) 或新上市的股票整只重扫
+5. 各形态各持有期的样本数/平均收益/胜率 (对比同期全市场) 随索引一起算好存 stats.json，'形态图解' 表直接引用
+6. 落盘: 每列一个 .npy (读取走 mmap)，先写临时目录再整体换名，meta.json 记代码表、最后索引日与复权指纹
+
+用法:
+    python pattern_index.py update --store price_store
+    python pattern_index.py query 早晨之星 "岛形反转(底)" --days 120 --where "cmf>0.1"
+    python pattern_index.py query 锤子线 多方炮 --all --start 20240101 --out hits.csv
+    python pattern_index.py stats
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+
+import rules
+from instrument import RunReport
+from main import IndicatorEngine, KLineStrictLib
+
+VERSION = 1
+HORIZONS = (5, 10, 20)
+# 筛选因子: 面板序列名 (查询时也认打分表里的 cmf_0 / pct_0 写法)
+COLUMNS = ('pct', 'vol_ratio', 'cmf', 'rsi', 'adx', 'bias', 'bb_width', 'cci')
+ALIASES = {'cmf_0': 'cmf', 'pct_0': 'pct'}
+# 尾部增量计算的根数: ma60 要 60 根，ADX 的两层 14 日窗口要 28 根，留一点余量 (同 intraday.IntradayWatch.TAIL)
+TAIL = 64
+PRICE_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+# 形态名 (同 rules.PATTERNS，位序一致)；查询时风险形态带不带 "风险:" 前缀都行
+NAMES = [p.name for p in rules.PATTERNS]
+WHERE = re.compile(r'^\s*(\w+)\s*(>=|<=|==|>|<)\s*(-?[\d.]+(?:e-?\d+)?)\s*$')
+OPS = {'>': np.greater, '>=': np.greater_equal, '<': np.less, '<=': np.less_equal, '==': np.equal}
+
+
+def pattern_id(name):
+    name = name.split(':', 1)[-1] if name.startswith('风险:') else name
+    if name not in NAMES: raise ValueError(f"未知形态: {name}")
+    return NAMES.index(name)
+
+
+def parse_where(conds):
+    """["cmf>0.1", ...] 或 [(列, 运算符, 值), ...] -> [(列, 运算符, 值)]"""
+    out = []
+    for c in conds or ():
+        if isinstance(c, str):
+            m = WHERE.match(c)
+            if not m: raise ValueError(f"看不懂的条件: {c} (写法如 cmf>0.1)")
+            c = (m.group(1), m.group(2), float(m.group(3)))
+        col, op, value = c
+        col = ALIASES.get(col, col)
+        if col not in COLUMNS: raise ValueError(f"不能按 {col} 筛选，可用: {', '.join(COLUMNS)}")
+        if op not in OPS: raise ValueError(f"未知运算符: {op}")
+        out.append((col, op, value))
+    return out
+
+
+def _empty():
+    return {'date': np.empty(0, dtype=np.int32), 'sym': np.empty(0, dtype=np.int32), 'bits': np.empty(0, dtype=np.int64),
+            **{k: np.empty(0, dtype=np.float32) for k in COLUMNS},
+            **{f'fwd_{h}': np.empty(0, dtype=np.float32) for h in HORIZONS}}
+
+
+def scan(md, rows, ids, since=None, tail=None):
+    """md 的若干行 -> 这些股票 (日期 > since 的) 有形态的 K 线，列同 K 线表 (远期收益为 NaN)
+    ids: 与 rows 对应的代码编号；since: 每只已索引到的日期 (标量或与 rows 对应的数组)；
+    tail: 只展开每只最后 tail 根 (窗口类因子与形态与整段算一致)"""
+    p = md.panel(rows, fields=PRICE_FIELDS, tail=tail)
+    o, h, l, c, v = (p[k] for k in PRICE_FIELDS)
+    S = IndicatorEngine.panel_series(h, l, c, v)
+    bits, _ = KLineStrictLib.detect_panel(o, h, l, c, v, S['ma5'], S['ma10'], S['ma20'])
+    keep = bits != 0
+    if since is not None: keep &= p['date'] > np.reshape(since, (-1, 1))
+    r, col = np.nonzero(keep)
+    out = {'date': p['date'][r, col].astype(np.int32), 'sym': np.asarray(ids, dtype=np.int32)[r],
+           'bits': bits[r, col].astype(np.int64)}
+    for k in COLUMNS:
+        out[k] = S[k][r, col].astype(np.float32)
+    for hz in HORIZONS:
+        out[f'fwd_{hz}'] = np.full(len(r), np.nan, dtype=np.float32)
+    return out
+
+
+def _bar_keys(md):
+    """每根 K 线的全局键 (行号 * 交易日数 + 交易日下标)，按行、日期升序，可 searchsorted"""
+    C = len(md.calendar)
+    return np.repeat(np.arange(len(md), dtype=np.int64), md.lengths) * C + md.day
+
+
+def forward(md, rows, dates, horizons=HORIZONS, keys=None):
+    """(md 行号, 日期) -> {h: 次日开盘买入、第 h 天收盘的收益}；行号为 -1、K 线不在 md 里或还没走完的为 NaN"""
+    keys = _bar_keys(md) if keys is None else keys
+    rows, dates = np.asarray(rows, dtype=np.int64), np.asarray(dates, dtype=np.int64)
+    ci = np.searchsorted(md.calendar, dates)
+    ok = (rows >= 0) & (ci < len(md.calendar))
+    ok[ok] &= md.calendar[ci[ok]] == dates[ok]
+    k = np.searchsorted(keys, rows * len(md.calendar) + ci)
+    ok[ok] &= keys[np.minimum(k[ok], len(keys) - 1)] == rows[ok] * len(md.calendar) + ci[ok]
+    end = np.where(ok, md.offsets[np.maximum(rows, 0) + 1], 0)
+    o, c = md.column('open'), md.column('close')
+    out = {}
+    for h in horizons:
+        live = ok & (k + h < end)
+        f = np.full(len(rows), np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f[live] = c[k[live] + h] / o[k[live] + 1] - 1
+        out[h] = f
+    return out
+
+
+def baseline(md, start, end, horizons=HORIZONS):
+    """同期全市场 (历史够判形态的每根 K 线) 的远期收益: {h: (样本数, 收益和, 上涨数)}"""
+    keys = _bar_keys(md)
+    pos = np.arange(len(keys)) - np.repeat(md.offsets[:-1], md.lengths)
+    date = md.calendar[md.day]
+    pick = np.flatnonzero((pos >= KLineStrictLib.MIN_BARS - 1) & (date >= start) & (date <= end))
+    f = forward(md, keys[pick] // len(md.calendar), date[pick], horizons, keys)
+    out = {}
+    for h in horizons:
+        x = f[h][~np.isnan(f[h])]
+        out[h] = (int(len(x)), float(x.sum()), int((x > 0).sum()))
+    return out
+
+
+class PatternIndex:
+    """root: 索引目录；bars: K 线表 {列: 一维数组}；post/offsets: 倒排 (第 i 个形态为 post[offsets[i]:offsets[i+1]])"""
+
+    def __init__(self, root='pattern_index', mmap=True):
+        self.root = root
+        self.meta, self.stats = None, None
+        self.bars, self.post, self.offsets = _empty(), np.empty(0, dtype=np.int32), np.zeros(len(NAMES) + 1, dtype=np.int64)
+        meta = self.read_meta(root)
+        if meta:
+            self.meta = meta
+            load = lambda name: np.load(os.path.join(root, f'{name}.npy'), mmap_mode='r' if mmap else None)
+            self.bars = {k: load(f'bar_{k}') for k in _empty()}
+            self.post, self.offsets = load('post'), load('offsets')
+            with open(os.path.join(root, 'stats.json'), encoding='utf-8') as f:
+                self.stats = json.load(f)
+
+    @staticmethod
+    def read_meta(root):
+        path = os.path.join(root, 'meta.json')
+        if not os.path.exists(path): return None
+        with open(path, encoding='utf-8') as f:
+            meta = json.load(f)
+        return meta if meta.get('version') == VERSION and meta.get('patterns') == NAMES else None
+
+    @property
+    def symbols(self):
+        return self.meta['symbols'] if self.meta else []
+
+    def __len__(self):
+        return len(self.bars['date'])
+
+    # ---------- 建索引 / 增量更新 ----------
+    def build(self, md, adjust=None, chunk=500, report=None):
+        """全部历史整段重扫 (adjust: {代码: 复权指纹}，更新时据此判断哪些股票要整只重扫)"""
+        self.meta = None
+        self.bars = _empty()
+        return self.update(md, adjust, chunk, report)
+
+    def update(self, md, adjust=None, chunk=500, report=None):
+        """只扫最后索引日之后的新 K 线；复权指纹变了或新出现的股票整只重扫；然后补远期收益、重算倒排与统计"""
+        report = report or RunReport()
+        adjust = adjust or {}
+        meta = self.meta or {'symbols': [], 'through': [], 'last': 0, 'adjust': {}}
+        symbols, through = list(meta['symbols']), list(meta['through'])
+        ids = {s: i for i, s in enumerate(symbols)}
+        old_adjust = meta['adjust']
+        fresh = [s for s in md.symbols if s not in ids or adjust.get(s) != old_adjust.get(s)]
+        for s in fresh:
+            if s not in ids:
+                ids[s] = len(symbols)
+                symbols.append(s)
+                through.append(0)
+        sym_ids = np.array([ids[s] for s in md.symbols], dtype=np.int32)
+
+        bars = {k: np.asarray(v) for k, v in self.bars.items()}
+        if fresh and len(bars['date']):
+            keep = ~np.isin(bars['sym'], [ids[s] for s in fresh])
+            bars = {k: v[keep] for k, v in bars.items()}
+        fresh_rows = np.array([md.index[s] for s in fresh], dtype=np.int64)
+        last_date = md.calendar[md.day[md.offsets[1:] - 1]] if len(md) else np.empty(0, dtype=np.int32)
+        new = np.ones(len(md), dtype=bool)
+        new[fresh_rows] = False
+        # 每只各自索引到哪天 (某天没拉到数据的股票，补回来的 K 线也会被扫到)
+        since = np.array(through, dtype=np.int64)[sym_ids]
+        new &= last_date > since
+        tail_rows = np.flatnonzero(new)
+        parts = [bars]
+        with report.stage('scan'):
+            for i in range(0, len(fresh_rows), chunk):
+                rows = fresh_rows[i:i + chunk]
+                parts.append(scan(md, rows, sym_ids[rows]))
+            if len(tail_rows):
+                # 每只要补的新 K 线根数 (停牌的少一些)，尾部多留这么多根
+                n_new = md.offsets[tail_rows + 1] - np.array([md.offsets[r] + np.searchsorted(
+                    md.calendar[md.day[md.offsets[r]:md.offsets[r + 1]]], since[r], side='right') for r in tail_rows])
+                for i in range(0, len(tail_rows), chunk):
+                    rows = tail_rows[i:i + chunk]
+                    parts.append(scan(md, rows, sym_ids[rows], since[rows], TAIL + int(n_new[i:i + chunk].max())))
+        bars = {k: np.concatenate([p[k] for p in parts]) for k in bars}
+        order = np.lexsort((bars['sym'], bars['date']))
+        bars = {k: v[order] for k, v in bars.items()}
+
+        with report.stage('forward'):
+            # 还没走完的远期收益 (含新扫出来的) 用 md 补上
+            pending = np.flatnonzero(np.isnan(bars[f'fwd_{HORIZONS[-1]}']))
+            row_of = np.full(len(symbols), -1, dtype=np.int64)
+            row_of[sym_ids] = np.arange(len(md))
+            f = forward(md, row_of[bars['sym'][pending]], bars['date'][pending])
+            for h in HORIZONS:
+                col = bars[f'fwd_{h}']
+                fill = np.isnan(col[pending])
+                col[pending[fill]] = f[h][fill]
+
+        self.bars = bars
+        through = np.array(through, dtype=np.int64)
+        through[sym_ids] = np.maximum(since, last_date)
+        first = int(bars['date'][0]) if len(bars['date']) else 0
+        self.meta = {'version': VERSION, 'patterns': NAMES, 'horizons': list(HORIZONS), 'columns': list(COLUMNS),
+                     'symbols': symbols, 'through': through.tolist(), 'first': first, 'last': int(through.max(initial=0)),
+                     'bars': len(bars['date']), 'adjust': {**old_adjust, **{s: adjust.get(s) for s in md.symbols}},
+                     'updated': time.strftime('%Y-%m-%d %H:%M:%S')}
+        with report.stage('invert'):
+            self._invert()
+        with report.stage('stats'):
+            self.stats = self._stats(baseline(md, first, self.meta['last']) if len(md) else {})
+        report.info['pattern_index'] = {'bars': self.meta['bars'], 'occurrences': int(len(self.post)),
+                                        'rescanned': len(fresh), 'tail_scanned': int(len(tail_rows))}
+        return self
+
+    def _invert(self):
+        bits = self.bars['bits']
+        lists = [np.flatnonzero(bits >> i & 1).astype(np.int32) for i in range(len(NAMES))]
+        self.post = np.concatenate(lists) if lists else np.empty(0, dtype=np.int32)
+        self.offsets = np.concatenate([[0], np.cumsum([len(x) for x in lists])]).astype(np.int64)
+
+    def _stats(self, base):
+        """各形态各持有期: 样本数 / 平均收益% / 胜率% / 超额% (对比同期全市场)"""
+        out = {'horizons': list(HORIZONS), 'baseline': {}, 'patterns': {}}
+        for h in HORIZONS:
+            n, s, w = base.get(h, (0, 0.0, 0))
+            out['baseline'][str(h)] = {'n': n, 'mean': s / n * 100 if n else None, 'hit': w / n * 100 if n else None}
+        for i, name in enumerate(NAMES):
+            ids = self.post[self.offsets[i]:self.offsets[i + 1]]
+            row = {}
+            for h in HORIZONS:
+                f = self.bars[f'fwd_{h}'][ids]
+                f = f[~np.isnan(f)].astype(np.float64)
+                mean = f.mean() * 100 if len(f) else None
+                b = out['baseline'][str(h)]['mean']
+                row[str(h)] = {'n': int(len(f)), 'mean': mean, 'hit': (f > 0).mean() * 100 if len(f) else None,
+                               'excess': mean - b if mean is not None and b is not None else None}
+            out['patterns'][name] = row
+        return out
+
+    def save(self):
+        """写到临时目录再整体换名，读的一方不会看到半截索引"""
+        tmp, old = self.root + '.tmp', self.root + '.old'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        arrays = {**{f'bar_{k}': v for k, v in self.bars.items()}, 'post': self.post, 'offsets': self.offsets}
+        for name, a in arrays.items():
+            np.save(os.path.join(tmp, f'{name}.npy'), np.ascontiguousarray(a))
+        with open(os.path.join(tmp, 'stats.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.stats, f, ensure_ascii=False, indent=1)
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(self.root): os.rename(self.root, old)
+        os.rename(tmp, self.root)
+        shutil.rmtree(old, ignore_errors=True)
+        return self.root
+
+    # ---------- 查询 ----------
+    def occurrences(self, pattern, start=None, end=None):
+        """一个形态在 [start, end] 内的 K 线编号 (升序)"""
+        i = pattern_id(pattern)
+        ids = self.post[self.offsets[i]:self.offsets[i + 1]]
+        date = self.bars['date']
+        lo = np.searchsorted(date, start, side='left') if start else 0
+        hi = np.searchsorted(date, end, side='right') if end else len(date)
+        return np.asarray(ids[np.searchsorted(ids, lo):np.searchsorted(ids, hi)])
+
+    def last_days(self, n):
+        """最近 n 个有记录的交易日的第一天"""
+        days = np.unique(np.asarray(self.bars['date'][-200000:]))
+        if len(days) < n: days = np.unique(np.asarray(self.bars['date']))
+        return int(days[-n]) if len(days) >= n else (int(days[0]) if len(days) else None)
+
+    def match(self, patterns, start=None, end=None, where=(), all_of=False, symbols=None):
+        """形态 (任一 / 全部命中) + 日期区间 + 因子条件 + 代码范围 -> K 线编号 (升序)"""
+        lists = [self.occurrences(p, start, end) for p in patterns]
+        if not lists: return np.empty(0, dtype=np.int32)
+        ids = lists[0]
+        for x in lists[1:]:
+            ids = np.intersect1d(ids, x, assume_unique=True) if all_of else np.union1d(ids, x)
+        for col, op, value in parse_where(where):
+            ids = ids[OPS[op](self.bars[col][ids], value)]
+        if symbols:
+            want = [i for i, s in enumerate(self.symbols) if s in set(symbols)]
+            ids = ids[np.isin(self.bars['sym'][ids], want)]
+        return ids
+
+    def query(self, patterns, start=None, end=None, where=(), all_of=False, symbols=None):
+        """match 的结果展开成表: 代码/日期/命中的形态/筛选因子/远期收益%"""
+        ids = self.match(patterns, start, end, where, all_of, symbols)
+        bits = np.asarray(self.bars['bits'][ids])
+        asked = [pattern_id(p) for p in patterns]
+        names = [' | '.join(NAMES[i] for i in asked if b >> i & 1) for b in bits]
+        out = pd.DataFrame({'代码': [self.symbols[s] for s in self.bars['sym'][ids]], '日期': np.asarray(self.bars['date'][ids]),
+                            '形态': names})
+        for k in COLUMNS:
+            out[k] = np.asarray(self.bars[k][ids], dtype=float)
+        for h in HORIZONS:
+            out[f'{h}日收益%'] = np.asarray(self.bars[f'fwd_{h}'][ids], dtype=float) * 100
+        return out
+
+    @staticmethod
+    def outcome(table):
+        """query 结果的事后表现: 每个持有期的样本数/平均收益/胜率"""
+        rows = []
+        for h in HORIZONS:
+            x = table[f'{h}日收益%'].dropna()
+            rows.append({'持有期': f'{h}日', '样本数': len(x), '平均收益%': round(x.mean(), 3) if len(x) else np.nan,
+                         '中位数%': round(x.median(), 3) if len(x) else np.nan,
+                         '胜率%': round((x > 0).mean() * 100, 2) if len(x) else np.nan})
+        return pd.DataFrame(rows)
+
+    def stats_table(self):
+        """stats.json -> 表: 一行一个形态"""
+        rows = []
+        for name, row in (self.stats or {}).get('patterns', {}).items():
+            out = {'形态': name}
+            for h in HORIZONS:
+                s = row[str(h)]
+                out.update({f'{h}日样本': s['n'], f'{h}日均涨%': _round(s['mean']), f'{h}日胜率%': _round(s['hit']),
+                            f'{h}日超额%': _round(s['excess'])})
+            rows.append(out)
+        return pd.DataFrame(rows)
+
+
+def _round(v, n=2):
+    return None if v is None else round(v, n)
+
+
+def sheet_stats(root='pattern_index', horizon=None):
+    """'形态图解' 表要补的实测列: (列名, {形态名: 值})；没建过索引返回 None"""
+    meta = PatternIndex.read_meta(root)
+    if not meta: return None
+    with open(os.path.join(root, 'stats.json'), encoding='utf-8') as f:
+        stats = json.load(f)
+    h = str(horizon or HORIZONS[-1])
+    cols = [f'实测{h}日胜率%', f'实测{h}日均涨%', f'实测{h}日超额%', '样本数', '统计区间']
+    span = f"{meta['first']}~{meta['last']}"
+    values = {name: [_round(row[h]['hit'], 1), _round(row[h]['mean']), _round(row[h]['excess']), row[h]['n'], span]
+              for name, row in stats['patterns'].items()}
+    return cols, values
+
+
+def adjust_fingerprint(store, symbols):
+    """仓库里每只股票的复权指纹 (除权事件数, 最后一次除权日)：变了说明历史复权价变了，要整只重扫"""
+    out = {}
+    for s in symbols:
+        events = store.factors.get(s) or []
+        out[s] = [len(events), events[-1][0] if events else 0]
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='形态倒排索引: 建/增量更新、按形态查历史出现与事后涨跌')
+    sub = parser.add_subparsers(dest='action', required=True)
+    p = sub.add_parser('update', help='增量更新 (没有索引时全量建)')
+    p.add_argument('--store', default='price_store', help='本地行情仓库目录')
+    p.add_argument('--rebuild', action='store_true', help='丢掉旧索引全量重建')
+    q = sub.add_parser('query', help='按形态查历史出现记录')
+    q.add_argument('patterns', nargs='+', help='形态名 (可多个)')
+    q.add_argument('--all', action='store_true', help='同一根 K 线要同时命中全部形态 (默认任一)')
+    q.add_argument('--start', type=int, help='起始日 yyyymmdd')
+    q.add_argument('--end', type=int, help='结束日 yyyymmdd')
+    q.add_argument('--days', type=int, help='最近多少个交易日 (代替 --start)')
+    q.add_argument('--where', nargs='+', default=[], help=f"因子条件，如 cmf>0.1 (可用: {', '.join(COLUMNS)})")
+    q.add_argument('--symbols', nargs='+', help='只看这些代码')
+    q.add_argument('--out', help='明细写到 csv')
+    sub.add_parser('stats', help='各形态的事后表现')
+    for x in (p, q):
+        x.add_argument('--index', default='pattern_index', help='索引目录')
+    parser.add_argument('--index', default='pattern_index', help='索引目录')
+    args = parser.parse_args()
+
+    if args.action == 'update':
+        from store import PriceStore
+        from backtest import load_store
+        report = RunReport()
+        store = PriceStore(args.store)
+        with report.stage('load'):
+            md = load_store(store)
+        index = PatternIndex(args.index, mmap=False)
+        fp = adjust_fingerprint(store, md.symbols)
+        (index.build if args.rebuild or not index.meta else index.update)(md, fp, report=report)
+        with report.stage('save'):
+            index.save()
+        info = report.info['pattern_index']
+        print(f"形态索引: {info['bars']} 根 K 线 / {info['occurrences']} 条记录，"
+              f"整只重扫 {info['rescanned']} 只，增量 {info['tail_scanned']} 只，截至 {index.meta['last']}")
+        print(f"   环节耗时: {report.summary()}")
+    else:
+        index = PatternIndex(args.index)
+        if not index.meta: raise SystemExit(f"没有索引: {args.index} (先运行 python pattern_index.py update)")
+        if args.action == 'stats':
+            print(index.stats_table().to_string(index=False))
+        else:
+            start = index.last_days(args.days) if args.days else args.start
+            t0 = time.perf_counter()
+            table = index.query(args.patterns, start, args.end, args.where, args.all, args.symbols)
+            elapsed = time.perf_counter() - t0
+            print(f"命中 {len(table)} 次 ({table['代码'].nunique() if len(table) else 0} 只)，查询用时 {elapsed * 1000:.1f}ms")
+            print(index.outcome(table).to_string(index=False))
+            if len(table): print(table.tail(20).round(3).to_string(index=False))
+            if args.out:
+                table.to_csv(args.out, index=False, encoding='utf-8-sig')
+                print(f"明细已保存至: {args.out}")
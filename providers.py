@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+行情数据源 (Provider) - 快照 / 日线 / 分红送转 / 新闻四个接口，流水线只认这一层
+1. AkshareProvider: 线上数据 (东方财富)，akshare 延迟导入 (pandas 也只在真正读写数据时导入，import 本模块不带重依赖)
+2. ReplayProvider: 回放磁盘上录制好的数据，可注入延迟与失败率，离线、可复现
+3. RecordingProvider: 包一层任意数据源，把拉到的数据按回放目录格式落盘，用来录制夹具
+
+回放目录格式 (均为 akshare 原始中文列):
+    <root>/meta.json         {"asof": "2024-06-28 16:00:00"}  回放的"当前时间"
+    <root>/spot.csv          stock_zh_a_spot_em
+    <root>/hist/<代码>.csv    stock_zh_a_hist (前复权)
+    <root>/hist_raw/<代码>.csv  stock_zh_a_hist (不复权，本地仓库用)；没录的回退到 hist/，同时视为没有除权事件
+                             只录了不复权的，要复权价时用 factors/ 现推
+    <root>/factors/<代码>.csv stock_fhps_detail_em
+    <root>/news/<代码>.csv    stock_news_em
+"""
+
+import os
+import json
+import time
+import zlib
+import random
+import threading
+from collections import Counter
+from datetime import datetime
+
+SPOT_DTYPES = {'代码': str}
+HIST_DTYPES = {'股票代码': str}
+NEWS_DTYPES = {'关键词': str}
+# 复权方式 -> 回放目录下的日线子目录
+HIST_DIRS = {'qfq': 'hist', '': 'hist_raw', 'hfq': 'hist_hfq'}
+
+
+class AkshareProvider:
+    name = 'akshare'
+    news_rate = 10  # 新闻接口礼貌限速 (次/秒)
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+
+    def now(self):
+        return datetime.now()
+
+    def spot(self):
+        import akshare as ak
+        return ak.stock_zh_a_spot_em()
+
+    def history(self, symbol, start, end, adjust='qfq'):
+        import akshare as ak
+        return ak.stock_zh_a_hist(symbol=symbol, period='daily', start_date=start, end_date=end, adjust=adjust, timeout=self.timeout)
+
+    def factors(self, symbol):
+        import akshare as ak
+        return ak.stock_fhps_detail_em(symbol=symbol)
+
+    def news(self, symbol):
+        import akshare as ak
+        return ak.stock_news_em(symbol=symbol)
+
+
+class ReplayProvider:
+    """latency: 每次请求的平均附加延迟 (秒，实际在 0.5~1.5 倍间抖动)；fail_rate: 每次请求抛 ConnectionError 的概率
+    注入的随机数由 (seed, 接口, 代码, 第几次调用) 决定，与线程调度无关，重复运行结果一致"""
+    name = 'replay'
+    news_rate = None
+
+    def __init__(self, root, latency=0.0, fail_rate=0.0, seed=0):
+        self.root = root
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.seed = seed
+        self._calls = Counter()
+        self._lock = threading.Lock()
+        meta_path = os.path.join(root, 'meta.json')
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        self.asof = None
+        if meta.get('asof'):
+            import pandas as pd
+            self.asof = pd.Timestamp(meta['asof']).to_pydatetime()
+
+    def _inject(self, kind, symbol=''):
+        with self._lock:
+            n = self._calls[(kind, symbol)]
+            self._calls[(kind, symbol)] += 1
+        rng = random.Random(zlib.crc32(f"{self.seed}:{kind}:{symbol}:{n}".encode()))
+        if self.latency: time.sleep(self.latency * rng.uniform(0.5, 1.5))
+        if self.fail_rate and rng.random() < self.fail_rate:
+            raise ConnectionError(f"injected failure: {kind} {symbol}")
+
+    def _read(self, path, dtype):
+        import pandas as pd
+        if not os.path.exists(path): return pd.DataFrame()
+        return pd.read_csv(path, dtype=dtype)
+
+    def now(self):
+        if self.asof is None:
+            # 没写 asof 就取录制日线里最后一个交易日的收盘后
+            import pandas as pd
+            hist_dir = os.path.join(self.root, 'hist')
+            files = sorted(os.listdir(hist_dir)) if os.path.isdir(hist_dir) else []
+            last = max((pd.read_csv(os.path.join(hist_dir, f), usecols=['日期'])['日期'].max() for f in files), default=None)
+            self.asof = (pd.Timestamp(last) + pd.Timedelta(hours=16)).to_pydatetime() if last else datetime.now()
+        return self.asof
+
+    def spot(self):
+        self._inject('spot')
+        return self._read(os.path.join(self.root, 'spot.csv'), SPOT_DTYPES)
+
+    def _path(self, sub, symbol):
+        return os.path.join(self.root, sub, f"{symbol}.csv")
+
+    def _adjusted(self, symbol, adjust):
+        """只录了不复权日线: 用录下的分红送转表现推复权价"""
+        from store import frame_to_bars
+        from adjust import adjust_bars, events_from_dividends
+        df = self._read(self._path('hist_raw', symbol), HIST_DTYPES)
+        if df.empty: return df
+        df = df.sort_values('日期', kind='stable').reset_index(drop=True)
+        factors = self._read(self._path('factors', symbol), None)
+        bars = adjust_bars(frame_to_bars(df), events_from_dividends(factors), adjust)
+        for col, f in (('开盘', 'open'), ('收盘', 'close'), ('最高', 'high'), ('最低', 'low')):
+            df[col] = bars[f]
+        return df
+
+    def history(self, symbol, start, end, adjust='qfq'):
+        self._inject('hist', symbol)
+        if os.path.exists(self._path(HIST_DIRS[adjust], symbol)):
+            df = self._read(self._path(HIST_DIRS[adjust], symbol), HIST_DTYPES)
+        elif os.path.exists(self._path('hist_raw', symbol)):
+            df = self._adjusted(symbol, adjust)
+        else:
+            df = self._read(self._path('hist', symbol), HIST_DTYPES)
+        if df.empty: return df
+        import pandas as pd
+        d = pd.to_datetime(df['日期']).dt.strftime('%Y%m%d')
+        return df[(d >= str(start)) & (d <= str(end))].reset_index(drop=True)
+
+    def factors(self, symbol):
+        # 不复权日线没录 (回退到了前复权)，就不能再叠加除权事件
+        if not os.path.exists(self._path('hist_raw', symbol)):
+            import pandas as pd
+            return pd.DataFrame()
+        self._inject('factors', symbol)
+        return self._read(self._path('factors', symbol), None)
+
+    def news(self, symbol):
+        self._inject('news', symbol)
+        return self._read(os.path.join(self.root, 'news', f"{symbol}.csv"), NEWS_DTYPES)
+
+
+class RecordingProvider:
+    """透传给 inner，同时把结果写成回放目录；同一代码的日线多次请求时保留并集"""
+
+    def __init__(self, inner, root):
+        self.inner = inner
+        self.root = root
+        self.name = inner.name
+        self.news_rate = getattr(inner, 'news_rate', None)
+        self._lock = threading.Lock()
+        for sub in (*HIST_DIRS.values(), 'factors', 'news'):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+        self._asof = inner.now()
+        with open(os.path.join(root, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'asof': self._asof.strftime('%Y-%m-%d %H:%M:%S'), 'source': inner.name}, f, ensure_ascii=False)
+
+    def now(self):
+        return self._asof
+
+    def spot(self):
+        df = self.inner.spot()
+        if df is not None: df.to_csv(os.path.join(self.root, 'spot.csv'), index=False)
+        return df
+
+    def history(self, symbol, start, end, adjust='qfq'):
+        df = self.inner.history(symbol, start, end, adjust=adjust)
+        if df is None or df.empty: return df
+        import pandas as pd
+        path = os.path.join(self.root, HIST_DIRS[adjust], f"{symbol}.csv")
+        with self._lock:
+            old = pd.read_csv(path, dtype=HIST_DTYPES) if os.path.exists(path) else None
+            out = df.copy()
+            out['日期'] = pd.to_datetime(out['日期']).dt.strftime('%Y-%m-%d')
+            if old is not None:
+                out = pd.concat([old, out]).drop_duplicates('日期', keep='last').sort_values('日期')
+            out.to_csv(path, index=False)
+        return df
+
+    def factors(self, symbol):
+        df = self.inner.factors(symbol)
+        if df is not None and not df.empty: df.to_csv(os.path.join(self.root, 'factors', f"{symbol}.csv"), index=False)
+        return df
+
+    def news(self, symbol):
+        df = self.inner.news(symbol)
+        if df is not None: df.to_csv(os.path.join(self.root, 'news', f"{symbol}.csv"), index=False)
+        return df
+
+
+def make_provider(kind='akshare', replay_dir=None, latency=0.0, fail_rate=0.0, seed=0, record_dir=None, timeout=None):
+    if kind == 'replay':
+        if not replay_dir: raise ValueError("replay 数据源需要 --replay-dir")
+        provider = ReplayProvider(replay_dir, latency=latency, fail_rate=fail_rate, seed=seed)
+    elif kind == 'akshare':
+        provider = AkshareProvider(timeout=timeout)
+    else:
+        raise ValueError(f"未知数据源: {kind}")
+    return RecordingProvider(provider, record_dir) if record_dir else provider
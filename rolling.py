@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+滑动窗口统计算子 (指标引擎/形态引擎/回测共用的唯一实现)
+- 输入为 1 维序列或 (股票 × 日期) 二维面板，时间在最后一维
+- 窗口内含 NaN 或未满窗口时结果为 NaN，等价 pandas rolling(w) 默认 min_periods
+- 实现方式: 按窗口偏移逐段累加，一次处理全部股票；不展开 (股票 × 日期 × 窗口) 的三维视图，
+  内存只占 O(股票数 × 日期数)，窗口内部按时间顺序求和
+- MAD (CCI 用) 先求窗口均值，再按偏移累加绝对离差，替代逐根调用的 Python lambda
+- EWM 为逐日递推，交给 pandas 的 Cython 核按列计算
+- ewm_carry / ewm_step: 从整段结果的末值续算一根 (盘中临时 K 线只算最后一步)
+"""
+
+import numpy as np
+
+
+def _as_2d(f):
+    def wrapper(x, *args, **kwargs):
+        x = np.asarray(x, dtype=float)
+        if x.ndim == 1: return f(x[None, :], *args, **kwargs)[0]
+        return f(x, *args, **kwargs)
+    wrapper.__name__ = f.__name__
+    wrapper.__doc__ = f.__doc__
+    return wrapper
+
+
+@_as_2d
+def shift(x, k=1):
+    """x 向后平移 k 根 (等价 Series.shift(k))"""
+    out = np.full_like(x, np.nan)
+    if k < x.shape[1]: out[:, k:] = x[:, :x.shape[1] - k]
+    return out
+
+
+def _window_sum(x, w):
+    L = x.shape[1] - w + 1
+    acc = x[:, :L].copy()
+    for k in range(1, w): acc += x[:, k:k + L]
+    return acc, L
+
+
+@_as_2d
+def rolling_sum(x, w):
+    out = np.full_like(x, np.nan)
+    if x.shape[1] >= w: out[:, w - 1:] = _window_sum(x, w)[0]
+    return out
+
+
+@_as_2d
+def rolling_mean(x, w):
+    out = np.full_like(x, np.nan)
+    if x.shape[1] >= w: out[:, w - 1:] = _window_sum(x, w)[0] / w
+    return out
+
+
+def _window_dev(x, w, how):
+    out = np.full_like(x, np.nan)
+    if x.shape[1] < w: return out
+    acc, L = _window_sum(x, w)
+    m = acc / w
+    dev = np.zeros_like(m)
+    for k in range(w):
+        d = x[:, k:k + L] - m
+        dev += d * d if how == 'std' else np.abs(d)
+    out[:, w - 1:] = np.sqrt(dev / (w - 1)) if how == 'std' else dev / w
+    return out
+
+
+@_as_2d
+def rolling_std(x, w):
+    """样本标准差 (ddof=1)，两遍法: 先求均值再累加离差平方"""
+    return _window_dev(x, w, 'std')
+
+
+@_as_2d
+def rolling_mad(x, w):
+    """平均绝对离差 mean(|x - mean(x)|)，CCI 的分母"""
+    return _window_dev(x, w, 'mad')
+
+
+def _window_extreme(x, w, op):
+    out = np.full_like(x, np.nan)
+    L = x.shape[1] - w + 1
+    if L <= 0: return out
+    acc = x[:, :L].copy()
+    # np.minimum/np.maximum 遇 NaN 传播 NaN，与 min_periods 语义一致
+    for k in range(1, w): op(acc, x[:, k:k + L], out=acc)
+    out[:, w - 1:] = acc
+    return out
+
+
+@_as_2d
+def rolling_min(x, w):
+    return _window_extreme(x, w, np.minimum)
+
+
+@_as_2d
+def rolling_max(x, w):
+    return _window_extreme(x, w, np.maximum)
+
+
+@_as_2d
+def ewm_mean(x, com=None, span=None):
+    """ewm(adjust=False).mean()：递推本身无法按时间向量化，直接调用 pandas 的 Cython 递推核 (按列一次跑完)"""
+    import pandas as pd
+    return pd.DataFrame(x.T).ewm(com=com, span=span, adjust=False).mean().to_numpy().T
+
+
+def _alpha(com=None, span=None):
+    if span is not None: com = (span - 1) / 2.0
+    return 1.0 / (1.0 + com)
+
+
+def ewm_carry(x, y, com=None, span=None):
+    """ewm_mean 的续算状态: x 为输入序列、y 为其 ewm_mean，返回 (末值, 旧值权重)
+    末尾连续 k 根 NaN 输入时旧值权重为 (1-alpha)^k (与 pandas 递推一致)，否则为 1"""
+    x = np.asarray(x, dtype=float); y = np.asarray(y, dtype=float)
+    valid = ~np.isnan(x)
+    k = np.argmax(valid[..., ::-1], axis=-1)
+    last = y[..., -1]
+    wt = np.where(np.isnan(last) | ~valid.any(axis=-1), 1.0, (1.0 - _alpha(com, span)) ** k)
+    return last, wt
+
+
+def ewm_step(y, wt, x, com=None, span=None):
+    """ewm_mean 续算一根: (末值, 旧值权重) + 新输入 -> 新的 (末值, 旧值权重)，逐位同 ewm_mean 整段计算"""
+    a = _alpha(com, span)
+    y, wt, x = (np.asarray(v, dtype=float) for v in (y, wt, x))
+    has_y, has_x = ~np.isnan(y), ~np.isnan(x)
+    old = wt * (1.0 - a)
+    with np.errstate(invalid='ignore'):
+        mixed = np.where(y != x, (old * y + a * x) / (old + a), y)
+    out = np.where(has_y, np.where(has_x, mixed, y), x)
+    return out, np.where(has_y, np.where(has_x, 1.0, old), wt)
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+"""
+规则库 (Rule Registry) - K 线形态与打分规则只在这里声明一次
+1. 每条规则是数据: 名称、分值、类型、说明 + 一个表达式字符串
+   - 形态表达式作用于 (股票 × 日期) 面板: c 为当根收盘，c[2] 为 2 根之前；SERIES 里声明的派生序列同样可以取滞后
+   - 打分表达式作用于每只股票最后一根的因子 (calculate 的字典键 + 快照 pe/pb/turnover + 市场环境 CONTEXT_INPUTS)；
+     FACTORS 为可复用的命名条件
+   - 可直接写 Python 的 and/or/not 与连续比较 (1 < x < 5)，编译时改写为逐元素的 & | ~
+2. compile_patterns / compile_strategy 把整张规则表生成一个 Python 函数: 每个滞后序列只算一次，
+   全部规则在同一个函数里一次向量化求值，新增规则不增加逐只股票的 Python 开销
+3. compile_bound: 只知道部分因子时，按 "与" 条件里已知的部分算出规则表能给的最高分 (打分漏斗剪枝用)
+4. ExcelExporter 的形态图解/打分规则两张说明表也从这里生成
+5. 打分规则里的阈值与入围门槛是参数 (StrategyParams)，编译出的函数按参数求值，调参不必重新编译
+"""
+
+import ast
+import json
+import numpy as np
+from collections import namedtuple
+from rolling import shift, rolling_mean, rolling_min, rolling_max
+
+# group: 同组规则互斥，按声明顺序第一条成立的生效 (if/elif)；tag: 写进得分详情的文字，None 不写
+Rule = namedtuple('Rule', ['name', 'weight', 'category', 'desc', 'expr', 'group', 'tag'])
+
+
+def pattern(name, weight, category, desc, expr):
+    return Rule(name, weight, category, desc, expr, None, None)
+
+
+def rule(name, weight, category, desc, expr, group=None, tag=None):
+    return Rule(name, weight, category, desc, expr, group, tag)
+
+
+# ==========================================
+# 1. 表达式编译
+# ==========================================
+_FUNCS = {
+    'abs': 'np.abs', 'maximum': 'np.maximum', 'minimum': 'np.minimum',
+    'rolling_mean': 'rolling_mean', 'rolling_min': 'rolling_min', 'rolling_max': 'rolling_max',
+}
+_NAMESPACE = {'np': np, 'shift': shift, 'rolling_mean': rolling_mean, 'rolling_min': rolling_min, 'rolling_max': rolling_max}
+
+
+class _Lower(ast.NodeTransformer):
+    """and/or/not/连续比较 -> & | ~；name[k] -> 滞后变量 name__k；命名条件内联展开"""
+
+    def __init__(self, known, inline=None):
+        self.known = known
+        self.inline = inline or {}
+        self.names = set()
+        self.lags = set()
+
+    def visit_Name(self, node):
+        if node.id in self.inline:
+            return self.visit(ast.parse(self.inline[node.id], mode='eval').body)
+        if node.id not in self.known:
+            raise NameError(f"规则里引用了未知序列: {node.id}")
+        self.names.add(node.id)
+        return node
+
+    def visit_Subscript(self, node):
+        k = node.slice
+        if not (isinstance(node.value, ast.Name) and isinstance(k, ast.Constant) and isinstance(k.value, int)):
+            raise SyntaxError(f"滞后只支持 name[整数]: {ast.unparse(node)}")
+        name = node.value.id
+        if name not in self.known:
+            raise NameError(f"规则里引用了未知序列: {name}")
+        self.names.add(name)
+        if k.value == 0: return ast.Name(name, ast.Load())
+        self.lags.add((name, k.value))
+        return ast.Name(f"{name}__{k.value}", ast.Load())
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in _FUNCS:
+            raise NameError(f"规则里只能调用 {sorted(_FUNCS)}")
+        node.args = [self.visit(a) for a in node.args]
+        node.func = ast.parse(_FUNCS[node.func.id], mode='eval').body
+        return node
+
+    def visit_BoolOp(self, node):
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        vals = [self.visit(v) for v in node.values]
+        out = vals[0]
+        for v in vals[1:]: out = ast.BinOp(out, op, v)
+        return out
+
+    def visit_UnaryOp(self, node):
+        node.operand = self.visit(node.operand)
+        if isinstance(node.op, ast.Not): return ast.UnaryOp(ast.Invert(), node.operand)
+        return node
+
+    def visit_Compare(self, node):
+        left = self.visit(node.left)
+        comps = [self.visit(c) for c in node.comparators]
+        parts, prev = [], left
+        for op, right in zip(node.ops, comps):
+            parts.append(ast.Compare(prev, [op], [right]))
+            prev = right
+        out = parts[0]
+        for p in parts[1:]: out = ast.BinOp(out, ast.BitAnd(), p)
+        return out
+
+
+def _conjuncts(expr, inline):
+    """顶层 "与" 拆成若干条件 (命名条件先展开)，剪枝时逐条判断是否已可求值"""
+    node = ast.parse(expr, mode='eval').body
+
+    def flat(n):
+        if isinstance(n, ast.Name) and n.id in inline:
+            return flat(ast.parse(inline[n.id], mode='eval').body)
+        if isinstance(n, ast.BoolOp) and isinstance(n.op, ast.And):
+            return [x for v in n.values for x in flat(v)]
+        if isinstance(n, ast.BinOp) and isinstance(n.op, ast.BitAnd):
+            return flat(n.left) + flat(n.right)
+        return [n]
+    return [ast.unparse(n) for n in flat(node)]
+
+
+def _lower(expr, known, inline=None):
+    t = _Lower(known, inline)
+    code = ast.unparse(t.visit(ast.parse(expr, mode='eval').body))
+    return code, t.names, t.lags
+
+
+def _build(name, lines, default=None):
+    src = "\n".join(lines)
+    ns = dict(_NAMESPACE, _default=default)
+    exec(compile(src, f"<rules:{name}>", 'exec'), ns)
+    fn = ns[name]
+    fn.source = src
+    return fn
+
+
+def compile_patterns(patterns, inputs, series):
+    """-> fn(**inputs, enough) 返回 (位掩码, 形态得分)；第 i 条形态对应第 i 位"""
+    known = set(inputs)
+    lines = [f"def _patterns({', '.join(inputs)}, enough):",
+             "    with np.errstate(invalid='ignore', divide='ignore'):"]
+    for k, expr in series.items():
+        code, _, _ = _lower(expr, known)
+        known.add(k)
+        lines.append(f"        {k} = {code}")
+    bodies, lags = [], set()
+    for p in patterns:
+        code, _, lg = _lower(p.expr, known)
+        bodies.append(code)
+        lags |= lg
+    for name, k in sorted(lags):
+        lines.append(f"        {name}__{k} = shift({name}, {k})")
+    lines += ["        bits = np.zeros(enough.shape, dtype=np.int64)",
+              "        score = np.zeros(enough.shape, dtype=np.int64)"]
+    for i, (p, code) in enumerate(zip(patterns, bodies)):
+        lines += [f"        m = ({code}) & enough",
+                  f"        bits |= m.astype(np.int64) << {i}",
+                  f"        score += m * {int(p.weight)}"]
+    lines.append("    return bits, score")
+    return _build('_patterns', lines)
+
+
+def _param_lines(params):
+    return [f"    {k} = params.{k}" for k in params._fields]
+
+
+def compile_strategy(rules, inputs, factors, params):
+    """-> fn(env, params) 返回 (得分, 规则位掩码)；env 为 {因子名: 一维数组}，同组规则互斥；params 缺省为编译时的参数
+    只从 env 取规则里实际引用到的输入，没被引用的 (如未启用的市场环境变量) env 里可以没有"""
+    known = set(inputs) | set(params._fields)
+    body, used, groups = [], set(), []
+    for i, r in enumerate(rules):
+        code, names, _ = _lower(r.expr, known, factors)
+        used |= names
+        body.append(f"        m = np.asarray({code}, dtype=bool)")
+        if r.group:
+            g = f"taken_{r.group}"
+            if r.group not in groups:
+                groups.append(r.group)
+                body.append(f"        {g} = np.zeros(n, dtype=bool)")
+            body += [f"        m = m & ~{g}", f"        {g} |= m"]
+        body += [f"        bits |= m.astype(np.int64) << {i}",
+                 f"        score += m * {int(r.weight)}"]
+    lines = ["def _strategy(env, params=_default):"] + _param_lines(params)
+    for k in sorted(used & set(inputs)): lines.append(f"    {k} = env[{k!r}]")
+    lines += ["    with np.errstate(invalid='ignore'):",
+              "        n = len(env['close'])",
+              "        bits = np.zeros(n, dtype=np.int64)",
+              "        score = np.zeros(n, dtype=np.int64)"]
+    lines += body
+    lines.append("    return score, bits")
+    return _build('_strategy', lines, params)
+
+
+def compile_bound(rules, available, factors, params):
+    """-> fn(env, params) 返回规则表在只知道 available 这些因子时的最高可得分
+    正分规则: "与" 条件里已知的部分都成立才可能得分；负分规则: 全部已知时按实际扣，否则按 0；同组取最大"""
+    lines = ["def _bound(env, params=_default):"] + _param_lines(params)
+    for k in sorted(available): lines.append(f"    {k} = env[{k!r}]")
+    lines += ["    with np.errstate(invalid='ignore'):",
+              f"        n = len(env[{sorted(available)[0]!r}])",
+              "        total = np.zeros(n, dtype=np.int64)"]
+    group_terms = {}
+    available = set(available) | set(params._fields)
+    for r in rules:
+        conj = _conjuncts(r.expr, factors)
+        known = []
+        for c in conj:
+            t = _Lower(available, factors)
+            try:
+                code = ast.unparse(t.visit(ast.parse(c, mode='eval').body))
+            except NameError:
+                continue
+            if t.names <= available: known.append(code)
+        exact = len(known) == len(conj)
+        if r.weight < 0 and not exact: continue
+        if r.weight > 0 and not known:
+            term = f"np.full(n, {int(r.weight)})"
+        else:
+            cond = " & ".join(f"({c})" for c in known)
+            term = f"np.asarray({cond}, dtype=bool) * {int(r.weight)}"
+        if r.group:
+            group_terms.setdefault(r.group, []).append(term)
+        else:
+            lines.append(f"        total += {term}")
+    for g, terms in group_terms.items():
+        # 同组至多一条生效: 上界取各条上界的最大值 (且不低于 0，一条都不成立时得 0)
+        lines.append(f"        total += np.maximum.reduce([np.zeros(n, dtype=np.int64), {', '.join(terms)}])")
+    lines.append("    return total")
+    return _build('_bound', lines, params)
+
+
+# ==========================================
+# 2. K 线形态 (顺序即位掩码的位序)
+# ==========================================
+PATTERN_INPUTS = ('o', 'h', 'l', 'c', 'v', 'ma5', 'ma10', 'ma20')
+
+# 派生序列 (按顺序计算，后面的可以引用前面的)
+SERIES = {
+    'body': "abs(c - o)",                       # 实体
+    'us': "h - maximum(c, o)",                  # 上影线
+    'ls': "minimum(c, o) - l",                  # 下影线
+    'avg_body': "rolling_mean(body, 10)",
+    'low5': "rolling_min(l, 5)",
+    'low10': "rolling_min(l, 10)",
+    'high20': "rolling_max(c, 20)",
+    'ma_max': "maximum(maximum(ma5, ma10), ma20)",
+    'ma_min': "minimum(minimum(ma5, ma10), ma20)",
+}
+
+PATTERNS = [
+    # A. 底部/反转 (买入)
+    pattern("早晨之星", 20, '买入-反转', '底部三日组合：阴线+星线+阳线，强力见底',
+            "(c[2] < o[2]) & (body[2] > avg_body[2]) & (h[1] < l[2]) & (c > o) & (c > (o[2] + c[2]) / 2)"),
+    pattern("锤子线", 15, '买入-反转', '底部长下影线，主力试盘后拉回，支撑强',
+            "(l == low5) & (ls >= 2 * body) & (us <= 0.1 * body)"),
+    pattern("倒锤头", 10, '买入-反转', '底部长上影线，主力低位试盘，抛压减轻',
+            "(l == low5) & (us >= 2 * body) & (ls <= 0.1 * body)"),
+    pattern("阳包阴", 20, '买入-反转', '今日阳线完全包住昨日阴线，多头反击',
+            "(c[1] < o[1]) & (c > o) & (o < c[1]) & (c > o[1])"),
+    pattern("曙光初现", 15, '买入-反转', '大阴线后低开高走，阳线刺入阴线一半',
+            "(c[1] < o[1]) & (body[1] > avg_body[1]) & (o < l[1]) & (c > (o[1] + c[1]) / 2)"),
+    pattern("平底", 15, '买入-反转', '两日最低价相同，筑底成功',
+            "(abs(l - l[1]) < c * 0.003) & (l <= low10)"),
+    pattern("多头孕线", 15, '买入-反转', '长阴包含小K线，底部孕育，变盘在即',
+            "(c[1] < o[1]) & (body[1] > avg_body[1]) & (c > o) & (h < h[1]) & (l > l[1])"),
+    pattern("旭日东升", 25, '买入-强反转', '大阴线后高开高走，收盘价高于前日开盘',
+            "(c[1] < o[1]) & (body[1] > avg_body[1] * 1.2) & (o > c[1]) & (c > o[1])"),
+    pattern("岛形反转(底)", 35, '买入-强反转', '下跌缺口+盘整+上涨缺口，超强反转',
+            "(h[1] < l[2]) & (l > h[1])"),
+    pattern("踢脚线", 20, '买入-强反转', '大阴线后直接高开高走，无上影，主力暴力反转',
+            "(us == 0) & (ls > 0) & (c > o) & (o > h[1])"),
+    pattern("蜻蜓点水", 15, '买入-技巧', '股价回踩均线(MA20/30)后立即弹起',
+            "(l <= ma20) & (minimum(o, c) > ma20) & (c > o)"),
+    # B. 攻击/突破 (买入)
+    pattern("红三兵", 15, '买入-攻击', '连续三天阳线稳步推升',
+            "(c[2] > o[2]) & (c[1] > o[1]) & (c > o) & (c > c[1]) & (c[1] > c[2])"),
+    pattern("上升三法", 25, '买入-持续', '大阳后接三小阴不破低，再接大阳',
+            "(c[4] > o[4]) & (body[4] > avg_body[4]) & (c[3] < o[3]) & (c[2] < o[2]) & (c[1] < o[1]) & (c > o) & (c > c[4])"),
+    pattern("多方炮", 20, '买入-攻击', '阳阴阳组合，洗盘结束，再次上攻',
+            "(c[2] > o[2]) & (c[1] < o[1]) & (c > o) & (c > c[2])"),
+    pattern("向上缺口", 15, '买入-强势', '向上跳空不回补，主力强势特征',
+            "l > h[1]"),
+    pattern("一阳穿三线", 25, '买入-突破', '大阳线同时突破5/10/20均线',
+            "(c > ma_max) & (o < ma_min)"),
+    pattern("倍量过左峰", 20, '买入-突破', '成交量翻倍且价格突破前期高点',
+            "(v > v[1] * 1.9) & (c >= high20)"),
+    pattern("金蜘蛛", 15, '买入-突破', '均线粘合后放量向上发散',
+            "((ma_max - ma_min) / c < 0.015) & (c > ma5) & (c > o)"),
+    pattern("仙人指路", 15, '买入-试盘', '今日大阳线突破昨日的长上影线',
+            "(us[1] > body[1]) & (c > h[1]) & (c > o)"),
+    # C. 风险形态 (卖出/否决)
+    pattern("黄昏之星", -30, '卖出-风险', '顶部三日组合：阳线+星线+阴线',
+            "(c[2] > o[2]) & (l[1] > h[2]) & (c < o) & (c < (o[2] + c[2]) / 2)"),
+    pattern("乌云盖顶", -25, '卖出-风险', '大阳后接大阴，吃掉一半涨幅',
+            "(c[1] > o[1]) & (c < o) & (o > h[1]) & (c < (o[1] + c[1]) / 2)"),
+    pattern("阴包阳", -25, '卖出-风险', '空头吞噬，阴线包住阳线',
+            "(c[1] > o[1]) & (c < o) & (o > c[1]) & (c < o[1])"),
+    pattern("三只乌鸦", -30, '卖出-风险', '连续三根阴线杀跌',
+            "(c < o) & (c[1] < o[1]) & (c[2] < o[2])"),
+    pattern("射击之星", -20, '卖出-风险', '高位长上影线，冲高回落',
+            "(us > 2 * body) & (ls < 0.1 * body) & (c > c[19] * 1.15)"),
+    pattern("吊颈线", -20, '卖出-风险', '高位长下影线，主力诱多',
+            "(ls > 2 * body) & (us < 0.1 * body) & (c > c[19] * 1.15)"),
+    pattern("断头铡刀", -40, '卖出-风险', '一阴断多线，趋势崩塌',
+            "(c < ma_min) & (o > ma_max)"),
+    pattern("向下缺口", -20, '卖出-风险', '向下跳空不回补，极弱势',
+            "h < l[1]"),
+    pattern("倾盆大雨", -25, '卖出-风险', '低开低走大阴线，吞没前日涨幅',
+            "(c[1] > o[1]) & (o < c[1]) & (c < o[1]) & (c < o)"),
+    pattern("空头孕线", -20, '卖出-风险', '高位长阳包含小K线，滞涨信号',
+            "(c[1] > o[1]) & (body[1] > avg_body[1]) & (c < o) & (h < h[1]) & (l > l[1]) & (c > c[19] * 1.1)"),
+    pattern("岛形反转(顶)", -50, '卖出-风险', '上涨缺口+盘整+下跌缺口，见顶信号',
+            "(l[1] > h[2]) & (h < l[1])"),
+    pattern("墓碑线", -30, '卖出-风险', '高位T字线，多头力竭',
+            "(body < 0.005 * c) & (us > 3 * body) & (ls < body) & (c > c[19] * 1.2)"),
+]
+
+# ==========================================
+# 3. 打分规则 (组合 A/B/C + 辅助项)，顺序即得分详情里的文字顺序
+# ==========================================
+# 规则阈值与入围门槛: 名称 -> (缺省值, 说明)；规则表达式里直接按名称引用
+PARAMS = {
+    'lock_turnover_min': (1.0, '主力锁筹: 换手率下限 %'),
+    'lock_turnover_max': (5.0, '主力锁筹: 换手率上限 %'),
+    'lock_vr_min': (0.5, '主力锁筹: 量比下限'),
+    'lock_vr_max': (1.2, '主力锁筹: 量比上限'),
+    'start_vr': (1.5, '放量启动: 量比下限'),
+    'stall_turnover': (15.0, '高换手滞涨: 换手率下限 %'),
+    'stall_pct': (2.0, '高换手滞涨: 涨跌幅绝对值上限 %'),
+    'rsi_hot': (80.0, 'RSI 过热线'),
+    'pit_cmf': (0.1, '黄金坑: CMF 下限'),
+    'top_cmf': (-0.05, '顶背离: CMF 上限'),
+    'pe_max': (25.0, '估值保护: 市盈率上限'),
+    'pb_max': (10.0, '高市净率: 市净率下限'),
+    'adx_min': (25.0, '趋势强度: ADX 下限'),
+    'threshold': (65, '入围门槛 (规则分 + 正的形态分)'),
+}
+StrategyParams = namedtuple('StrategyParams', list(PARAMS))
+DEFAULT = StrategyParams(**{k: v for k, (v, _) in PARAMS.items()})
+
+
+def params_from(d, base=DEFAULT):
+    """{参数名: 值} -> StrategyParams，未列出的取 base；未知参数名直接报错"""
+    unknown = set(d) - set(PARAMS)
+    if unknown: raise KeyError(f"未知策略参数: {sorted(unknown)}")
+    return base._replace(**{k: type(PARAMS[k][0])(v) for k, v in d.items()})
+
+
+def load_params(path):
+    with open(path, encoding='utf-8') as f:
+        return params_from(json.load(f))
+
+
+def save_params(params, path):
+    """只写与缺省值不同的参数"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({k: v for k, v in params._asdict().items() if v != getattr(DEFAULT, k)}, f, ensure_ascii=False, indent=2)
+    return path
+
+# 市场环境 (context.MarketContext，每次扫描拉日线之前算一次): 宽度、状态 (-1 risk_off / 0 / 1 risk_on)、
+# 所在板块强度分位、候选池内 量比/换手率/涨跌幅/60 日涨跌幅/CMF 的横截面分位 (0~1)；没有环境时为 NaN
+CONTEXT_INPUTS = ('mkt_breadth', 'mkt_regime', 'sector_strength',
+                  'vr_rank', 'turnover_rank', 'pct_rank', 'pct60_rank', 'cmf_rank')
+
+STRATEGY_INPUTS = (
+    'close', 'ma20', 'vol_ratio', 'pct_0', 'macd_dif', 'macd_dea', 'rsi', 'bb_up', 'bb_low', 'cmf_0', 'adx',
+    'pe', 'pb', 'turnover', 'risk',
+) + CONTEXT_INPUTS
+
+# 命名条件，规则里直接引用 (编译时内联)
+FACTORS = {
+    'trend': "close > ma20",
+    'macd_gold': "macd_dif > macd_dea and macd_dif > 0",
+}
+
+STRATEGY = [
+    rule('风险形态否决', -30, '否决', '出现任一风险形态', "risk"),
+    # 组合 A：量比 + 换手率 + 位置 = 主力意图
+    rule('主力锁筹', 20, '组合A-主力意图', '拉升中 + 低换手 + 量比平稳，筹码锁定最强',
+         "trend and lock_turnover_min < turnover < lock_turnover_max and lock_vr_min < vol_ratio < lock_vr_max", group='A', tag="A:主力锁筹(最强)"),
+    rule('放量启动', 15, '组合A-主力意图', '趋势向上 + 放量 + 当日上涨，建仓启动',
+         "trend and vol_ratio > start_vr and pct_0 > 0", group='A', tag="A:放量启动"),
+    rule('高换手滞涨', -30, '组合A-主力意图', '换手 >15% 但涨跌幅不到 2%，疑似出货',
+         "turnover > stall_turnover and -stall_pct < pct_0 < stall_pct", tag="A:⚠️高换手滞涨"),
+    # 组合 B：MACD + RSI = 买卖点校准
+    rule('趋势情绪共振', 10, '组合B-买卖校准', 'MACD 零轴上金叉且 RSI 未过热',
+         "macd_gold and rsi < rsi_hot", group='B', tag="B:趋势情绪共振"),
+    rule('假买点', -5, '组合B-买卖校准', 'MACD 金叉但 RSI 过热 (≥80)',
+         "macd_gold and not rsi < rsi_hot", group='B', tag="B:⚠️假买点(RSI过热)"),
+    # 组合 C：布林带 + 资金流 = 真假突破
+    rule('黄金坑', 40, '买入-机会', '跌破布林下轨且主力资金逆势进场',
+         "close < bb_low and cmf_0 > pit_cmf", tag="C:黄金坑(破位+资金进)"),
+    rule('顶背离', -40, '组合C-真假突破', '突破布林上轨但资金流出，诱多',
+         "close > bb_up and cmf_0 < top_cmf", tag="C:⚠️顶背离(诱多)"),
+    # 其他辅助
+    rule('估值保护', 10, '辅助', '0 < 动态市盈率 ≤ 25', "0 < pe <= pe_max"),
+    rule('高市净率', -5, '辅助', '市净率 > 10', "pb > pb_max"),
+    rule('趋势强度', 5, '辅助', 'ADX > 25 且站上 MA20', "adx > adx_min and trend"),
+]
+
+# 形态图解里除形态外还要列出的规则
+EXPLAIN_EXTRA = ('黄金坑',)
+
+
+def pattern_sheet():
+    """形态图解: 全部形态 + EXPLAIN_EXTRA 里的打分规则"""
+    rows = [[p.name, p.category, p.desc] for p in PATTERNS]
+    rows += [[r.name, r.category, r.desc] for r in STRATEGY if r.name in EXPLAIN_EXTRA]
+    return rows
+
+
+class _Fill(ast.NodeTransformer):
+    def __init__(self, params):
+        self.params = params._asdict()
+
+    def visit_Name(self, node):
+        return ast.Constant(self.params[node.id]) if node.id in self.params else node
+
+
+def strategy_sheet(params=DEFAULT):
+    """打分规则说明: 条件里的参数名替换成本次使用的取值"""
+    fill = lambda e: ast.unparse(_Fill(params).visit(ast.parse(e, mode='eval')))
+    rows = [[r.name, r.weight, r.category, r.desc, fill(r.expr)] for r in STRATEGY]
+    rows.append(['形态得分', '+形态分', '形态', '买入/风险形态分值之和为正时计入', '; '.join(f"{p.name}{p.weight:+d}" for p in PATTERNS)])
+    return rows
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+分片扫描 - 候选按代码哈希切成 N 片，各片独立扫描，最后合并出与单进程一致的结果
+1. shard_of: crc32(代码) % N，与进程/机器/候选顺序无关，同一只股票永远落在同一片
+2. 分片 worker (main.py scan --shard K/N): 拉快照 -> 只扫自己那片 -> 入围结果、打分表、运行报告写成一个分片文件
+   - 先写临时文件再原子改名，整片扫完才出现；带运行条件 (交易日/数据源/参数/打分表格式)，对不上的按缺片处理
+   - 分片里记着每只候选在快照中的位置，合并时同分按它排，与单进程的收集顺序一致
+   - 市场环境 (context.py) 在切片前按全部候选算，且分片模式只用快照不看仓库 (各片仓库只有自己那片)，
+     各片一致；打分表里的 vr_rank/cmf_rank 因此不含历史口径，与单进程 (有仓库时) 不同
+3. 合并 (main.py merge): 读齐各片 -> 全局排序取前 sentiment_top 跑舆情 -> 前 30 导出 xlsx，打分表按快照顺序拼接
+   - 缺片 (worker 失败/超时/没跑) 默认在合并进程里补扫；--allow-missing 时跳过并记入报告
+4. 本机多进程 (scan --local-shards N): 起 N 个 worker 子进程，失败的重跑一次，再在本进程合并
+5. 生产上每片一个 CI matrix job，上传分片目录，合并 job 下载齐后执行 merge
+"""
+
+import os
+import sys
+import zlib
+import pickle
+import subprocess
+
+# 分片文件格式版本，结构变了就加一，旧文件按缺片处理
+VERSION = 1
+
+
+def shard_of(symbol, n):
+    return zlib.crc32(str(symbol).encode()) % n
+
+
+def parse(spec):
+    """'K/N' -> (K, N)，0 <= K < N"""
+    try:
+        k, n = (int(x) for x in str(spec).split('/'))
+    except ValueError:
+        raise ValueError(f"分片格式应为 K/N: {spec}") from None
+    if not 0 <= k < n: raise ValueError(f"分片编号越界: {spec}")
+    return k, n
+
+
+def fingerprint(symbols):
+    """候选代码序列的指纹 (各片拉的快照不一致时合并会给出提示)"""
+    return zlib.crc32('\x1f'.join(map(str, symbols)).encode())
+
+
+def path(root, k, n):
+    return os.path.join(root, f'shard_{k:03d}_of_{n:03d}.pkl')
+
+
+def save(root, k, n, payload):
+    os.makedirs(root, exist_ok=True)
+    p = path(root, k, n)
+    with open(p + '.tmp', 'wb') as f:
+        pickle.dump(dict(payload, version=VERSION, shard=[k, n]), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(p + '.tmp', p)
+    return p
+
+
+def load(root, n, key):
+    """读回 N 片 -> ({K: 分片}, 缺片编号列表)；没有、写坏、版本或运行条件对不上的都算缺片"""
+    parts, missing = {}, []
+    for k in range(n):
+        try:
+            with open(path(root, k, n), 'rb') as f:
+                part = pickle.load(f)
+        except Exception:
+            missing.append(k)
+            continue
+        if part.get('version') != VERSION or part.get('shard') != [k, n] or part.get('key') != key:
+            missing.append(k)
+            continue
+        parts[k] = part
+    return parts, missing
+
+
+def discard(root, n):
+    for k in range(n):
+        if os.path.exists(path(root, k, n)): os.remove(path(root, k, n))
+
+
+class TableSink:
+    """分片模式下代替 ScoreWriter: 打分表留在内存里随分片文件带走，由合并步骤统一落盘"""
+
+    def __init__(self):
+        self.tables = []
+        self.rows = 0
+
+    def write(self, df):
+        if df is None or not len(df): return
+        self.tables.append(df)
+        self.rows += len(df)
+
+    def close(self, ok=True):
+        return []
+
+
+def merge_reports(report, snaps):
+    """各片的运行报告 (RunReport.snapshot(latencies=True)) 累加进 report
+    漏斗里 'shard' 之前的环节 (快照过滤) 每片都是全市场的同一份，只取一次；之后的按片相加"""
+    for i, snap in enumerate(snaps):
+        stages = list(snap['funnel'])
+        cut = stages.index('shard') if 'shard' in stages else -1
+        if i == 0:
+            for k in stages[:max(cut, 0)]:
+                report.drop(k, snap['funnel'][k]['dropped'], snap['funnel'][k]['remaining'])
+        for k in stages[cut + 1:]:
+            f = snap['funnel'][k]
+            old = report.funnel.get(k, {}).get('remaining')
+            remaining = None if f['remaining'] is None else f['remaining'] + (old or 0)
+            report.drop(k, f['dropped'], remaining)
+        report.merge(dict(snap, funnel={}))
+
+
+def spawn(argv, n, root, retries=1, script=None):
+    """本机起 N 个 worker 子进程 (argv 为 scan 子命令的其余参数)，失败的片重跑 retries 次；返回最终仍失败的片"""
+    script = script or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    todo = list(range(n))
+    for attempt in range(retries + 1):
+        if not todo: break
+        if attempt: print(f"   分片 {todo} 失败，重跑第 {attempt} 次")
+        procs = {k: subprocess.Popen([sys.executable, script, 'scan', *argv, '--shard', f'{k}/{n}', '--shard-dir', root])
+                 for k in todo}
+        todo = [k for k, p in procs.items() if p.wait() != 0]
+    return todo
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+本地行情仓库 (PriceStore) - 日线增量落盘
+1. 每只股票一个 .npy 结构化数组文件，按 (代码, 日期) 存储，读取走 mmap
+   - 存不复权价格，历史不会因分红送转被改写；复权方式 (默认前复权) 读取时由除权事件表现推 (见 adjust.py)
+2. 日常运行只补拉最后一根 K 线之后的缺口，不再每天重下 400 天
+   - 新 K 线的昨收 (收盘 - 涨跌额) 与上一根收盘对不上说明当天除权，只重拉这一只的分红送转表
+3. 冷启动: bulk_load 多线程全量灌库
+4. 完整性校验: 重叠 K 线比对 (不一致 => 全量重拉)、日期单调、OHLC 合法性；旧版 (前复权、无昨收列) 文件视为空，自动重灌
+5. 过期检测: 最后一根 K 线落后于最近交易日即视为过期
+6. 多进程共用 (分片扫描): 每只一个文件互不相干；meta/除权事件表 flush 时只写回本进程改过的代码，
+   与磁盘上其它进程写的合并 (有 fcntl 时加文件锁)
+"""
+
+import os
+import json
+import threading
+import contextlib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from adjust import FACTOR_DTYPE, adjust_bars, events_from_dividends, exrights
+
+# 落盘字段 (只保留引擎需要的列)
+BAR_DTYPE = np.dtype([
+    ('date', '<i4'), ('open', '<f8'), ('close', '<f8'), ('high', '<f8'), ('low', '<f8'),
+    ('volume', '<f8'), ('amount', '<f8'), ('turnover', '<f8'), ('preclose', '<f8'),
+])
+PRICE_FIELDS = ('open', 'close', 'high', 'low', 'volume')
+
+# akshare 中文列名 -> 仓库列名
+HIST_COLUMNS = {
+    '日期': 'date', '开盘': 'open', '收盘': 'close', '最高': 'high', '最低': 'low',
+    '成交量': 'volume', '成交额': 'amount', '换手率': 'turnover', '涨跌额': 'change',
+}
+
+# 收盘后才认为当日 K 线已定型
+MARKET_CLOSE_HOUR = 15
+
+
+def date_to_int(d):
+    if not hasattr(d, 'strftime'):
+        import pandas as pd
+        d = pd.Timestamp(d)
+    return int(d.strftime('%Y%m%d'))
+
+
+def dates_to_int(dates):
+    """日期序列 -> yyyymmdd 整数数组 (纯 numpy，避免逐个格式化字符串)"""
+    d = np.asarray(dates)
+    if not np.issubdtype(d.dtype, np.datetime64):
+        import pandas as pd
+        d = pd.to_datetime(pd.Series(d), cache=False).to_numpy()
+    d = d.astype('datetime64[D]')
+    month = d.astype('datetime64[M]')
+    year = month.astype('datetime64[Y]')
+    return ((year.astype(np.int64) + 1970) * 10000 + (month - year).astype(np.int64) * 100 + 100
+            + (d - month).astype(np.int64) + 1)
+
+
+def last_trading_day(now=None):
+    """最近一个已收盘的交易日 (按工作日近似，节假日会多一次空拉取，代价很小)"""
+    now = now or datetime.now()
+    d = now.date() if now.hour >= MARKET_CLOSE_HOUR else now.date() - timedelta(days=1)
+    while d.weekday() >= 5:
+        d -= timedelta(days=1)
+    return date_to_int(d)
+
+
+def ak_fetch(symbol, start, end, adjust='qfq'):
+    import akshare as ak
+    return ak.stock_zh_a_hist(symbol=symbol, period='daily', start_date=start, end_date=end, adjust=adjust)
+
+
+def ak_factors(symbol):
+    import akshare as ak
+    return ak.stock_fhps_detail_em(symbol=symbol)
+
+
+def frame_to_bars(df):
+    """akshare 原始 DataFrame (中文或已改名的列) -> 结构化数组"""
+    if df is None or df.empty: return np.empty(0, dtype=BAR_DTYPE)
+    import pandas as pd
+    df = df.rename(columns=HIST_COLUMNS)
+    bars = np.empty(len(df), dtype=BAR_DTYPE)
+    bars['date'] = dates_to_int(df['date'])
+    for f in BAR_DTYPE.names[1:]:
+        bars[f] = pd.to_numeric(df[f], errors='coerce').to_numpy(dtype=float) if f in df.columns else np.nan
+    if 'change' in df.columns:
+        bars['preclose'] = np.round(bars['close'] - pd.to_numeric(df['change'], errors='coerce').to_numpy(dtype=float), 2)
+    bars.sort(order='date')
+    return bars
+
+
+def bars_to_frame(bars):
+    """结构化数组 -> IndicatorEngine / KLineStrictLib 需要的 DataFrame 形状"""
+    import pandas as pd
+    df = pd.DataFrame({f: np.asarray(bars[f]) for f in BAR_DTYPE.names})
+    df['date'] = pd.to_datetime(df['date'].astype(str), format='%Y%m%d')
+    return df
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """跨进程互斥 (POSIX flock)；没有 fcntl 的平台退化为不加锁"""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class PriceStore:
+    """fetch(代码, 起, 止, adjust) 拉日线；factors(代码) 拉分红送转明细 (自定义 fetch 且不给 factors 时视为没有除权事件)
+    adjust: 读取时默认的复权方式 ('qfq' / 'hfq' / '' 不复权)"""
+
+    def __init__(self, root='price_store', fetch=None, window_days=400, factors=None, adjust='qfq'):
+        self.root = root
+        self.fetch = fetch or ak_fetch
+        self.fetch_factors = factors or (ak_factors if fetch is None else None)
+        self.window_days = window_days
+        self.adjust = adjust
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._meta_path = os.path.join(root, '_meta.json')
+        self._factors_path = os.path.join(root, '_factors.json')
+        self.meta = self._load_json(self._meta_path)
+        # {代码: [[除权日, scale, offset], ...]}
+        self.factors = self._load_json(self._factors_path)
+        # 本进程改过 meta/除权事件的代码，flush 时只写回这些
+        self._dirty = set()
+
+    @staticmethod
+    def _load_json(path):
+        if not os.path.exists(path): return {}
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    # ---------- 读写 ----------
+    def _path(self, symbol):
+        return os.path.join(self.root, f"{symbol}.npy")
+
+    def read(self, symbol):
+        path = self._path(symbol)
+        if not os.path.exists(path): return np.empty(0, dtype=BAR_DTYPE)
+        bars = np.load(path, mmap_mode='r')
+        # 旧版仓库 (前复权价、没有昨收列) 当作空，下次 update 全量重灌
+        return bars if bars.dtype == BAR_DTYPE else np.empty(0, dtype=BAR_DTYPE)
+
+    def write(self, symbol, bars):
+        # 先写临时文件再原子替换，进程中途被杀也不会留下半截文件
+        tmp = self._path(symbol) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(bars, dtype=BAR_DTYPE))
+        os.replace(tmp, self._path(symbol))
+
+    def flush(self):
+        with self._lock, _file_lock(os.path.join(self.root, '_meta.lock')):
+            dirty, self._dirty = self._dirty, set()
+            for name, path in (('meta', self._meta_path), ('factors', self._factors_path)):
+                # 以磁盘上的为底 (可能刚被别的进程写过)，盖上本进程改过的代码
+                data, merged = getattr(self, name), self._load_json(path)
+                for s in dirty:
+                    if s in data: merged[s] = data[s]
+                    else: merged.pop(s, None)
+                setattr(self, name, merged)
+                tmp = path + '.tmp'
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(merged, f)
+                os.replace(tmp, path)
+
+    # ---------- 复权 ----------
+    def events(self, symbol):
+        """这只股票的除权事件表 (FACTOR_DTYPE)"""
+        rows = self.factors.get(symbol) or []
+        return np.array([tuple(r) for r in rows], dtype=FACTOR_DTYPE)
+
+    def refresh_factors(self, symbol, today):
+        """重拉分红送转明细，只收已到除权日的"""
+        if self.fetch_factors is None: return
+        events = events_from_dividends(self.fetch_factors(symbol), until=today)
+        with self._lock:
+            self.factors[symbol] = [[int(d), float(a), float(b)] for d, a, b in events.tolist()]
+            self._dirty.add(symbol)
+
+    def adjusted(self, symbol, bars=None, adjust=None):
+        """不复权数组 (缺省为库里全部历史) -> 按 adjust (缺省 self.adjust) 复权"""
+        bars = self.read(symbol) if bars is None else bars
+        return adjust_bars(bars, self.events(symbol), self.adjust if adjust is None else adjust)
+
+    def _touch(self, symbol, bars, today):
+        with self._lock:
+            self.meta[symbol] = {'last': int(bars['date'][-1]) if len(bars) else 0, 'rows': int(len(bars)), 'checked': today}
+            self._dirty.add(symbol)
+
+    # ---------- 增量更新 ----------
+    def is_stale(self, symbol, today=None):
+        today = today or last_trading_day()
+        m = self.meta.get(symbol)
+        if not m or not m['rows']: return True
+        # 今天已经问过一次且没有新数据 (停牌/节假日)，不再重复请求
+        return m['last'] < today and m.get('checked', 0) < today
+
+    def update(self, symbol, today=None):
+        """补拉缺口，返回最新的完整结构化数组"""
+        today = today or last_trading_day()
+        bars = self.read(symbol)
+        if len(bars) and not self.is_stale(symbol, today):
+            return bars
+
+        if not len(bars):
+            return self._refill(symbol, today)
+
+        last = int(bars['date'][-1])
+        start = str(last)
+        new = frame_to_bars(self.fetch(symbol, start, str(today), adjust=''))
+        if not len(new):
+            self._touch(symbol, bars, today)
+            return bars
+
+        # 重叠校验: 不复权历史不会变，新数据第一根必须和库里最后一根完全一致，否则整只重拉
+        if new['date'][0] != last or not self._same_bar(new[0], bars[-1]):
+            return self._refill(symbol, today)
+
+        # 缺口里有除权日: 只更新这一只的事件表，K 线本身照常追加
+        if exrights(new['close'][:-1], new['preclose'][1:]).any():
+            self.refresh_factors(symbol, today)
+        bars = np.concatenate([np.asarray(bars), new[1:]])
+        self.write(symbol, bars)
+        self._touch(symbol, bars, today)
+        return self.read(symbol)
+
+    def _refill(self, symbol, today, days=None):
+        days = days or self.window_days
+        start = (datetime.strptime(str(today), '%Y%m%d') - timedelta(days=days)).strftime('%Y%m%d')
+        bars = frame_to_bars(self.fetch(symbol, start, str(today), adjust=''))
+        if len(bars):
+            self.refresh_factors(symbol, today)
+            self.write(symbol, bars)
+        self._touch(symbol, bars, today)
+        return bars
+
+    @staticmethod
+    def _same_bar(a, b):
+        return all(np.isclose(a[f], b[f], rtol=0, atol=1e-6) for f in PRICE_FIELDS)
+
+    def window(self, symbol, days=None, now=None, adjust=None):
+        """补拉缺口后取 [now-days, now] 的复权结构化数组 (计算侧直接用，不经 DataFrame)"""
+        now = now or datetime.now()
+        bars = self.update(symbol, last_trading_day(now))
+        start = date_to_int(now - timedelta(days=days or self.window_days))
+        end = date_to_int(now)
+        return self.adjusted(symbol, bars[(bars['date'] >= start) & (bars['date'] <= end)], adjust)
+
+    def history(self, symbol, days=None, now=None, adjust=None):
+        """与 ak.stock_zh_a_hist(start=now-400天, adjust=adjust) 改名后等价的 DataFrame"""
+        return bars_to_frame(self.window(symbol, days, now, adjust))
+
+    def check_adjust(self, symbol, days=None, adjust=None):
+        """现推的复权价与数据源直接给的复权价逐根比对，返回最大绝对误差 (没有可比的 K 线返回 None)"""
+        adjust = self.adjust if adjust is None else adjust
+        ours = self.window(symbol, days, adjust=adjust)
+        if not len(ours): return None
+        theirs = frame_to_bars(self.fetch(symbol, str(ours['date'][0]), str(ours['date'][-1]), adjust=adjust))
+        common, i, j = np.intersect1d(ours['date'], theirs['date'], return_indices=True)
+        if not len(common): return None
+        return max(float(np.nanmax(np.abs(ours[f][i] - theirs[f][j]))) for f in ('open', 'close', 'high', 'low'))
+
+    # ---------- 冷启动 ----------
+    def bulk_load(self, symbols, days=None, workers=16, force=False, today=None):
+        """全量灌库；force=False 时已有数据的只走增量；today 缺省按墙钟 (回放数据源须传 last_trading_day(provider.now()))"""
+        from tqdm import tqdm
+        today = today or last_trading_day()
+
+        def job(symbol):
+            try:
+                if force or not len(self.read(symbol)):
+                    return len(self._refill(symbol, today, days))
+                return len(self.update(symbol, today))
+            except Exception:
+                return 0
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            loaded = sum(1 for n in tqdm(executor.map(job, symbols), total=len(symbols)) if n)
+        self.flush()
+        return loaded
+
+    # ---------- 完整性校验 ----------
+    def verify(self, symbol, today=None):
+        """返回问题列表，空列表表示健康"""
+        bars = self.read(symbol)
+        problems = []
+        if not len(bars): return ['empty']
+        d = bars['date']
+        if np.any(np.diff(d) <= 0): problems.append('date_order')
+        if np.isnan(np.column_stack([bars[f] for f in PRICE_FIELDS])).any(): problems.append('nan')
+        hi_ok = bars['high'] >= np.maximum(bars['open'], bars['close']) - 1e-6
+        lo_ok = bars['low'] <= np.minimum(bars['open'], bars['close']) + 1e-6
+        if not (hi_ok.all() and lo_ok.all()): problems.append('ohlc')
+        m = self.meta.get(symbol)
+        if m and (m['rows'] != len(bars) or m['last'] != int(d[-1])): problems.append('meta')
+        if self.is_stale(symbol, today): problems.append('stale')
+        return problems
+
+    def repair(self, symbols):
+        """删除损坏文件，下次 update 自动冷启动重拉"""
+        broken = []
+        for s in symbols:
+            problems = [p for p in self.verify(s) if p != 'stale']
+            if problems:
+                broken.append((s, problems))
+                if os.path.exists(self._path(s)): os.remove(self._path(s))
+                with self._lock:
+                    self.meta.pop(s, None)
+                    self.factors.pop(s, None)
+                    self._dirty.add(s)
+        self.flush()
+        return broken
+
+    def symbols(self):
+        return sorted(f[:-4] for f in os.listdir(self.root) if f.endswith('.npy'))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='本地行情仓库维护')
+    parser.add_argument('action', choices=['warm', 'verify', 'check-adjust'])
+    parser.add_argument('--root', default='price_store')
+    parser.add_argument('--days', type=int, default=400)
+    parser.add_argument('--force', action='store_true')
+    parser.add_argument('--sample', type=int, default=20, help='check-adjust 抽查的股票数')
+    args = parser.parse_args()
+
+    store = PriceStore(args.root, window_days=args.days)
+    if args.action == 'warm':
+        from main import AlphaGalaxyOmni
+        symbols = [c[0] for c in AlphaGalaxyOmni().get_candidates()]
+        print(f"冷启动灌库: {store.bulk_load(symbols, force=args.force)}/{len(symbols)} 只")
+    elif args.action == 'check-adjust':
+        for s in store.symbols()[:args.sample]:
+            err = store.check_adjust(s)
+            print(f"{s}: {'无可比 K 线' if err is None else f'最大误差 {err:.4f}'}")
+        store.flush()
+    else:
+        broken = store.repair(store.symbols())
+        for s, problems in broken: print(f"⚠️ {s}: {problems}")
+        print(f"校验完成，修复 {len(broken)} 只")
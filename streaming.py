@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+流式指标引擎 (StreamingIndicatorEngine) - 每根新 K 线只更新定长窗口，计算量与历史长度无关
+1. 每只股票保存一份滚动状态: 定长环形缓冲 (均线/布林/CMF/ATR/RSI/ADX/CCI)、EMA 末值 (MACD/KDJ)
+2. 状态落盘，第二天只需把新 K 线喂进去，不用重算整段历史
+3. 输出字典与 IndicatorEngine.calculate 完全同键；verify 与整段重算交叉校验
+说明: 单根的代价是 O(窗口) 而不是 O(1): 窗口统计量 (最长 60 根) 每次在缓冲上按时间顺序重新累加，
+      不维护加一减一的滑动和 —— 求和顺序与面板算子相同，所以和面板路径逐位一致 (滑动和会累积舍入误差，
+      压线的得分可能翻转)，与 pandas 路径只差浮点舍入
+"""
+
+import os
+import pickle
+import numpy as np
+from collections import deque
+from store import dates_to_int
+
+NAN = float('nan')
+
+
+class _Window:
+    """定长环形缓冲；未填满或含 NaN 时统计量为 NaN (等价 rolling(n) 默认 min_periods)"""
+    __slots__ = ('n', 'buf')
+
+    def __init__(self, n):
+        self.n = n
+        self.buf = deque(maxlen=n)
+
+    def push(self, x):
+        self.buf.append(x)
+
+    def _ready(self, k):
+        if len(self.buf) < k: return None
+        vals = list(self.buf)[-k:]
+        return None if any(x != x for x in vals) else vals
+
+    def sum(self, k=None):
+        vals = self._ready(k or self.n)
+        if vals is None: return NAN
+        acc = vals[0]
+        for x in vals[1:]: acc += x
+        return acc
+
+    def mean(self, k=None):
+        k = k or self.n
+        return self.sum(k) / k
+
+    def dev(self, k=None, how='std'):
+        k = k or self.n
+        vals = self._ready(k)
+        if vals is None: return NAN
+        m = self.sum(k) / k
+        acc = 0.0
+        for x in vals:
+            d = x - m
+            acc += d * d if how == 'std' else abs(d)
+        return np.sqrt(acc / (k - 1)) if how == 'std' else acc / k
+
+    def min(self):
+        vals = self._ready(self.n)
+        return NAN if vals is None else min(vals)
+
+    def max(self):
+        vals = self._ready(self.n)
+        return NAN if vals is None else max(vals)
+
+
+class _EWM:
+    """ewm(adjust=False).mean() 的单步递推，公式与 NaN 处理同 pandas"""
+    __slots__ = ('alpha', 'weighted', 'old_wt')
+
+    def __init__(self, com=None, span=None):
+        if span is not None: com = (span - 1) / 2.0
+        self.alpha = 1.0 / (1.0 + com)
+        self.weighted = None
+        self.old_wt = 1.0
+
+    def push(self, cur):
+        w = self.weighted
+        if w is None:
+            w = cur
+        elif w == w:
+            self.old_wt *= 1.0 - self.alpha
+            if cur == cur:
+                if w != cur:
+                    w = (self.old_wt * w + self.alpha * cur) / (self.old_wt + self.alpha)
+                self.old_wt = 1.0
+        elif cur == cur:
+            w = cur
+        self.weighted = w
+        return w
+
+
+class StreamState:
+    """单只股票的全部指标状态"""
+
+    def __init__(self):
+        self.n_bars = 0
+        self.last_date = 0
+        self.prev = None  # 上一根 (close, high, low)
+        self.close = _Window(60); self.vol = _Window(5)
+        self.mfv = _Window(20); self.vol20 = _Window(20)
+        self.low9 = _Window(9); self.high9 = _Window(9)
+        self.tp = _Window(14); self.tr = _Window(14)
+        self.gain = _Window(14); self.loss = _Window(14)
+        self.plus_dm = _Window(14); self.minus_dm = _Window(14); self.dx = _Window(14)
+        self.K = _EWM(com=2); self.D = _EWM(com=2)
+        self.e12 = _EWM(span=12); self.e26 = _EWM(span=26); self.dea = _EWM(span=9)
+        # 最近 3 根的输出，用于 *_1 / *_2 历史键
+        self.hist = deque(maxlen=3)
+
+    def push(self, date, o, h, l, c, v):
+        o, h, l, c, v = (np.float64(x) for x in (o, h, l, c, v))
+        with np.errstate(all='ignore'):
+            pc, ph, pl = self.prev if self.prev else (NAN, NAN, NAN)
+            self.close.push(c)
+            ma5, ma10, ma20, ma60 = (self.close.mean(k) for k in (5, 10, 20, 60))
+
+            self.vol.push(v)
+            vol_ma5 = self.vol.mean()
+            vol_ratio = v / (1 if vol_ma5 == 0 else vol_ma5)
+
+            hl = h - l
+            mf_mult = ((c - l) - (h - c)) / (0.01 if hl == 0 else hl)
+            self.mfv.push(mf_mult * v); self.vol20.push(v)
+            cmf = self.mfv.sum() / self.vol20.sum()
+
+            self.low9.push(l); self.high9.push(h)
+            low_min, high_max = self.low9.min(), self.high9.max()
+            rsv = (c - low_min) / (high_max - low_min) * 100
+            K = self.K.push(rsv)
+            D = self.D.push(K)
+            J = 3 * K - 2 * D
+
+            std20 = self.close.dev(20)
+            boll_up = ma20 + 2 * std20
+            boll_low = ma20 - 2 * std20
+            bb_width = (boll_up - boll_low) / ma20
+            bias = (c - ma20) / ma20 * 100
+
+            tp = (h + l + c) / 3
+            self.tp.push(tp)
+            cci = (tp - self.tp.mean()) / (0.015 * self.tp.dev(how='mad'))
+
+            tr = np.fmax(np.fmax(h - l, abs(h - pc)), abs(l - pc))
+            self.tr.push(tr)
+            atr = self.tr.mean()
+            delta = c - pc
+            self.gain.push(delta if delta > 0 else 0.0)
+            self.loss.push(-delta if delta < 0 else 0.0)
+            rsi = 100 - (100 / (1 + self.gain.mean() / self.loss.mean()))
+
+            up = h - ph; down = pl - l
+            self.plus_dm.push(up if (up > down) and (up > 0) else 0.0)
+            self.minus_dm.push(down if (down > up) and (down > 0) else 0.0)
+            tr_smooth = self.tr.sum()
+            plus_di = 100 * (self.plus_dm.sum() / tr_smooth)
+            minus_di = 100 * (self.minus_dm.sum() / tr_smooth)
+            self.dx.push(100 * abs(plus_di - minus_di) / (plus_di + minus_di))
+            adx = self.dx.mean()
+
+            dif = self.e12.push(c) - self.e26.push(c)
+            dea = self.dea.push(dif)
+            macd_bar = 2 * (dif - dea)
+            pct = (c / pc - 1) * 100
+
+        self.prev = (c, h, l)
+        self.n_bars += 1
+        self.last_date = int(date)
+        self.hist.append({
+            'close': c, 'ma20': ma20, 'ma60': ma60, 'atr': atr, 'adx': adx,
+            'dif': dif, 'dea': dea, 'macd_bar': macd_bar, 'cci': cci, 'rsi': rsi,
+            'K': K, 'D': D, 'J': J, 'bias': bias, 'bb_width': bb_width, 'bb_up': boll_up, 'bb_low': boll_low,
+            'cmf': cmf, 'pct': pct, 'vol_ratio': vol_ratio,
+        })
+
+    def snapshot(self):
+        """与 IndicatorEngine.calculate 同键的字典；不足 60 根返回 None"""
+        if self.n_bars < 60: return None
+        cur, p1, p2 = self.hist[-1], self.hist[-2], self.hist[-3]
+        return {
+            'close': cur['close'], 'ma20': cur['ma20'], 'ma60': cur['ma60'],
+            'atr': cur['atr'], 'adx': cur['adx'],
+            'macd_dif': cur['dif'], 'macd_dea': cur['dea'],
+            'dif_0': cur['dif'], 'dif_1': p1['dif'],
+            'dea_0': cur['dea'], 'dea_1': p1['dea'],
+            'macd_bar_0': cur['macd_bar'], 'macd_bar_1': p1['macd_bar'],
+            'cci': cur['cci'], 'rsi': cur['rsi'],
+            'j_val': cur['J'],
+            'k_0': cur['K'], 'k_1': p1['K'],
+            'd_0': cur['D'], 'd_1': p1['D'],
+            'bias': cur['bias'],
+            'bb_width': cur['bb_width'], 'bb_up': cur['bb_up'], 'bb_low': cur['bb_low'],
+            'cmf_0': cur['cmf'], 'cmf_1': p1['cmf'], 'cmf_2': p2['cmf'],
+            'pct_0': cur['pct'], 'pct_1': p1['pct'], 'pct_2': p2['pct'],
+            'vol_ratio': cur['vol_ratio'],
+        }
+
+    @staticmethod
+    def from_frame(df):
+        state = StreamState()
+        state.extend(df)
+        return state
+
+    def extend(self, df):
+        dates = _date_ints(df)
+        cols = [df[k].to_numpy(dtype=float) for k in ('open', 'high', 'low', 'close', 'volume')]
+        for i in range(len(df)):
+            self.push(dates[i], *(col[i] for col in cols))
+
+
+def _date_ints(df):
+    return dates_to_int(df['date'])
+
+
+class StreamingIndicatorEngine:
+    def __init__(self, root='indicator_state'):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.stats = {'incremental': 0, 'rebuilt': 0, 'new_bars': 0}
+
+    def _path(self, symbol):
+        return os.path.join(self.root, f"{symbol}.pkl")
+
+    def load(self, symbol):
+        try:
+            with open(self._path(symbol), 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def save(self, symbol, state):
+        tmp = self._path(symbol) + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(symbol))
+
+    def update(self, symbol, df):
+        """把 df 中状态之后的新 K 线喂进状态并落盘，返回 calculate 同键字典"""
+        if df is None or not len(df): return None
+        dates = _date_ints(df)
+        state = self.load(symbol)
+
+        # 锚点校验: 状态的最后一根必须仍在 df 里且收盘价不变，否则 (前复权改写/断档) 整段重建
+        start = None
+        if state is not None and state.prev is not None:
+            pos = np.searchsorted(dates, state.last_date)
+            if pos < len(df) and dates[pos] == state.last_date and df['close'].iloc[pos] == state.prev[0]:
+                start = pos + 1
+        if start is None:
+            state = StreamState.from_frame(df)
+            self.stats['rebuilt'] += 1
+        elif start < len(df):
+            state.extend(df.iloc[start:])
+            self.stats['incremental'] += 1
+            self.stats['new_bars'] += int(len(df) - start)
+        self.save(symbol, state)
+        return state.snapshot()
+
+    def verify(self, symbol, df, rtol=1e-6):
+        """交叉校验: 持久化状态 vs 整段重算，返回超差的键 {键: (流式, 批量)}"""
+        from main import IndicatorEngine
+        stream = self.update(symbol, df)
+        batch = IndicatorEngine.calculate(df.copy())
+        if not stream or not batch: return {} if stream == batch else {'_': (stream, batch)}
+        bad = {}
+        for k, b in batch.items():
+            s = stream[k]
+            if np.isnan(b) and np.isnan(s): continue
+            if not np.isclose(s, b, rtol=rtol, atol=1e-9): bad[k] = (s, b)
+        return bad
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+参数寻优 (sweep) - 指标/形态只算一次，成千上万组打分参数在缓存上并行回测
+1. 缓存: 回测区间内每根合格 K 线的打分因子、正的形态分、风险标记，以及与参数无关的交易结果
+   (次日开盘买入、-2ATR 止损 / +3ATR 止盈 / 最长持有天数的收益，和固定持有期的远期收益)
+   按日期排好序存成 .npy 目录，子进程只读 mmap，同一份缓存多次寻优直接复用
+2. 一组参数的回测 = 编译好的规则函数在缓存上求一次分 + 每日按分数取前 top_n + 统计，不碰行情数据
+3. 搜索: 网格 (--grid 名=值1,值2 或 名=起:止:步长) 或随机 (--random N --space 名=下限:上限 或 名=值1,值2)
+4. 提前淘汰 (successive halving): 先在每 4 个交易日取 1 天的子集上评估全部组合，只留前 keep，
+   再到每 2 天取 1 天，最后全量；入选笔数不足 min_trades 的组合直接淘汰
+5. 结果按指标排名写 xlsx，最优参数写 JSON (main.py / backtest.py 的 --params 直接可用)
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+import rules
+import backtest as BT
+from instrument import RunReport
+from main import AlphaGalaxyOmni
+
+# 子集抽样步长: 每 k 个交易日取 1 天，最后一级为全量
+RUNGS = (4, 2, 1)
+METRICS = {
+    'mean': '平均每笔收益%',
+    'hit': '胜率%',
+    'excess': '远期超额%',
+    'tstat': '每笔收益 t 值',
+}
+CACHE_VERSION = 1
+
+
+# ==========================================
+# 1. 因子缓存
+# ==========================================
+def build_cache(frames, root, fundamentals=None, start=None, end=None, hold=20, horizon=20, chunk=500, report=None):
+    """frames 同 backtest.Backtest.run；写入 root/{rung}/*.npy 与 root/meta.json"""
+    report = report or RunReport()
+    cols = {}
+    for i, panel, pe, pb in report.timed('panel', BT.iter_panels(frames, fundamentals, chunk)):
+        with report.stage('indicators'):
+            env, k_score, _, S = BT.signal_factors(panel, pe, pb)
+        with report.stage('simulate'):
+            eligible = BT.eligible_mask(panel, pe, start, end)
+            rows, cols_ = np.nonzero(eligible)
+            trade = BT.simulate(panel, S['atr'], rows, cols_, hold)
+            entry = trade['买入价']
+            part = {k: np.asarray(x[rows, cols_], dtype=float) for k, x in env.items() if k != 'risk'}
+            part.update(risk=env['risk'][rows, cols_], k_pos=np.maximum(k_score[rows, cols_], 0),
+                        date=panel['date'][rows, cols_].astype(np.int32), order=(rows + i).astype(np.int32),
+                        trade=trade['收益%'] / 100, fwd=BT._at(panel['close'], rows, cols_ + horizon) / entry - 1)
+            for k, v in part.items(): cols.setdefault(k, []).append(v)
+    with report.stage('cache_write'):
+        cols = {k: np.concatenate(v) for k, v in cols.items()}
+        days = np.unique(cols['date'])
+        # 按 (日期, 代码顺序) 排好，选股时同分按代码顺序
+        idx = np.lexsort((cols['order'], cols['date']))
+        day_no = np.searchsorted(days, cols['date'][idx])
+        for k in RUNGS:
+            sub = idx[day_no % k == 0]
+            os.makedirs(os.path.join(root, str(k)), exist_ok=True)
+            for name, v in cols.items():
+                np.save(os.path.join(root, str(k), f"{name}.npy"), v[sub])
+        meta = {'version': CACHE_VERSION, 'start': start, 'end': end, 'hold': hold, 'horizon': horizon,
+                'days': len(days), 'bars': int(len(idx)), 'symbols': len(frames), 'valuation': bool(fundamentals),
+                'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+        with open(os.path.join(root, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def cache_meta(root):
+    path = os.path.join(root, 'meta.json')
+    if not os.path.exists(path): return None
+    with open(path, encoding='utf-8') as f:
+        meta = json.load(f)
+    return meta if meta.get('version') == CACHE_VERSION else None
+
+
+def load_cache(root, rung):
+    d = os.path.join(root, str(rung))
+    return {f[:-4]: np.load(os.path.join(d, f), mmap_mode='r') for f in os.listdir(d) if f.endswith('.npy')}
+
+
+# ==========================================
+# 2. 单组参数的回测
+# ==========================================
+def evaluate(C, params, top_n=30):
+    """缓存 C 上用 params 打分、逐日取前 top_n，返回统计字典"""
+    score, _ = AlphaGalaxyOmni._strategy(C, params)
+    score = score + C['k_pos']
+    idx = np.flatnonzero(score >= params.threshold)
+    # 缓存已按 (日期, 代码顺序) 排序: 稳定排序按 (日期, -得分) 即可
+    idx = idx[np.lexsort((-score[idx], C['date'][idx]))]
+    d = C['date'][idx]
+    first = np.r_[True, d[1:] != d[:-1]] if len(d) else np.zeros(0, dtype=bool)
+    pos = np.arange(len(d))
+    rank = pos - np.maximum.accumulate(np.where(first, pos, 0))
+    idx = idx[rank < top_n]
+    r = np.asarray(C['trade'][idx])
+    r = r[~np.isnan(r)]
+    fwd = np.asarray(C['fwd'][idx])
+    fwd = fwd[~np.isnan(fwd)]
+    n = len(r)
+    out = {'入选笔数': len(idx), '已平仓笔数': n, '入选天数': int(first.sum()) if len(d) else 0}
+    if n:
+        std = r.std(ddof=1) if n > 1 else np.nan
+        out.update({'平均每笔收益%': r.mean() * 100, '胜率%': (r > 0).mean() * 100,
+                    '每笔收益 t 值': r.mean() / std * np.sqrt(n) if std else np.nan})
+    if len(fwd):
+        out['远期超额%'] = (fwd.mean() - C['_universe']) * 100
+    return out
+
+
+_CACHE = {}
+
+
+def _init(root):
+    for k in RUNGS:
+        C = load_cache(root, k)
+        C['_universe'] = float(np.nanmean(C['fwd']))
+        _CACHE[k] = C
+
+
+def _run_batch(rung, combos, top_n):
+    C = _CACHE[rung]
+    return [evaluate(C, p, top_n) for p in combos]
+
+
+# ==========================================
+# 3. 参数空间与搜索
+# ==========================================
+def parse_space(specs):
+    """['rsi_hot=70,75,80', 'pe_max=15:40', 'pit_cmf=0:0.3:0.05'] -> {名: 取值列表 或 (下限, 上限)}"""
+    space = {}
+    for spec in specs or []:
+        name, _, vals = spec.partition('=')
+        if name not in rules.PARAMS: raise KeyError(f"未知策略参数: {name} (可选: {', '.join(rules.PARAMS)})")
+        cast = type(rules.PARAMS[name][0])
+        if ':' in vals:
+            lo, hi, *step = (float(x) for x in vals.split(':'))
+            space[name] = [cast(x) for x in np.arange(lo, hi + step[0] / 2, step[0]).round(10)] if step else (cast(lo), cast(hi))
+        else:
+            space[name] = [cast(x) for x in vals.split(',')]
+    return space
+
+
+def grid(space):
+    for name, vals in space.items():
+        if isinstance(vals, tuple): raise ValueError(f"网格搜索需要离散取值 (名=值1,值2 或 名=起:止:步长): {name}")
+    names = list(space)
+    for combo in itertools.product(*space.values()):
+        yield rules.params_from(dict(zip(names, combo)))
+
+
+def sample(space, n, seed=0):
+    rng = random.Random(seed)
+    for _ in range(n):
+        d = {}
+        for name, vals in space.items():
+            if isinstance(vals, tuple):
+                lo, hi = vals
+                d[name] = rng.randint(lo, hi) if isinstance(lo, int) else rng.uniform(lo, hi)
+            else:
+                d[name] = rng.choice(vals)
+        yield rules.params_from(d)
+
+
+class Sweep:
+    def __init__(self, root, metric='mean', top_n=30, min_trades=100, keep=0.25, workers=None, batch=20, report=None):
+        self.root = root
+        self.metric = metric
+        self.top_n = top_n
+        self.min_trades = min_trades
+        self.keep = keep
+        self.workers = workers or os.cpu_count() or 1
+        self.batch = batch
+        self.report = report or RunReport()
+
+    def _map(self, executor, rung, combos):
+        if executor is None:
+            return _run_batch(rung, combos, self.top_n)
+        chunks = [combos[i:i + self.batch] for i in range(0, len(combos), self.batch)]
+        return [r for part in executor.map(_run_batch, [rung] * len(chunks), chunks, [self.top_n] * len(chunks)) for r in part]
+
+    def run(self, combos):
+        """逐级评估: 每级按指标留前 keep (至少 1 组)，笔数不足的按抽样比例折算后淘汰；返回按指标排序的结果表"""
+        combos = list(dict.fromkeys([rules.DEFAULT] + list(combos)))  # 缺省参数总在里面，作为对照
+        key = METRICS[self.metric]
+        results = {p: {} for p in combos}
+        alive = combos
+        executor = ProcessPoolExecutor(self.workers, initializer=_init, initargs=(self.root,)) if self.workers > 1 else None
+        if executor is None: _init(self.root)
+        try:
+            for level, rung in enumerate(RUNGS):
+                with self.report.stage(f'rung_{rung}'):
+                    stats = self._map(executor, rung, alive)
+                for p, st in zip(alive, stats):
+                    results[p] = dict(st, 评估级别=level + 1)
+                if rung == RUNGS[-1]: break
+                ok = [p for p in alive if results[p]['已平仓笔数'] * rung >= self.min_trades and not np.isnan(results[p].get(key, np.nan))]
+                ok.sort(key=lambda p: -results[p][key])
+                survivors = ok[:max(1, int(np.ceil(len(alive) * self.keep)))]
+                self.report.drop(f'rung_{rung}', len(alive) - len(survivors), len(survivors))
+                alive = survivors
+        finally:
+            if executor is not None: executor.shutdown()
+        swept = [k for k in rules.PARAMS if len({getattr(p, k) for p in combos}) > 1]
+        rows = [{**{k: getattr(p, k) for k in swept}, '缺省参数': p == rules.DEFAULT, **results[p]} for p in combos]
+        table = pd.DataFrame(rows)
+        final = table['评估级别'] == len(RUNGS)
+        enough = table['已平仓笔数'] >= self.min_trades
+        table['_rank'] = np.where(final & enough, table.get(key, pd.Series(np.nan, index=table.index)), -np.inf)
+        table = table.sort_values(['评估级别', '_rank'], ascending=False, kind='stable').drop(columns='_rank')
+        self.best = combos[table.index[0]] if len(table) and final[table.index[0]] and enough[table.index[0]] else None
+        return table.reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    from providers import make_provider
+    from store import PriceStore
+    parser = argparse.ArgumentParser(description='打分参数寻优 (指标/形态缓存一次，参数组合并行回测)')
+    parser.add_argument('--store', default='price_store', help='本地行情仓库目录')
+    parser.add_argument('--cache', default='sweep_cache', help='因子缓存目录 (区间/持有期不变时复用)')
+    parser.add_argument('--rebuild', action='store_true', help='重建因子缓存')
+    parser.add_argument('--start', type=int, help='回测起始日 yyyymmdd')
+    parser.add_argument('--end', type=int, help='回测结束日 yyyymmdd')
+    parser.add_argument('--hold', type=int, default=20, help='最长持有天数 (同时是远期收益的持有期)')
+    parser.add_argument('--provider', choices=['akshare', 'replay'], help='取当前快照 (市盈率/市净率)')
+    parser.add_argument('--replay-dir', help='回放数据目录 (--provider replay)')
+    parser.add_argument('--grid', nargs='+', help='网格: 名=值1,值2 或 名=起:止:步长')
+    parser.add_argument('--random', type=int, help='随机搜索的组合数 (取值范围见 --space)')
+    parser.add_argument('--space', nargs='+', help='随机搜索: 名=下限:上限 或 名=值1,值2')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--metric', choices=list(METRICS), default='mean', help='排名指标')
+    parser.add_argument('--top-n', type=int, default=30, help='每天最多入选多少只')
+    parser.add_argument('--min-trades', type=int, default=100, help='平仓笔数不足的组合不参与排名')
+    parser.add_argument('--keep', type=float, default=0.25, help='每级评估后保留的比例')
+    parser.add_argument('--workers', type=int, default=None, help='进程数 (默认 CPU 核数)')
+    parser.add_argument('--out', default=None, help='输出 xlsx (默认 Sweep_<时间>.xlsx)')
+    args = parser.parse_args()
+
+    report = RunReport()
+    meta = cache_meta(args.cache)
+    wanted = {'start': args.start, 'end': args.end, 'hold': args.hold, 'horizon': args.hold}
+    if args.rebuild or not meta or any(meta.get(k) != v for k, v in wanted.items()):
+        provider = make_provider(args.provider, args.replay_dir) if args.provider else None
+        fundamentals = {}
+        if provider:
+            with report.stage('snapshot'):
+                spot = provider.spot()
+                for col in ['市盈率-动态', '市净率']:
+                    spot[col] = pd.to_numeric(spot[col], errors='coerce')
+                fundamentals = dict(zip(spot['代码'], zip(spot['市盈率-动态'], spot['市净率'])))
+        with report.stage('load'):
+            frames = BT.load_store(PriceStore(args.store))
+        print(f"构建因子缓存: {len(frames)} 只 -> {args.cache}")
+        meta = build_cache(frames, args.cache, fundamentals, args.start, args.end, args.hold, args.hold, report=report)
+    print(f"因子缓存: {meta['bars']} 根 K 线 / {meta['days']} 个交易日")
+
+    space = parse_space(args.space if args.random else args.grid)
+    combos = list(sample(space, args.random, args.seed) if args.random else grid(space))
+    print(f"参数组合: {len(combos)} 组，按 {METRICS[args.metric]} 排名")
+    sweep = Sweep(args.cache, args.metric, args.top_n, args.min_trades, args.keep, args.workers, report=report)
+    table = sweep.run(combos)
+    report.info.update(cache=meta, combos=len(combos), metric=args.metric)
+
+    stem = args.out[:-5] if args.out and args.out.endswith('.xlsx') else (args.out or f"Sweep_{time.strftime('%Y%m%d_%H%M%S')}")
+    with report.stage('export'):
+        with pd.ExcelWriter(f"{stem}.xlsx", engine='openpyxl') as writer:
+            table.round(4).to_excel(writer, sheet_name='参数排名', index=False)
+            pd.DataFrame([[k, v, d] for k, (v, d) in rules.PARAMS.items()],
+                         columns=['参数', '缺省值', '说明']).to_excel(writer, sheet_name='参数说明', index=False)
+    if sweep.best is not None:
+        rules.save_params(sweep.best, f"{stem}_best.json")
+        report.info['best'] = sweep.best._asdict()
+    report.save(f"{stem}.json")
+    print(table.head(10).round(3).to_string(index=False))
+    print(f"   环节耗时: {report.summary()}")
+    print(f"✅ 寻优结果已保存至: {stem}.xlsx" + (f"，最优参数: {stem}_best.json" if sweep.best is not None else ""))